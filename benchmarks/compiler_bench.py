@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+
+# Copyright 2018 Eotvos Lorand University, Budapest, Hungary
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks src/compiler.py on the examples listed in examples.cfg.
+
+Usage (from the root of the repository):
+
+    python benchmarks/compiler_bench.py [-p P4C] [-r REPEAT] [-o results.json] [example ...]
+
+Each program is compiled with an empty cache (cold) and then again with the filled cache (warm).
+For both modes, the wall time, the per-phase times (see the -profile option of the compiler),
+the peak RSS and the size of the generated files are recorded.
+
+    --save-baseline FILE  saves the results as a baseline
+    --baseline FILE       compares the results to the baseline; the exit code is 1 on regression
+    --time-threshold PCT, --mem-threshold PCT
+                          the allowed slowdown and memory growth (in percent)
+
+Offline runs: with --record, the JSON output of the real p4c is saved into the replay directory,
+and --replay uses benchmarks/fake_p4c instead of p4c, which returns the recorded JSON files.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from os.path import join
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+fake_p4c_dir = join(bench_dir, "fake_p4c")
+default_replay_dir = join(bench_dir, "replay")
+
+
+def read_examples_cfg(filename):
+    """Returns the example names from the configuration file, in order, without duplicates."""
+    names = []
+    with open(filename, "r") as infile:
+        for line in infile:
+            line = re.sub(r';.*', '', line).strip()
+            if line == "":
+                continue
+            name = line.split()[0].split('@')[0]
+            if name not in names:
+                names.append(name)
+    return names
+
+
+def find_source(name, examples_dir="examples"):
+    """Returns the P4 source of the example and its P4 version."""
+    for ext, p4v in ((".p4", 16), (".p4_14", 14)):
+        for dirpath, _, filenames in os.walk(examples_dir):
+            if name + ext in filenames:
+                return join(dirpath, name + ext), p4v
+    return None, None
+
+
+def record_json(p4_file, p4v, p4c_path, replay_dir):
+    """Runs the real P4 frontend and saves its JSON output for later replays."""
+    if not os.path.isdir(replay_dir):
+        os.makedirs(replay_dir)
+
+    p4test = join(p4c_path, "build", "p4test")
+    json_file = join(replay_dir, os.path.basename(p4_file) + ".json")
+    return subprocess.call([p4test, p4_file, "-I", join(p4c_path, "p4include"), "--toJSON", json_file, "--p4v", str(p4v)]) == 0
+
+
+def directory_sizes(dirname):
+    sizes = {}
+    for fname in sorted(os.listdir(dirname)):
+        if os.path.isfile(join(dirname, fname)):
+            sizes[fname] = os.path.getsize(join(dirname, fname))
+    return sizes
+
+
+def flatten_phases(phases):
+    """Gives a unique name to each phase by prefixing it with the names of the enclosing phases."""
+    flat = {}
+    stack = []
+    for phase in phases:
+        del stack[phase['depth']:]
+        stack.append(phase['name'])
+        flat["/".join(stack)] = phase['wall']
+    return flat
+
+
+def compile_once(p4_file, p4v, p4c_path, work_dir, cache_dir, env):
+    """Runs the compiler in a separate process, returns its measurements."""
+    profile_dir = join(work_dir, "profile")
+    generated_dir = join(work_dir, "srcgen")
+    for dirname in (profile_dir, generated_dir):
+        if os.path.isdir(dirname):
+            shutil.rmtree(dirname)
+
+    cmd = [sys.executable, "-B", "src/compiler.py", p4_file, "--p4v", str(p4v), "-p", p4c_path,
+           "-g", generated_dir, "-desugared_path", join(work_dir, "desugared"),
+           "-cache_dir", cache_dir, "-profile", "-profile_dir", profile_dir]
+
+    with open(os.devnull, "w") as devnull:
+        start = time.time()
+        proc = subprocess.Popen(cmd, stdout=devnull, env=env)
+        _, status, rusage = os.wait4(proc.pid, 0)
+        wall = time.time() - start
+
+    if status != 0:
+        return None
+
+    with open(join(profile_dir, os.path.basename(p4_file) + ".json"), "r") as infile:
+        profile = json.load(infile)
+
+    sizes = directory_sizes(generated_dir)
+    return {
+        'wall': wall,
+        'cpu': rusage.ru_utime + rusage.ru_stime,
+        'maxrss_kb': rusage.ru_maxrss,
+        'phases': flatten_phases(profile['phases']),
+        'output_bytes': sum(sizes.values()),
+        'output_files': sizes,
+    }
+
+
+def best_of(runs):
+    """The fastest run, with the smallest memory usage of all runs."""
+    best = min(runs, key=lambda r: r['wall'])
+    best['maxrss_kb'] = min(r['maxrss_kb'] for r in runs)
+    return best
+
+
+def bench_example(p4_file, p4v, p4c_path, repeat, env):
+    """Returns the cold and warm measurements of the example."""
+    work_dir = tempfile.mkdtemp(prefix="t4p4s-bench-")
+    try:
+        cold_runs = []
+        warm_runs = []
+        for _ in range(repeat):
+            cache_dir = join(work_dir, "cache")
+            if os.path.isdir(cache_dir):
+                shutil.rmtree(cache_dir)
+
+            cold_runs.append(compile_once(p4_file, p4v, p4c_path, work_dir, cache_dir, env))
+            warm_runs.append(compile_once(p4_file, p4v, p4c_path, work_dir, cache_dir, env))
+
+        if None in cold_runs + warm_runs:
+            return None
+        return {'cold': best_of(cold_runs), 'warm': best_of(warm_runs)}
+    finally:
+        shutil.rmtree(work_dir)
+
+
+def compare(results, baseline, time_threshold, mem_threshold, min_time):
+    """Returns the list of regressions compared to the baseline."""
+    regressions = []
+
+    def check(what, value, base, threshold, floor=0):
+        if base is None or value <= floor:
+            return
+        if value > base * (1 + threshold / 100.0):
+            regressions.append("{}: {:.3f} -> {:.3f} (+{:.1f}%)".format(what, base, value, 100.0 * (value - base) / max(base, 1e-9)))
+
+    for example in sorted(results):
+        if example not in baseline:
+            continue
+        for mode in ('cold', 'warm'):
+            res, base = results[example][mode], baseline[example][mode]
+            prefix = "{} ({})".format(example, mode)
+
+            check(prefix + " wall time", res['wall'], base['wall'], time_threshold, min_time)
+            check(prefix + " peak RSS (kB)", res['maxrss_kb'], base['maxrss_kb'], mem_threshold)
+            for phase, wall in sorted(res['phases'].items()):
+                check("{} phase '{}'".format(prefix, phase), wall, base['phases'].get(phase), time_threshold, min_time)
+
+            if res['output_bytes'] != base['output_bytes']:
+                print("Note: {} output size changed: {} -> {} bytes".format(prefix, base['output_bytes'], res['output_bytes']))
+
+    return regressions
+
+
+def print_results(results):
+    print("{:<32} {:>10} {:>10} {:>12} {:>12} {:>12}".format("example", "cold (s)", "warm (s)", "cold RSS kB", "warm RSS kB", "output kB"))
+    for example in sorted(results):
+        cold, warm = results[example]['cold'], results[example]['warm']
+        print("{:<32} {:>10.3f} {:>10.3f} {:>12} {:>12} {:>12}".format(
+            example, cold['wall'], warm['wall'], cold['maxrss_kb'], warm['maxrss_kb'], warm['output_bytes'] // 1024))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='T4P4S compiler benchmark')
+    parser.add_argument('examples', nargs='*', help='The examples to measure (default: all in examples.cfg)')
+    parser.add_argument('-c', '--config', help='The examples configuration file', default="examples.cfg")
+    parser.add_argument('-p', '--p4c_path', help='P4C path', default=os.environ.get('P4C'))
+    parser.add_argument('-r', '--repeat', help='The number of runs per mode, the best one is reported', type=int, default=3)
+    parser.add_argument('-o', '--output', help='Save the results into this JSON file')
+    parser.add_argument('--baseline', help='Compare the results to this baseline')
+    parser.add_argument('--save-baseline', help='Save the results as a baseline')
+    parser.add_argument('--time-threshold', help='Allowed slowdown in percent', type=float, default=10.0)
+    parser.add_argument('--mem-threshold', help='Allowed growth of peak memory in percent', type=float, default=10.0)
+    parser.add_argument('--min-time', help='Times below this (in seconds) are not considered regressions', type=float, default=0.05)
+    parser.add_argument('--record', help='Save the JSON output of the real p4c into the replay directory', action='store_true')
+    parser.add_argument('--replay', help='Use the recorded JSON files instead of the real p4c', action='store_true')
+    parser.add_argument('--replay-dir', help='Directory of the recorded JSON files', default=default_replay_dir)
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    p4c_path = args.p4c_path
+    if args.replay:
+        p4c_path = fake_p4c_dir
+        env['T4P4S_REPLAY_DIR'] = os.path.abspath(args.replay_dir)
+
+    if p4c_path is None:
+        print("P4C is not set, use -p or --replay", file=sys.stderr)
+        sys.exit(1)
+
+    results = {}
+    for example in args.examples or read_examples_cfg(args.config):
+        p4_file, p4v = find_source(example)
+        if p4_file is None:
+            print("Skipping {}: source not found".format(example), file=sys.stderr)
+            continue
+
+        if args.record and not record_json(p4_file, p4v, args.p4c_path, args.replay_dir):
+            print("Skipping {}: p4c failed".format(example), file=sys.stderr)
+            continue
+
+        result = bench_example(p4_file, p4v, p4c_path, args.repeat, env)
+        if result is None:
+            print("Skipping {}: compilation failed".format(example), file=sys.stderr)
+            continue
+        results[example] = result
+
+    print_results(results)
+
+    for filename in (args.output, args.save_baseline):
+        if filename is not None:
+            with open(filename, "w") as outf:
+                json.dump(results, outf, indent=4, sort_keys=True)
+
+    if args.baseline is not None:
+        with open(args.baseline, "r") as infile:
+            baseline = json.load(infile)
+
+        regressions = compare(results, baseline, args.time_threshold, args.mem_threshold, args.min_time)
+        for regression in regressions:
+            print("REGRESSION: " + regression, file=sys.stderr)
+        if regressions != []:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+# Copyright 2018 Eotvos Lorand University, Budapest, Hungary
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks the translation of the sugared syntax (src/desugar.py)
+on src/utils/codegen.sugar.py and the templates in src/hardware_indep.
+
+Usage (from the root of the repository):
+
+    python benchmarks/desugar_bench.py [-r REPEAT] [--compare OLD_COMPILER_PY]
+
+With --compare, the translator of an older version of the compiler is measured as well,
+and its output is checked to be identical to the output of the current translator, e.g.
+
+    git show <commit>:src/compiler.py > /tmp/old_compiler.py
+    python benchmarks/desugar_bench.py --compare /tmp/old_compiler.py
+
+The exit code is 1 if the outputs differ.
+"""
+
+from __future__ import print_function
+
+import argparse
+import glob
+import imp
+import os
+import sys
+import time
+
+sys.path.insert(0, "src")
+
+import desugar
+
+
+def get_files():
+    """The sugared files, and whether line numbers are added to their desugared form."""
+    files = [(f, False) for f in sorted(glob.glob("src/utils/*.sugar.py"))]
+    files += [(f, True) for f in sorted(glob.glob("src/hardware_indep/*.py"))]
+    return files
+
+
+def prefix_lines_of(add_lines):
+    return "" if add_lines else "generated_code = \"\"\n"
+
+
+def measure(translate, repeat):
+    """The best time of the function in seconds, and its result."""
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        result = translate()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def load_legacy(filename, desugar_info):
+    """Imports an older compiler.py, which has translate_file_contents that reads the global args."""
+    legacy = imp.load_source("legacy_compiler", filename)
+    legacy.args = {'desugar_info': desugar_info}
+    return legacy
+
+
+def main():
+    parser = argparse.ArgumentParser(description='T4P4S desugaring benchmark')
+    parser.add_argument('-r', '--repeat', help='The number of runs per file, the best one is reported', type=int, default=20)
+    parser.add_argument('-d', '--desugar_info', help='Markings in the generated source code', default="comment", choices=["comment", "pragma", "none"])
+    parser.add_argument('--compare', help='Also measure the translator of this (older) compiler.py')
+    args = parser.parse_args()
+
+    legacy = load_legacy(args.compare, args.desugar_info) if args.compare is not None else None
+
+    print("{:<40} {:>8} {:>12} {:>12} {:>8}".format("file", "lines", "time (ms)", "legacy (ms)", "speedup"))
+
+    total_time, total_legacy_time, total_lines = 0.0, 0.0, 0
+    mismatches = []
+    for filename, add_lines in get_files():
+        with open(filename, "r") as infile:
+            code = infile.read()
+        prefix_lines = prefix_lines_of(add_lines)
+        lines = len(code.splitlines())
+
+        elapsed, output = measure(lambda: desugar.translate_file_contents(filename, code, args.desugar_info, prefix_lines=prefix_lines, add_lines=add_lines), args.repeat)
+        total_time += elapsed
+        total_lines += lines
+
+        if legacy is None:
+            print("{:<40} {:>8} {:>12.3f}".format(filename, lines, 1000 * elapsed))
+            continue
+
+        legacy_elapsed, legacy_output = measure(lambda: legacy.translate_file_contents(filename, code, prefix_lines=prefix_lines, add_lines=add_lines), args.repeat)
+        total_legacy_time += legacy_elapsed
+        if output != legacy_output:
+            mismatches.append(filename)
+
+        print("{:<40} {:>8} {:>12.3f} {:>12.3f} {:>7.2f}x".format(filename, lines, 1000 * elapsed, 1000 * legacy_elapsed, legacy_elapsed / max(elapsed, 1e-9)))
+
+    print()
+    print("Total: {} lines in {:.3f} ms ({:.0f} lines/s)".format(total_lines, 1000 * total_time, total_lines / max(total_time, 1e-9)))
+    if legacy is not None:
+        print("Legacy: {:.3f} ms, speedup {:.2f}x".format(1000 * total_legacy_time, total_legacy_time / max(total_time, 1e-9)))
+
+    for filename in mismatches:
+        print("MISMATCH: the desugared output of {} differs".format(filename), file=sys.stderr)
+    if mismatches != []:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
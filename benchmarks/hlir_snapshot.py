@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+
+# Copyright 2018 Eotvos Lorand University, Budapest, Hungary
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compares the dill pickled HLIR with the binary HLIR snapshot.
+
+Usage (from the root of the repository):
+
+    python benchmarks/hlir_snapshot.py [-p P4C] [-r REPEAT] [examples/*.p4]
+
+For each program, both files are written into a temporary directory,
+then they are loaded in fresh processes, measuring the load time and the peak RSS.
+The snapshot is measured both when only the root node is touched (lazy)
+and when all nodes are walked through (full).
+"""
+
+from __future__ import print_function
+
+import argparse
+import glob
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from os.path import join
+
+src_dir = join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, src_dir)
+
+
+def walk_all(root):
+    """Touches all nodes that are reachable from the root."""
+    from hlir16.p4node import P4Node
+
+    seen = set()
+    todo = [root]
+    while todo:
+        value = todo.pop()
+        if isinstance(value, P4Node):
+            if id(value) in seen:
+                continue
+            seen.add(id(value))
+            todo.extend(value.__dict__.values())
+        elif type(value) in (list, tuple, set, frozenset):
+            todo.extend(value)
+        elif type(value) is dict:
+            todo.extend(value.values())
+    return len(seen)
+
+
+def measure(mode, filename):
+    """Runs in the child process: loads the file and prints the elapsed time and the peak RSS."""
+    from hlir16.p4node import P4Node
+
+    start = time.time()
+    if mode == 'pickle':
+        import dill
+        import pickle
+        sys.setrecursionlimit(10000)
+        with open(filename, 'rb') as inf:
+            hlir = pickle.load(inf)
+        hlir.__dict__
+    elif mode in ('lazy', 'full'):
+        from snapshot_hlir16 import load_snapshot
+        hlir = load_snapshot(filename)
+        hlir.__dict__
+        if mode == 'full':
+            walk_all(hlir)
+    elapsed = time.time() - start
+
+    print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+def run_child(mode, filename):
+    out = subprocess.check_output([sys.executable, "-B", __file__, "--measure", mode, filename])
+    elapsed, maxrss = out.split()
+    return float(elapsed), int(maxrss)
+
+
+def best_of(repeat, mode, filename):
+    results = [run_child(mode, filename) for _ in range(repeat)]
+    return min(t for t, _ in results), min(rss for _, rss in results)
+
+
+def prepare(p4_file, p4c_path, tmp_dir):
+    """Returns the size of the pickled and the snapshot file."""
+    import dill
+    import pickle
+    from hlir16.hlir16 import load_p4
+    from transform_hlir16 import transform_hlir16
+    from snapshot_hlir16 import save_snapshot
+
+    p4v = 14 if p4_file.endswith(".p4_14") else 16
+    hlir = load_p4(p4_file, p4v, p4c_path, tmp_dir)
+    if type(hlir) is int:
+        return None
+
+    transform_hlir16(hlir)
+
+    sys.setrecursionlimit(10000)
+    with open(join(tmp_dir, "hlir.pickled"), 'wb') as outf:
+        pickle.dump(hlir, outf)
+    save_snapshot(hlir, join(tmp_dir, "hlir.snapshot"))
+
+    return walk_all(hlir), os.path.getsize(join(tmp_dir, "hlir.pickled")), os.path.getsize(join(tmp_dir, "hlir.snapshot"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='HLIR pickle vs snapshot benchmark')
+    parser.add_argument('p4_files', nargs='*', help='The P4 programs to measure (default: examples/*.p4)')
+    parser.add_argument('-p', '--p4c_path', help='P4C path', default=os.environ.get('P4C'))
+    parser.add_argument('-r', '--repeat', help='The number of loads, the best one is reported', type=int, default=3)
+    parser.add_argument('--measure', nargs=2, metavar=('MODE', 'FILE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(*args.measure)
+        return
+
+    p4_files = args.p4_files or sorted(glob.glob("examples/*.p4"))
+
+    print("{:<32} {:>7} {:>9} {:>9} {:>24} {:>24} {:>24} {:>24}".format(
+        "program", "nodes", "pickle kB", "snap kB", "empty s/RSS kB", "pickle s/RSS kB", "snapshot lazy s/RSS kB", "snapshot full s/RSS kB"))
+
+    for p4_file in p4_files:
+        tmp_dir = tempfile.mkdtemp(prefix="t4p4s-bench-")
+        try:
+            sizes = prepare(p4_file, args.p4c_path, tmp_dir)
+            if sizes is None:
+                print("{:<32} compilation failed".format(os.path.basename(p4_file)))
+                continue
+
+            node_count, pickle_size, snapshot_size = sizes
+            results = [
+                best_of(args.repeat, 'empty', p4_file),
+                best_of(args.repeat, 'pickle', join(tmp_dir, "hlir.pickled")),
+                best_of(args.repeat, 'lazy', join(tmp_dir, "hlir.snapshot")),
+                best_of(args.repeat, 'full', join(tmp_dir, "hlir.snapshot")),
+            ]
+
+            print("{:<32} {:>7} {:>9} {:>9} {}".format(
+                os.path.basename(p4_file), node_count, pickle_size // 1024, snapshot_size // 1024,
+                " ".join("{:>24}".format("{:.3f} / {}".format(t, rss)) for t, rss in results)))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -18,7 +18,18 @@ from __future__ import print_function
 import argparse
 from hlir16.hlir16 import *
 from utils.misc import *
+from utils import timing
+from utils.emitter import FileEmitter, file_has_digest
+from utils.postopt import PostOptimizer
 from transform_hlir16 import *
+from index_hlir16 import index_hlir16
+from liveness_hlir16 import mark_live_fields
+from static_tables_hlir16 import mark_static_tables
+from key_sharing_hlir16 import mark_shared_keys
+from cost_hlir16 import get_cost_report, format_cost_report, format_cost_report_json
+import desugar
+from snapshot_hlir16 import load_snapshot_with_paths, save_snapshot, SnapshotError
+from deps_hlir16 import DependencyRecorder, get_node_paths, reads_unchanged
 
 from subprocess import call
 
@@ -26,7 +37,6 @@ import re
 import os
 import sys
 import traceback
-import pkgutil
 from os.path import isfile, join
 
 
@@ -38,234 +48,130 @@ cache_dir_name = "build/.cache"
 args = []
 hlir = None
 
-indentation_level = 0
-
 
 def verbose_print(*txts):
     if args['verbose']:
         print(*txts)
 
 
-def translate_line_with_insert(file, line_idx, line, indent_str):
-    """Gets a line that contains an insert
-       and transforms it to a Python code section."""
-    # since Python code is generated, indentation has to be respected
-    indentation = re.sub(r'^([ \t]*)#[\[\{\}].*$', r'\1', line)
-
-    global indentation_level
-    pre_indentation_mod = ""
-    post_indentation_mod = ""
-    # #{ unindents starting this line
-    if '#}' in line:
-        if indentation_level == 0:
-            addError("Compiler", "Too much unindent in {}:{}".format(file, line_idx))
-        indentation_level -= 1
-        pre_indentation_mod = indentation + "file_indentation_level -= 1\n"
-
-    # #{ starts a new indentation level from the next line
-    if '#{' in line:
-        indentation_level += 1
-        post_indentation_mod = "\n" + indentation + "file_indentation_level += 1"
-
-    # get the #[ (or #{, or #}) part
-    content = re.sub(r'^[ \t]*#[\[\{\}]([ \t]*[^\n]*)[ \t]*', r'\1', line)
-    # escape sequences like \n may appear in #[ parts
-    content = re.sub(r'\\', r'\\\\', content)
-    # quotes may appear in #[ parts
-    content = re.sub(r'"', r'\"', content)
-
-    def replacer(m):
-        light = m.group("light")
-        txt1  = m.group('text1') or ''
-        expr  = m.group('expr')
-        txt2  = m.group('text2') or ''
-
-        # no highlighting
-        if m.group("type") == '$':
-            return '{}" + str({}) + "{}'.format(txt1, expr, txt2)
-
-        light_param = "," + light if light not in (None, "") else ""
-        return '\\" T4LIT({}" + str({}) + "{}{}) \\"'.format(txt1, expr, txt2, light_param)
-
-    # replace $$[light][text1]{expr}{text2} inserts, where all parts except {expr} are optional
-    content = re.sub(r'(?P<type>\$\$?)(\[(?P<light>[^\]]+)\])?(\[(?P<text1>[^\]]+)\])?{\s*(?P<expr>[^}]*)\s*}({(?P<text2>[^}]+)})?',
-                     replacer, content)
-
-    # replace $var inserts
-    content = re.sub(r'\$([a-zA-Z0-9_]*)', r'" + str(\1) + "', content)
-    # trim the line
-    content = content.strip()
-
-    # add a comment that shows where the line is generated at
-    is_nonempty_line = bool(content.strip())
-    if is_nonempty_line and line_idx is not None:
-        if args['desugar_info'] == "comment":
-            content += '" + sugar("{}", {}) + "'.format(os.path.basename(file), line_idx)
-        if args['desugar_info'] == "pragma":
-            content = '#line %d \\"%s\\"\\n%s' % (line_idx, "../../" + file, content)
-
-    return '{}{}generated_code += indent() + "{}"{}'.format(pre_indentation_mod, indentation, content, post_indentation_mod)
-
-
-def increase(idx):
-    if idx is None:
-        return None
-    return idx + 1
-
-
-def add_empty_lines(code_lines):
-    """Returns an enumerated list of the lines.
-    When an empty line separates follows an escaped code part,
-    an empty line is inserted into the generated list with None as line number."""
-    new_lines = []
-    is_block_with_sequence = False
-    last_indent = 0
-    already_added = False
-    for idx, line in code_lines:
-        if "#[" in line:
-            is_block_with_sequence = True
-
-        if not line.strip() and last_indent == 0 and not already_added:
-            new_lines.append((idx, line))
-            new_lines.append((None, "#["))
-            last_indent = 0
-            already_added = True
-        else:
-            if not line.strip():
-                continue
-            new_lines.append((increase(idx), line))
-            last_indent = len(line) - len(line.lstrip())
-            already_added = False
-
-    return new_lines
-
-
-def add_gen_in_def(code_lines, orig_file):
-    """If a function's name starts with 'gen_' in a generated file,
-    that function produces code.
-    This is a helper function that initialises and returns the appropriate variable.
-    Also, if "return" is encountered on a single line,
-    the requisite return value is inserted."""
-    new_lines = []
-    is_inside_gen = False
-    for idx, line in code_lines:
-        if is_inside_gen:
-            if re.match(r'^[ \t]*return[ \t]*$', line):
-                line = re.sub(r'^([ \t]*)return[ \t]*$', r'\1return generated_code', line)
-
-            is_separator_line  = re.match(r'^#[ \t]*([^ \t])\1\1*', line)
-            is_method_line     = re.sub(r'[ \t]*#.*', '', line).strip() != "" and line.lstrip() == line
-            is_unindented_line = re.match(r'^[^ \t]', line)
-            if is_separator_line or is_method_line or is_unindented_line:
-                new_lines.append((None, '    return generated_code'))
-                new_lines.append((None, ''))
-                is_inside_gen = False
-
-        if line.startswith('def gen_'):
-            new_lines.append((idx, line))
-            new_lines.append((None, '    generated_code = ""'))
-            is_inside_gen = True
-            continue
-
-        new_lines.append((idx, line))
+def translate_file_contents(file, code, indent_str="    ", prefix_lines="", add_lines=True):
+    """Returns the code transformed into runnable Python code (see desugar.py)."""
+    return desugar.translate_file_contents(file, code, args['desugar_info'], indent_str, prefix_lines, add_lines)
 
-    if is_inside_gen:
-        new_lines.append((None, '    return generated_code'))
-        new_lines.append((None, ''))
 
-    return new_lines
+template_cache_stats = {'hits': 0, 'misses': 0}
+# the totals of the caches of the formatting functions in utils/codegen.sugar.py
+format_cache_stats = {}
+# the totals of the post-optimizer, see utils/postopt.py
+postopt_stats = {}
+translator_digest = None
+loaded_templates = {}
 
 
-def translate_file_contents(file, code, indent_str="    ", prefix_lines="", add_lines=True):
-    """Returns the code transformed into runnable Python code.
-       Translated are #[generated_code, #=generator_expression and ${var} constructs."""
-    has_translatable_comment = re.compile(r'^[ \t]*#[\[\{\}][ \t]*.*$')
+def get_translator_digest():
+    """The cached translations become invalid if the translator itself changes."""
+    global translator_digest
+    if translator_digest is None:
+        import hashlib
+        digest = hashlib.sha1()
+        for source_file in (__file__, desugar.__file__):
+            with open(re.sub(r'[.]pyc$', '.py', source_file), "rb") as infile:
+                digest.update(infile.read())
+        translator_digest = digest.hexdigest()
+    return translator_digest
 
-    global indentation_level
-    indentation_level = 0
 
-    new_lines = prefix_lines.splitlines()
-    new_lines += """
-# Autogenerated file (from {0}), do not modify directly.
-# Generator: T4P4S (https://github.com/P4ELTE/t4p4s/)
+def get_template_cache_file(file, code, prefix_lines, add_lines):
+    import hashlib
+    key = hashlib.sha1()
+    for part in (sys.version, get_translator_digest(), args['desugar_info'], file, prefix_lines, str(add_lines), code):
+        key.update(part)
+        key.update("\0")
+    return join(cache_dir_name, "templates", key.hexdigest() + ".marshal")
 
-global file_indentation_level
-file_indentation_level = 0
 
-# The last element is the innermost (current) style.
-file_sugar_style = ['line_comment']
+def load_cached_template(cache_file):
+    import marshal
 
+    if not os.path.isfile(cache_file):
+        return None
 
-def indent():
-    global file_indentation_level
-    return '{1}' * file_indentation_level
-
+    try:
+        with open(cache_file, "rb") as infile:
+            return marshal.load(infile)
+    except (EOFError, ValueError, TypeError):
+        return None
 
-class SugarStyle():
-    def __init__(self, sugar):
-        global file_sugar_style
-        file_sugar_style.append(sugar)
 
-    def __enter__(self):
-        global file_sugar_style
-        return file_sugar_style[-1]
+def save_cached_template(cache_file, source, compiled):
+    import marshal
+    import tempfile
 
-    def __exit__(self, type, value, traceback):
-        global file_sugar_style
-        file_sugar_style.pop()
+    cache_dir = os.path.dirname(cache_file)
+    if not os.path.isdir(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            # another process may have created it meanwhile
+            pass
 
+    fd, tmpname = tempfile.mkstemp(dir=cache_dir)
+    with os.fdopen(fd, "wb") as outf:
+        marshal.dump((source, compiled), outf)
+    os.rename(tmpname, cache_file)
 
-def sugar(file, line):
-    import re
-    global file_sugar_style
-    sugar_file = re.sub("[.].*$", "", file)
-    if file_sugar_style[-1] == 'line_comment':
-        # if file == "{2}":
-        #     return ' // @' + str(line) + '\\n'
-        return ' // ' + sugar_file + '@' + str(line) + '\\n'
-    if file_sugar_style[-1] == 'inline_comment':
-        # if file == "{2}":
-        #     return '\\n/* @' + str(line) + '*/'
-        return '\\n/* ' + sugar_file + '@' + str(line) + '*/'
-    return ''
 
+def translate_and_compile(file, code, genfile, prefix_lines="", add_lines=True):
+    """Returns the desugared source of the file and its compiled code object.
+    Both are cached in the template cache, keyed by the contents of the file.
+    The code object is None if the desugared source cannot be compiled.
+    In batch mode, the results are also kept in memory for the following programs."""
+    memory_key = (file, code, genfile, prefix_lines, add_lines, args['desugar_info'])
+    if memory_key in loaded_templates:
+        template_cache_stats['hits'] += 1
+        return loaded_templates[memory_key]
 
-""".format(file, indent_str, os.path.basename(file)).splitlines()
+    cache_file = get_template_cache_file(file, code, prefix_lines, add_lines) if cache_dir_name else None
 
-    code_lines = enumerate(code.splitlines())
-    code_lines = add_gen_in_def(code_lines, file)
-    if add_lines:
-        code_lines = add_empty_lines(code_lines)
+    if cache_file is not None:
+        cached = load_cached_template(cache_file)
+        if cached is not None:
+            template_cache_stats['hits'] += 1
+            loaded_templates[memory_key] = cached
+            return cached
 
-    for idx, code_line in code_lines:
-        new_line = code_line
-        if has_translatable_comment.match(code_line):
-            new_line = translate_line_with_insert(file, idx, code_line, indent_str)
-        elif re.match(r'^[ \t]*#= .*$', code_line):
-            new_line = re.sub(r'^([ \t]*)#=(.*)$', r'\1generated_code += str(\2)', code_line)
+    template_cache_stats['misses'] += 1
 
-            if args['desugar_info'] == "comment":
-                sugar_filename = os.path.basename(file)
-                sugar_filename = re.sub("([.]sugar)?[.]py", "", sugar_filename)
-                new_line += " # {}@{}".format(sugar_filename, idx)
+    error_count = len(errors)
+    source = translate_file_contents(file, code, prefix_lines=prefix_lines, add_lines=add_lines)
 
-        new_lines.append(new_line)
+    try:
+        compiled = compile(source, genfile, 'exec')
+    except SyntaxError:
+        # the error is reported when the source is executed
+        return (source, None)
 
-    if indentation_level != 0:
-        addError("Compiler", "Non-zero indentation level ({}) at end of file: {}".format(indentation_level, file))
+    if len(errors) == error_count:
+        loaded_templates[memory_key] = (source, compiled)
+        if cache_file is not None:
+            save_cached_template(cache_file, source, compiled)
 
-    return '\n'.join(new_lines)
+    return (source, compiled)
 
 
-def generate_code(file, genfile, localvars={}):
+def generate_code(file, genfile, outfile, localvars={}, optimizer=None):
     """The file contains Python code with #[ inserts.
        The comments (which have to be indented properly)
        contain code to be output,
-       their contents are collected in the variable generated_code.
-       Inside the comments, refer to Python variables as ${variable_name}."""
+       their contents are collected in the variable generated_code,
+       which streams them into outfile.
+       Inside the comments, refer to Python variables as ${variable_name}.
+       If an optimizer is given, the output is optimized while it is streamed.
+       Returns the digest of the output."""
     with open(file, "r") as orig_file:
         code = orig_file.read()
-        code = translate_file_contents(file, code)
+        with timing.phase("translate"):
+            code, compiled = translate_and_compile(file, code, genfile)
 
         if generate_code_files:
             write_file(genfile, code)
@@ -275,10 +181,12 @@ def generate_code(file, genfile, localvars={}):
             print(code)
             print(file + " *************************************************")
 
-        localvars['generated_code'] = ""
+        emitter = FileEmitter(outfile, optimizer=optimizer)
+        localvars['generated_code'] = emitter
 
         try:
-            exec(code, localvars, localvars)
+            with timing.phase("exec"), timing.cprofile(os.path.basename(file)):
+                exec(compiled or code, localvars, localvars)
         except Exception as exc:
             # exc_type, exc, tb = sys.exc_info()
             if hasattr(exc, 'lineno'):
@@ -289,9 +197,14 @@ def generate_code(file, genfile, localvars={}):
                 print("Error: cannot compile file {}".format(genfile), file=sys.stderr)
                 print("Exception: {}".format(str(exc)), file=sys.stderr)
                 traceback.print_exc(file=sys.stderr)
+                emitter.discard()
                 raise
 
-        return re.sub(r'\n{3,}', '\n\n', localvars['generated_code'])
+        emitter.close()
+        if optimizer is not None:
+            for k in optimizer.stats:
+                postopt_stats[k] = postopt_stats.get(k, 0) + optimizer.stats[k]
+        return emitter.hexdigest()
 
 
 def generate_desugared_py():
@@ -303,7 +216,7 @@ def generate_desugared_py():
         with open(fromfile, "r") as orig_file:
             code = orig_file.read()
             prefix_lines = "generated_code = \"\"\n"
-            code = translate_file_contents(fromfile, code, prefix_lines=prefix_lines, add_lines=False)
+            code, _ = translate_and_compile(fromfile, code, tofile, prefix_lines=prefix_lines, add_lines=False)
 
             write_file(tofile, code)
 
@@ -316,15 +229,163 @@ def get_hlir():
     return hlir
 
 
+def reset_codegen_state(hlir_index=None):
+    """The code generator helpers keep some state (variable name counters, type environment etc.)
+    while a file is generated. It is reset before each file
+    so that the output does not depend on the order in which the files are generated.
+    The helpers get the index of the HLIR for their lookups."""
+    codegen = sys.modules.get('utils.codegen')
+    if codegen is None and hlir_index is not None:
+        import utils.codegen as codegen
+    if codegen is not None:
+        codegen.reset_state(hlir_index)
+
+
+def get_constant_tables(hlir):
+    """The contents of the constant tables of parser.h that the post-optimizer can fold."""
+    byte_widths = {}
+    byte_widths_summed = {}
+    total = 0
+    for hdr in hlir.header_instances:
+        total += hdr.type.type_ref.byte_width
+        byte_widths['header_instance_' + hdr.name] = hdr.type.type_ref.byte_width
+        byte_widths_summed['header_instance_' + hdr.name] = total
+
+    return {
+        'header_instance_byte_width': byte_widths,
+        'header_instance_byte_width_summed': byte_widths_summed,
+    }
+
+
+def get_post_optimizer(hlir, outfile):
+    """The post-optimizer of the generated C code, if it is enabled."""
+    if args['no_postopt'] or not outfile.endswith(".c"):
+        return None
+
+    return PostOptimizer(get_constant_tables(hlir))
+
+
 def generate_desugared_c(filename, filepath):
     hlir = get_hlir()
 
-    genfile = join(args['desugared_path'], re.sub(r'\.([ch])\.py$', r'.\1.desugared.py', filename))
-    code = generate_code(filepath, genfile, {'hlir16': hlir})
+    reset_codegen_state(hlir.index)
+
+    genfile = get_desugared_file(filename)
+    outfile = get_output_file(filename)
+
+    if not args['incremental']:
+        with timing.phase("template " + filename):
+            generate_code(filepath, genfile, outfile, {'hlir16': hlir}, get_post_optimizer(hlir, outfile))
+        return
+
+    error_count, warning_count = len(errors), len(warnings)
+    with timing.phase("template " + filename):
+        with DependencyRecorder(node_paths) as recorder:
+            output_digest = generate_code(filepath, genfile, outfile, {'hlir16': hlir}, get_post_optimizer(hlir, outfile))
+
+    # templates that report problems are always run again, so that they report them again
+    if len(errors) == error_count and len(warnings) == warning_count:
+        save_dependencies(filename, output_digest, recorder.get_reads())
+    elif os.path.isfile(get_deps_file(filename)):
+        os.remove(get_deps_file(filename))
+
+
+def get_desugared_file(filename):
+    return join(args['desugared_path'], re.sub(r'\.([ch])\.py$', r'.\1.desugared.py', filename))
+
+
+def get_output_file(filename):
+    return join(args['generated_dir'], re.sub(r'\.([ch])\.py$', r'.\1', filename))
+
+
+node_paths = None
+nodes_by_path = None
+environment_key = None
 
-    outfile = join(args['generated_dir'], re.sub(r'\.([ch])\.py$', r'.\1', filename))
 
-    write_file(outfile, code)
+def get_deps_file(filename):
+    return join(args['generated_dir'], ".deps", filename + ".json")
+
+
+def get_environment_key():
+    """The output of all templates depends on the compiler, the code generator helpers
+    and the code that builds the HLIR."""
+    global environment_key
+    if environment_key is None:
+        import glob
+
+        parts = [sys.version, "p4v={}".format(args['p4v']), args['desugar_info'], "no_postopt={}".format(args['no_postopt'])]
+        own_files = [__file__, desugar.__file__, sys.modules['deps_hlir16'].__file__, sys.modules['snapshot_hlir16'].__file__]
+        own_files = [re.sub(r'[.]pyc$', '.py', f) for f in own_files]
+        for source_file in own_files + sorted(glob.glob("src/utils/*.py")) + get_compiler_sources():
+            with open(source_file, "r") as infile:
+                parts += [source_file, infile.read()]
+        environment_key = hash_parts(parts)
+    return environment_key
+
+
+def get_template_key(filename):
+    with open(join(args['compiler_files_dir'], filename), "r") as infile:
+        return hash_parts([get_environment_key(), filename, infile.read()])
+
+
+def save_dependencies(filename, output_digest, reads):
+    import json
+
+    deps_dir = os.path.dirname(get_deps_file(filename))
+    if not os.path.isdir(deps_dir):
+        try:
+            os.makedirs(deps_dir)
+        except OSError:
+            # another process may have created it meanwhile
+            pass
+
+    deps = {
+        'key': get_template_key(filename),
+        'output': output_digest,
+        'reads': reads,
+    }
+    write_file(get_deps_file(filename), json.dumps(deps))
+
+
+def is_up_to_date(filename):
+    """Returns True iff the output of the template would not change:
+    the template and the compiler are unchanged, the output file is intact,
+    and all parts of the HLIR that the template read last time are unchanged."""
+    import json
+
+    deps_file = get_deps_file(filename)
+    outfile = get_output_file(filename)
+    if not os.path.isfile(deps_file) or not os.path.isfile(outfile):
+        return False
+
+    try:
+        with open(deps_file, "r") as infile:
+            deps = json.load(infile)
+    except ValueError:
+        return False
+
+    if deps['key'] != get_template_key(filename):
+        return False
+
+    if not file_has_digest(outfile, deps['output']):
+        return False
+
+    return reads_unchanged(deps['reads'], node_paths, nodes_by_path)
+
+
+def get_outdated_files(filenames):
+    global node_paths, nodes_by_path
+    if node_paths is None:
+        node_paths, nodes_by_path = get_node_paths(get_hlir())
+
+    outdated = []
+    for filename in filenames:
+        if is_up_to_date(filename):
+            verbose_print("  P4", filename, "is up to date")
+        else:
+            outdated.append(filename)
+    return outdated
 
 
 def make_dirs():
@@ -341,8 +402,8 @@ def make_dirs():
         os.makedirs(args['generated_dir'])
         verbose_print("Generating path for generated files: {0}".format(args['generated_dir']))
 
-    if cache_dir_name and not os.path.isdir(cache_dir_name):
-        os.mkdir(cache_dir_name)
+    if cache_dir_name and not os.path.isdir(get_hlir_cache_dir()):
+        os.makedirs(get_hlir_cache_dir())
 
 
 def file_contains_exact_text(filename, text):
@@ -358,136 +419,463 @@ def file_contains_exact_text(filename, text):
 
 
 def write_file(filename, text):
-    """Writes the given text to the given file."""
+    """Writes the given text to the given file.
+    The file is replaced atomically, so concurrent readers never see partial contents."""
 
     if file_contains_exact_text(filename, text):
         return
 
-    with open(filename, "w") as genfile:
+    import tempfile
+    fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(filename) or '.', prefix='.' + os.path.basename(filename) + '.')
+    with os.fdopen(fd, "w") as genfile:
         genfile.write(text)
+    os.chmod(tmpname, 0o644)
+    os.rename(tmpname, filename)
 
 
-def init_args():
-    """Parses the command line arguments and loads them
-    into the global variable args."""
+def create_arg_parser():
     parser = argparse.ArgumentParser(description='T4P4S compiler')
-    parser.add_argument('p4_file', help='The source file')
+    parser.add_argument('p4_file', help='The source file', nargs='?')
     parser.add_argument('-v', '--p4v', help='Use P4-14 (default is P4-16)', required=False, choices=[16, 14], type=int, default=16)
     parser.add_argument('-p', '--p4c_path', help='P4C path', required=False)
     parser.add_argument('-c', '--compiler_files_dir', help='Source directory of the compiler\'s files', required=False, default=join("src", "hardware_indep"))
-    parser.add_argument('-g', '--generated_dir', help='Output directory for hardware independent files', required=True)
+    parser.add_argument('-g', '--generated_dir', help='Output directory for hardware independent files', required=False)
     parser.add_argument('-desugared_path', help='Output directory for the compiler\'s files', required=False, default=join("build", "util", "desugared_compiler"))
     parser.add_argument('-desugar_info', help='Markings in the generated source code', required=False, choices=["comment", "pragma", "none"], default="comment")
     parser.add_argument('-verbose', help='Verbosity', required=False, default=False, action='store_const', const=True)
     parser.add_argument('-beautify', help='Beautification', required=False, default=False, action='store_const', const=True)
+    parser.add_argument('-no_postopt', help='Do not optimize the generated C code', required=False, default=False, action='store_const', const=True)
+    parser.add_argument('-cache_dir', help='Directory of the cached files (empty: no caching)', required=False, default=cache_dir_name)
+    parser.add_argument('-cache_size', help='Size limit of the cached JSON and HLIR files (in MiB)', required=False, type=int, default=512)
+    parser.add_argument('-incremental', help='Only run the templates whose inputs have changed since the last compilation', required=False, default=False, action='store_const', const=True)
+    parser.add_argument('-profile', help='Report the time and memory used by the phases of the compiler', required=False, default=False, action='store_const', const=True)
+    parser.add_argument('-profile_templates', help='Also save a cProfile dump for each template', required=False, default=False, action='store_const', const=True)
+    parser.add_argument('-profile_dir', help='Output directory for the profiling reports', required=False, default=join("build", "profile"))
+    parser.add_argument('-j', '--jobs', help='Number of processes generating files in parallel (0: one per CPU core)', required=False, type=int, default=1)
+    parser.add_argument('-batch', help='Compile all programs listed in the file (examples.cfg entries or compiler arguments, one per line)', required=False)
+    return parser
 
-    global args
-    args = vars(parser.parse_args())
 
+def parse_args(parser, argv=None, defaults=None):
+    """Parses the arguments; the ones that are not given are taken from `defaults` if present."""
+    namespace = argparse.Namespace(**defaults) if defaults is not None else None
+    parsed = vars(parser.parse_args(argv, namespace))
 
-# TODO also reload if HLIR has changed
-def is_file_fresh(filename):
-    global p4time
-    filetime = os.path.getmtime(filename)
-    return p4time < filetime
+    if parsed['batch'] is None:
+        if parsed['p4_file'] is None:
+            parser.error("the source file is required")
+        if parsed['generated_dir'] is None:
+            parser.error("the output directory (-g) is required")
 
+    return parsed
 
-def load_json_from_cache(base_p4_file):
-    if not cache_dir_name:
-        return None
 
-    json_filename = base_p4_file + ".json"
-    json_filepath = os.path.join(cache_dir_name, json_filename)
+def set_args(new_args):
+    global args, cache_dir_name
+    args = new_args
+    cache_dir_name = args['cache_dir']
 
-    if not os.path.isfile(json_filepath):
-        return None
-    if not is_file_fresh(json_filepath):
-        return None
 
-    verbose_print("Using cached JSON file %s..." % json_filename)
-    return json_filepath
+def init_args():
+    """Parses the command line arguments and loads them
+    into the global variable args."""
+    set_args(parse_args(create_arg_parser()))
+
+
+def get_p4c_path():
+    return args['p4c_path'] or os.environ.get('P4C', '')
+
+
+def get_p4c_fingerprint():
+    """Identifies the P4 frontend by its version text and binary size."""
+    import subprocess
+
+    p4test = join(get_p4c_path(), "build", "p4test")
+    if not os.path.isfile(p4test):
+        return p4test
+
+    try:
+        proc = subprocess.Popen([p4test, "--version"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        version = proc.communicate()[0]
+    except OSError:
+        version = ""
+
+    return "{}:{}:{}".format(p4test, os.path.getsize(p4test), version.strip())
+
+
+include_pattern = re.compile(r'^[ \t]*#[ \t]*include[ \t]*([<"])([^>"]+)[>"]', re.MULTILINE)
+
+
+def collect_p4_sources(filename):
+    """Returns the contents of the P4 file and all files it includes (transitively)
+    as a list of (name, contents) pairs.
+    Included files that cannot be found are listed with empty contents."""
+    include_dirs = [join(get_p4c_path(), "p4include")]
+
+    sources = []
+    visited = set()
+    to_visit = [(os.path.basename(filename), os.path.realpath(filename))]
+    while to_visit != []:
+        name, path = to_visit.pop()
+        if (path or name) in visited:
+            continue
+        visited.add(path or name)
+
+        if path is None or not os.path.isfile(path):
+            sources.append((name, ""))
+            continue
+
+        with open(path, "r") as infile:
+            contents = infile.read()
+        sources.append((name, contents))
+
+        for quote, included in include_pattern.findall(contents):
+            dirs = ([os.path.dirname(path)] if quote == '"' else []) + include_dirs
+            candidates = [join(d, included) for d in dirs if os.path.isfile(join(d, included))]
+            to_visit.append((included, os.path.realpath(candidates[0]) if candidates != [] else None))
+
+    return sources
+
+
+def get_compiler_sources():
+    """The files that determine how the HLIR is built, transformed and indexed."""
+    import glob
+    import hlir16.hlir16
+
+    hlir16_dir = os.path.dirname(hlir16.hlir16.__file__)
+    own_files = [sys.modules[name].__file__ for name in ('transform_hlir16', 'constfold_hlir16', 'liveness_hlir16', 'static_tables_hlir16', 'key_sharing_hlir16', 'cost_hlir16', 'index_hlir16')]
+    return sorted(glob.glob(join(hlir16_dir, "*.py"))) + [re.sub(r'[.]pyc$', '.py', f) for f in own_files]
+
+
+def hash_parts(parts):
+    import hashlib
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(part)
+        digest.update("\0")
+    return digest.hexdigest()
+
+
+def get_cache_keys(filename):
+    """Returns the keys for the cached JSON and the cached HLIR of the P4 file.
+    The JSON key covers the P4 sources (including the included files),
+    the P4 frontend and its options;
+    the HLIR key also covers the code that builds and transforms the HLIR."""
+    parts = ["p4v={}".format(args['p4v']), get_p4c_fingerprint()]
+    for name, contents in collect_p4_sources(filename):
+        parts += [name, contents]
+    json_key = hash_parts(parts)
+
+    compiler_parts = [json_key]
+    for compiler_file in get_compiler_sources():
+        with open(compiler_file, "r") as infile:
+            compiler_parts.append(infile.read())
+    hlir_key = hash_parts(compiler_parts)
+
+    return json_key, hlir_key
+
+
+def get_hlir_cache_dir():
+    return join(cache_dir_name, "hlir")
+
+
+def get_cache_file(base_p4_file, key, ext):
+    return join(get_hlir_cache_dir(), "{}.{}{}".format(base_p4_file, key, ext))
+
+
+def use_cache_file(filepath):
+    """Returns True iff the cache file exists.
+    Its modification time is updated, the least recently used files are evicted first."""
+    if not os.path.isfile(filepath):
+        return False
+
+    os.utime(filepath, None)
+    return True
+
+
+def evict_cache_files(keep):
+    """Removes the least recently used files from the HLIR cache
+    until it fits into the size limit.
+    The files in `keep` are never removed."""
+    cache_dir = get_hlir_cache_dir()
+    limit = args['cache_size'] * 1024 * 1024
+
+    entries = []
+    for fname in os.listdir(cache_dir):
+        path = join(cache_dir, fname)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, path))
+
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_size <= limit:
+            break
+        if path in keep:
+            continue
+
+        verbose_print("Evicting cache file %s..." % path)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total_size -= size
 
 
-def get_pickled_hlir_file(base_p4_file):
+def load_json_from_cache(base_p4_file, json_key):
     if not cache_dir_name:
         return None
 
-    if not pkgutil.find_loader('dill'):
+    json_filepath = get_cache_file(base_p4_file, json_key, ".json")
+    if not use_cache_file(json_filepath):
         return None
 
-    pickle_filepath = os.path.join(cache_dir_name, base_p4_file + ".pickled")
-    if not os.path.isfile(pickle_filepath):
-        return None
-    if not is_file_fresh(pickle_filepath):
+    verbose_print("Using cached JSON file %s..." % json_filepath)
+    return json_filepath
+
+
+def save_json_to_cache(base_p4_file, json_key):
+    """The P4 frontend leaves the JSON file in the cache directory;
+    it is moved into the content addressed cache."""
+    json_filepath = join(cache_dir_name, base_p4_file + ".json")
+    if not cache_dir_name or not os.path.isfile(json_filepath):
         return None
 
-    return pickle_filepath
+    cached_filepath = get_cache_file(base_p4_file, json_key, ".json")
+    os.rename(json_filepath, cached_filepath)
+    return cached_filepath
 
 
-def load_pickled_hlir(pickle_filepath):
-    if pickle_filepath is None:
+def get_hlir_snapshot_file(base_p4_file, hlir_key):
+    if not cache_dir_name:
         return None
 
-    if not pkgutil.find_loader('dill'):
+    snapshot_filepath = get_cache_file(base_p4_file, hlir_key, ".snapshot")
+    if not use_cache_file(snapshot_filepath):
         return None
 
-    import dill
-    import pickle
+    return snapshot_filepath
+
 
-    # the standard recursion limit of 1000 can be too restrictive in more complex cases
-    sys.setrecursionlimit(10000)
+def load_hlir_snapshot(snapshot_filepath):
+    """Returns the HLIR, the paths of its nodes and its nodes by their paths."""
+    if snapshot_filepath is None:
+        return None, None, None
 
-    with open(pickle_filepath, 'r') as inf:
-        verbose_print("Found serialized HLIR in %s..." % pickle_filepath)
-        return pickle.load(inf)
+    verbose_print("Found HLIR snapshot in %s..." % snapshot_filepath)
+    try:
+        return load_snapshot_with_paths(snapshot_filepath)
+    except SnapshotError as e:
+        verbose_print("Ignoring HLIR snapshot: %s" % e)
+        return None, None, None
 
 
-def save_pickled_hlir(hlir, base_p4_file):
+def save_hlir_snapshot(hlir, paths, base_p4_file, hlir_key):
     if not cache_dir_name:
         return None
 
-    if not pkgutil.find_loader('dill'):
-        return None
+    import tempfile
 
-    import dill
-    import pickle
+    snapshot_filepath = get_cache_file(base_p4_file, hlir_key, ".snapshot")
+    fd, tmp_filepath = tempfile.mkstemp(dir=get_hlir_cache_dir(), suffix=".tmp")
+    os.close(fd)
+    try:
+        save_snapshot(hlir, tmp_filepath, paths)
+        os.rename(tmp_filepath, snapshot_filepath)
+    except:
+        os.remove(tmp_filepath)
+        raise
 
-    # the standard recursion limit of 1000 can be too restrictive in more complex cases
-    sys.setrecursionlimit(10000)
+    return snapshot_filepath
 
-    with open(os.path.join(cache_dir_name, base_p4_file + ".pickled"), 'w') as outf:
-        pickled_hlir = pickle.dumps(hlir)
-        outf.write(pickled_hlir)
+
+# The recently used HLIRs (with their node paths) by their cache keys, the least recently used first.
+# Only used by the compiler daemon, see compiler_daemon.py.
+loaded_hlirs = None
+max_loaded_hlirs = 0
+
+
+def keep_hlir_in_memory(hlir_key):
+    if loaded_hlirs is None:
+        return
+
+    loaded_hlirs[hlir_key] = (hlir, node_paths, nodes_by_path)
+    while len(loaded_hlirs) > max_loaded_hlirs:
+        loaded_hlirs.popitem(last=False)
 
 
 def load_p4_file(filename):
-    global hlir
+    global hlir, node_paths, nodes_by_path
 
     verbose_print("Compiling P4-16 HLIR for %s..." % filename)
 
     base_p4_file = os.path.basename(args['p4_file'])
+    with timing.phase("cache keys"):
+        json_key, hlir_key = get_cache_keys(filename)
 
-    pickle_filepath = get_pickled_hlir_file(base_p4_file)
-    hlir = load_pickled_hlir(pickle_filepath)
+    if loaded_hlirs is not None and hlir_key in loaded_hlirs:
+        verbose_print("Using HLIR kept in memory")
+        hlir, node_paths, nodes_by_path = loaded_hlirs.pop(hlir_key)
+        keep_hlir_in_memory(hlir_key)
+        return True
+
+    with timing.phase("load HLIR snapshot"):
+        snapshot_filepath = get_hlir_snapshot_file(base_p4_file, hlir_key)
+        hlir, node_paths, nodes_by_path = load_hlir_snapshot(snapshot_filepath)
     if hlir is not None:
+        keep_hlir_in_memory(hlir_key)
         return True
 
-    to_load = load_json_from_cache(base_p4_file) or args['p4_file']
+    json_filepath = load_json_from_cache(base_p4_file, json_key)
+    to_load = json_filepath or args['p4_file']
 
-    hlir = load_p4(to_load, args['p4v'], args['p4c_path'], cache_dir_name)
+    with timing.phase("load_p4 (p4c and HLIR building)"):
+        hlir = load_p4(to_load, args['p4v'], args['p4c_path'], cache_dir_name)
     success = type(hlir) is not int
 
     if not success:
         return False
 
+    if json_filepath is None:
+        json_filepath = save_json_to_cache(base_p4_file, json_key)
+
     verbose_print("Transforming HLIR")
-    transform_hlir16(hlir)
+    with timing.phase("transform_hlir16"):
+        transform_hlir16(hlir)
+    verbose_print("Constant folding: " + ", ".join("{} {}".format(count, name) for name, count in sorted(hlir.constant_folding_stats.items())))
+
+    with timing.phase("eliminate dead fields"):
+        mark_live_fields(hlir)
+    field_count = sum(len(hdr.type.type_ref.fields) for hdr in hlir.header_instances)
+    verbose_print("Live header fields: {} of {}, live headers: {} of {}".format(len(hlir.live_fields), field_count, len(hlir.live_headers), len(hlir.header_instances)))
+
+    with timing.phase("static tables"):
+        static_tables = mark_static_tables(hlir)
+    for table in static_tables:
+        verbose_print("Table {} has constant entries, {} lookup of {} entries".format(table.name, table.static_lookup.kind, len(table.static_lookup.entries)))
+
+    with timing.phase("shared table keys"):
+        shared_key_groups = mark_shared_keys(hlir)
+    for group in shared_key_groups:
+        verbose_print("Tables {} share their key".format(", ".join(table.name for table in group)))
+
+    with timing.phase("index HLIR"):
+        index_hlir16(hlir)
 
-    save_pickled_hlir(hlir, base_p4_file)
+    # the paths are saved into the snapshot, see deps_hlir16.py
+    if cache_dir_name or args['incremental']:
+        with timing.phase("node paths"):
+            node_paths, nodes_by_path = get_node_paths(hlir)
+
+    with timing.phase("save HLIR snapshot"):
+        snapshot_filepath = save_hlir_snapshot(hlir, node_paths, base_p4_file, hlir_key)
+
+    if cache_dir_name:
+        evict_cache_files({json_filepath, snapshot_filepath})
+
+    keep_hlir_in_memory(hlir_key)
 
     return True
 
 
+def get_codegen_format_stats():
+    """The cache statistics of the formatting functions of the code generator helpers in this process."""
+    codegen = sys.modules.get('utils.codegen')
+    if codegen is None:
+        return {}
+    return {name: counts.copy() for name, counts in codegen.format_cache_stats.items()}
+
+
+def add_format_cache_stats(stats):
+    for name, counts in stats.items():
+        total = format_cache_stats.setdefault(name, {k: 0 for k in counts})
+        for k in counts:
+            total[k] += counts[k]
+
+
+def format_cache_report():
+    parts = []
+    for name, counts in sorted(format_cache_stats.items()):
+        calls = sum(counts.values())
+        hit_rate = 100.0 * counts['hits'] / calls if calls > 0 else 0.0
+        parts.append("%s %.1f%% (%d hits, %d misses, %d uncacheable)" % (name, hit_rate, counts['hits'], counts['misses'], counts['uncacheable']))
+    return ", ".join(parts)
+
+
+def postopt_report():
+    before, after = postopt_stats['bytes before'], postopt_stats['bytes after']
+    saved = 100.0 * (before - after) / before if before > 0 else 0.0
+    counts = ", ".join("%d %s" % (postopt_stats[k], k) for k in sorted(postopt_stats) if not k.startswith('bytes'))
+    return "%d -> %d bytes (%.1f%% smaller), %s" % (before, after, saved, counts)
+
+
+def generate_file(filename):
+    """Generates a single output file.
+    Returns the errors, warnings, template cache statistics, profiling records,
+    formatting cache statistics and post-optimizer statistics that were produced meanwhile."""
+    error_count, warning_count = len(errors), len(warnings)
+    record_count = len(timing.records)
+    old_stats = template_cache_stats.copy()
+    old_format_stats = get_codegen_format_stats()
+    old_postopt_stats = postopt_stats.copy()
+
+    verbose_print("  P4", filename)
+    generate_desugared_c(filename, join(args['compiler_files_dir'], filename))
+
+    stats = {k: template_cache_stats[k] - old_stats[k] for k in template_cache_stats}
+    format_stats = {}
+    for name, counts in get_codegen_format_stats().items():
+        format_stats[name] = {k: counts[k] - old_format_stats.get(name, {}).get(k, 0) for k in counts}
+    file_postopt_stats = {k: postopt_stats[k] - old_postopt_stats.get(k, 0) for k in postopt_stats}
+    return errors[error_count:], warnings[warning_count:], stats, timing.records[record_count:], format_stats, file_postopt_stats
+
+
+def get_job_count(file_count):
+    import multiprocessing
+
+    jobs = args['jobs'] if args['jobs'] > 0 else multiprocessing.cpu_count()
+    return min(jobs, file_count)
+
+
+def generate_files(filenames):
+    """Generates the output files, either one by one or in parallel.
+    In parallel mode, the worker processes are forked after the HLIR is loaded,
+    so they all share the same (read-only) HLIR."""
+    jobs = get_job_count(len(filenames))
+    if jobs <= 1:
+        # the post-optimizer statistics are collected in this process
+        for filename in filenames:
+            add_format_cache_stats(generate_file(filename)[4])
+        return
+
+    import multiprocessing
+
+    verbose_print("Generating %d files using %d processes" % (len(filenames), jobs))
+
+    # the larger templates are started first for a better load balance
+    base = args['compiler_files_dir']
+    filenames = sorted(filenames, key=lambda f: os.path.getsize(join(base, f)), reverse=True)
+
+    pool = multiprocessing.Pool(jobs)
+    try:
+        results = pool.map(generate_file, filenames, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    for file_errors, file_warnings, stats, records, format_stats, file_postopt_stats in results:
+        errors.extend(file_errors)
+        warnings.extend(file_warnings)
+        timing.records.extend(records)
+        for k in stats:
+            template_cache_stats[k] += stats[k]
+        add_format_cache_stats(format_stats)
+        for k in file_postopt_stats:
+            postopt_stats[k] = postopt_stats.get(k, 0) + file_postopt_stats[k]
+
+
 def check_file_exists(filename):
     if os.path.isfile(filename) is False:
         print("FILE NOT FOUND: %s" % filename, file=sys.stderr)
@@ -501,38 +889,193 @@ def check_file_extension(filename):
 
 
 
-def main():
-    init_args()
+def init_profiling():
+    if args['profile']:
+        timing.enable(args['profile_dir'] if args['profile_templates'] else None)
 
-    filename = args['p4_file']
 
-    global p4time
-    p4time = os.path.getmtime(filename)
+def show_profile():
+    if not args['profile']:
+        return
+
+    report = timing.get_report()
+    report_file = join(args['profile_dir'], os.path.basename(args['p4_file']) + ".json")
+    timing.save_report(report, report_file)
+
+    print(timing.format_report(report))
+    print("Profile saved to %s" % report_file)
+
+
+def reset_program_state():
+    """Resets the singletons of the compiler before the next program of a batch is compiled.
+    The loaded modules and the translated templates are kept."""
+    global hlir, node_paths, nodes_by_path, environment_key
+    hlir = None
+    node_paths = None
+    nodes_by_path = None
+    environment_key = None
+
+    del errors[:]
+    del warnings[:]
+    del timing.records[:]
+    for k in template_cache_stats:
+        template_cache_stats[k] = 0
+    format_cache_stats.clear()
+    postopt_stats.clear()
+
+    reset_codegen_state()
+
+
+def compile_program():
+    """Generates the C files for the P4 program given in args.
+    Returns True iff the compilation was successful."""
+    return load_program() and generate_program()
+
+
+def load_program():
+    filename = args['p4_file']
 
     make_dirs()
 
     check_file_exists(filename)
     check_file_extension(filename)
 
-    success = load_p4_file(filename)
+    with timing.phase("load HLIR"):
+        success = load_p4_file(filename)
 
     if not success:
         print("P4 compilation failed for file %s" % (os.path.basename(__file__)), file=sys.stderr)
-        sys.exit(1)
+        return False
+
+    return True
+
 
+def get_template_files():
     base = args['compiler_files_dir']
     exts = [".c.py", ".h.py"]
+    return [f for f in sorted(os.listdir(base)) if isfile(join(base, f)) for ext in exts if f.endswith(ext)]
 
-    for filename in (f for f in os.listdir(base) if isfile(join(base, f)) for ext in exts if f.endswith(ext)):
-        verbose_print("  P4", filename)
+
+def generate_cost_report():
+    """The estimated per-packet costs are saved next to the generated files (see cost_hlir16.py)."""
+    report = get_cost_report(get_hlir())
+
+    report_file = join(args['generated_dir'], "cost_report")
+    write_file(report_file + ".txt", format_cost_report(report))
+    write_file(report_file + ".json", format_cost_report_json(report))
+
+    verbose_print("Estimated per-packet cost: {:g} to {:g} cycles, see {}.txt".format(report['min'], report['max'], report_file))
+
+
+def generate_program():
+    filenames = get_template_files()
+
+    with timing.phase("desugar utilities"):
         generate_desugared_py()
-        generate_desugared_c(filename, join(base, filename))
+
+    if args['incremental']:
+        with timing.phase("dependency check"):
+            filenames = get_outdated_files(filenames)
+
+    with timing.phase("generate files"):
+        generate_files(filenames)
+
+    with timing.phase("cost report"):
+        generate_cost_report()
+
+    verbose_print("Template cache: %d hits, %d misses" % (template_cache_stats['hits'], template_cache_stats['misses']))
+    if format_cache_stats != {}:
+        verbose_print("Formatting cache: " + format_cache_report())
+    if postopt_stats != {}:
+        verbose_print("Post-optimizer: " + postopt_report())
+
+    show_profile()
 
     showErrors()
     showWarnings()
 
-    global errors
-    if len(errors) > 0:
+    return len(errors) == 0
+
+
+def find_example_source(example):
+    """Finds the source of the example the same way as t4p4s.sh."""
+    src_dir = os.environ.get('P4_SRC_DIR', join(".", "examples"))
+    for dirpath, _, files in sorted(os.walk(src_dir)):
+        for f in sorted(files):
+            if re.match(re.escape(example) + r'[.]p4', f):
+                return join(dirpath, f)
+    return None
+
+
+def get_batch_argv(line):
+    """A line of the batch file is either an examples.cfg entry (example[@variant] followed by any options)
+    or the arguments of the compiler.
+    Examples are generated into the same directory as by t4p4s.sh."""
+    import shlex
+
+    words = shlex.split(line)
+    if re.search(r'[.]p4(_14)?$', words[0]) or words[0].startswith('-'):
+        return words
+
+    example, _, variant = words[0].partition('@')
+    source = find_example_source(example)
+    if source is None:
+        return None
+
+    p4v = "14" if source.endswith(".p4_14") else "16"
+    generated_dir = join(".", "build", "{}@{}".format(example, variant or "std"), "srcgen")
+    return [source, "--p4v", p4v, "-g", generated_dir]
+
+
+def compile_batch(batch_file):
+    """Compiles the programs listed in the batch file in this process.
+    The options given on the command line apply to all programs.
+    Returns True iff all programs were compiled successfully."""
+    parser = create_arg_parser()
+    batch_args = args
+
+    with open(batch_file, "r") as infile:
+        lines = [re.sub(r'(^|\s)[;#].*', '', line).strip() for line in infile]
+
+    failed = []
+    for line in lines:
+        if line == "":
+            continue
+
+        argv = get_batch_argv(line)
+        if argv is None:
+            print("Cannot find the source of %s" % line.split()[0], file=sys.stderr)
+            failed.append(line)
+            continue
+
+        reset_program_state()
+        try:
+            set_args(parse_args(parser, argv, dict(batch_args, batch=None)))
+            print("Compiling %s into %s" % (args['p4_file'], args['generated_dir']))
+            success = compile_program()
+        except SystemExit:
+            success = False
+
+        if not success:
+            failed.append(line)
+
+    set_args(batch_args)
+
+    for line in failed:
+        print("Compilation failed: %s" % line, file=sys.stderr)
+    return failed == []
+
+
+def main():
+    init_args()
+    init_profiling()
+
+    if args['batch'] is not None:
+        success = compile_batch(args['batch'])
+    else:
+        success = compile_program()
+
+    if not success:
         sys.exit(1)
 
 
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+# Copyright 2018 Eotvos Lorand University, Budapest, Hungary
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Takes the same arguments as compiler.py.
+If the compiler daemon (compiler_daemon.py) is running, the compilation is done by the daemon,
+otherwise by the compiler in this process."""
+
+from __future__ import print_function
+
+import json
+import os
+import socket
+import sys
+
+default_socket = os.path.join("build", ".cache", "compiler.sock")
+
+
+def compile_remotely(socket_path, argv):
+    """Returns the reply of the daemon, or None if it is not running."""
+    if not os.path.exists(socket_path):
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except socket.error:
+        sock.close()
+        return None
+
+    try:
+        request = {'argv': argv, 'cwd': os.getcwd(), 'env': dict(os.environ)}
+        sock.sendall(json.dumps(request))
+        sock.shutdown(socket.SHUT_WR)
+
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    finally:
+        sock.close()
+
+    try:
+        return json.loads("".join(chunks))
+    except ValueError:
+        return None
+
+
+def compile_locally():
+    import compiler
+    compiler.main()
+
+
+def main():
+    socket_path = os.environ.get('T4P4S_COMPILER_SOCKET', default_socket)
+    reply = compile_remotely(socket_path, sys.argv[1:])
+
+    if reply is None or 'fallback' in reply:
+        if reply is not None:
+            print("Compiler daemon: %s" % reply['fallback'], file=sys.stderr)
+        compile_locally()
+        return
+
+    sys.stdout.write(reply['stdout'].encode('utf-8'))
+    sys.stderr.write(reply['stderr'].encode('utf-8'))
+    sys.exit(reply['exit'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+
+# Copyright 2018 Eotvos Lorand University, Budapest, Hungary
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A long running compiler process, used by compiler_client.py.
+
+Start it in the root of the repository:
+
+    python -B src/compiler_daemon.py [-socket build/.cache/compiler.sock] [-max_hlirs 8]
+
+The daemon keeps the imported modules, the translated templates
+and the recently used HLIRs in memory.
+Each request is loaded in the daemon process (so that the HLIR can be kept),
+then the files are generated in a forked child process,
+so the state of the daemon is not changed by the templates.
+
+A request is a JSON object with the fields argv, cwd and env;
+the reply contains the exit code and the standard output and error of the compilation.
+If the sources of the compiler have changed since the daemon was started,
+the daemon asks the client to compile in-process and restarts itself.
+"""
+
+from __future__ import print_function
+
+import argparse
+import collections
+import glob
+import hashlib
+import json
+import os
+import re
+import socket
+import sys
+import tempfile
+import traceback
+
+# requests may come from other directories; later imports must not depend on the current directory
+sys.path[0] = os.path.abspath(sys.path[0])
+
+import compiler
+
+default_socket = os.path.join("build", ".cache", "compiler.sock")
+
+
+def get_socket_path():
+    return os.environ.get('T4P4S_COMPILER_SOCKET', default_socket)
+
+
+def get_sources_digest():
+    """The contents of the compiler sources, excluding the files generated from .sugar.py files."""
+    sugar_files = glob.glob("src/utils/*.sugar.py")
+    generated = {re.sub(r"[.]sugar[.]py$", ".py", f) for f in sugar_files}
+
+    files = sorted(glob.glob("src/*.py") + [f for f in glob.glob("src/utils/*.py") if f not in generated])
+    files += compiler.get_compiler_sources()
+
+    digest = hashlib.sha1()
+    for fname in files:
+        with open(fname, "r") as infile:
+            digest.update(fname)
+            digest.update(infile.read())
+    return digest.hexdigest()
+
+
+def receive_all(conn):
+    chunks = []
+    while True:
+        chunk = conn.recv(65536)
+        if not chunk:
+            return "".join(chunks)
+        chunks.append(chunk)
+
+
+def preload_templates():
+    """Translates the templates and imports the code generator helpers,
+    so that the forked processes do not have to."""
+    stats = compiler.template_cache_stats.copy()
+
+    compiler.generate_desugared_py()
+    import utils.codegen
+
+    for filename in compiler.get_template_files():
+        filepath = os.path.join(compiler.args['compiler_files_dir'], filename)
+        with open(filepath, "r") as infile:
+            compiler.translate_and_compile(filepath, infile.read(), compiler.get_desugared_file(filename))
+
+    # the statistics should only show the lookups of the compilation itself
+    compiler.template_cache_stats.update(stats)
+
+
+def run_in_child(compile_function):
+    """Runs the function in a forked process. Returns the exit code."""
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            code = 0 if compile_function() else 1
+        except SystemExit as e:
+            code = e.code if type(e.code) is int else 1
+        except:
+            traceback.print_exc()
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+
+    _, status = os.waitpid(pid, 0)
+    return os.WEXITSTATUS(status) if os.WIFEXITED(status) else 1
+
+
+def compile_request(argv):
+    """Compiles a program, returns the exit code."""
+    compiler.reset_program_state()
+    compiler.timing.disable()
+    try:
+        compiler.set_args(compiler.parse_args(compiler.create_arg_parser(), argv))
+        if compiler.args['batch'] is not None:
+            return run_in_child(lambda: compiler.compile_batch(compiler.args['batch']))
+
+        compiler.init_profiling()
+        if not compiler.load_program():
+            return 1
+
+        preload_templates()
+        return run_in_child(compiler.generate_program)
+    except SystemExit as e:
+        return e.code if type(e.code) is int else 1
+
+
+def handle_request(request):
+    """Runs the request with its output redirected into temporary files."""
+    old_env = dict(os.environ)
+    os.environ.clear()
+    os.environ.update(request['env'])
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved_fds = (os.dup(1), os.dup(2))
+    outputs = (tempfile.TemporaryFile(), tempfile.TemporaryFile())
+    os.dup2(outputs[0].fileno(), 1)
+    os.dup2(outputs[1].fileno(), 2)
+
+    try:
+        exit_code = compile_request(request['argv'])
+    except:
+        traceback.print_exc()
+        exit_code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(saved_fds[0], 1)
+        os.dup2(saved_fds[1], 2)
+        os.close(saved_fds[0])
+        os.close(saved_fds[1])
+
+        os.environ.clear()
+        os.environ.update(old_env)
+
+    texts = []
+    for outf in outputs:
+        outf.seek(0)
+        texts.append(outf.read().decode('utf-8', 'replace'))
+        outf.close()
+
+    return {'exit': exit_code, 'stdout': texts[0], 'stderr': texts[1]}
+
+
+def serve(sock, verbose):
+    sources_digest = get_sources_digest()
+    cwd = os.path.realpath(os.getcwd())
+
+    while True:
+        conn, _ = sock.accept()
+        request, reply = {}, {}
+        try:
+            request = json.loads(receive_all(conn))
+
+            if os.path.realpath(request['cwd']) != cwd:
+                reply = {'fallback': "the daemon serves {}".format(cwd)}
+            elif get_sources_digest() != sources_digest:
+                reply = {'fallback': "the compiler has changed, the daemon restarts"}
+            else:
+                reply = handle_request(request)
+
+            if verbose:
+                print("Request {}: {}".format(" ".join(request['argv']), reply.get('exit', reply.get('fallback'))))
+
+            conn.sendall(json.dumps(reply))
+        except Exception:
+            traceback.print_exc()
+        finally:
+            conn.close()
+
+        if 'fallback' in reply and os.path.realpath(request['cwd']) == cwd:
+            return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='T4P4S compiler daemon')
+    parser.add_argument('-socket', help='Path of the Unix socket', required=False, default=get_socket_path())
+    parser.add_argument('-max_hlirs', help='Number of HLIRs kept in memory', required=False, type=int, default=8)
+    parser.add_argument('-verbose', help='Verbosity', required=False, default=False, action='store_const', const=True)
+    daemon_args = parser.parse_args()
+
+    compiler.loaded_hlirs = collections.OrderedDict()
+    compiler.max_loaded_hlirs = daemon_args.max_hlirs
+
+    socket_dir = os.path.dirname(daemon_args.socket)
+    if socket_dir and not os.path.isdir(socket_dir):
+        os.makedirs(socket_dir)
+    if os.path.exists(daemon_args.socket):
+        os.remove(daemon_args.socket)
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(daemon_args.socket)
+    sock.listen(16)
+    print("Compiler daemon listening on %s" % daemon_args.socket)
+
+    try:
+        restart = serve(sock, daemon_args.verbose)
+    finally:
+        sock.close()
+        os.remove(daemon_args.socket)
+
+    if restart:
+        python_opts = ["-B"] if sys.dont_write_bytecode else []
+        os.execv(sys.executable, [sys.executable] + python_opts + sys.argv)
+
+
+if __name__ == '__main__':
+    main()
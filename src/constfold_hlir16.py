@@ -0,0 +1,361 @@
+# Copyright 2018 Eotvos Lorand University, Budapest, Hungary
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#!/usr/bin/env python
+
+"""Constant folding and propagation over the bodies of the controls, actions and parser states.
+
+- Operations on constants are evaluated (only on unsigned and arbitrary precision integers, and booleans).
+- Within a block, the reads of a local variable that was assigned a constant are replaced by the constant,
+  until the next statement that is not a simple assignment.
+- The branches of if and switch statements that cannot be taken are removed.
+- Constants wider than 32 bits get their big endian byte representation (byte_array),
+  so that the generated code can use a precomputed static array.
+"""
+
+from hlir16.p4node import P4Node, get_fresh_node_id
+
+code_declarations = {'P4Control', 'P4Parser', 'P4Action', 'Method', 'Function'}
+
+
+def big_endian_bytes(value, width):
+    """The lowest width bytes of the value, the most significant byte first."""
+    return [int((value >> (8 * (width - 1 - i))) & 0xff) for i in range(width)]
+
+
+def is_unsigned_bits(t):
+    return t.node_type == 'Type_Bits' and not t.isSigned
+
+
+def is_foldable_type(t):
+    return t is not None and (is_unsigned_bits(t) or t.node_type == 'Type_InfInt')
+
+
+def is_constant(e):
+    return e.node_type == 'Constant' and is_foldable_type(e.type)
+
+
+def is_bool_literal(e):
+    return e.node_type == 'BoolLiteral'
+
+
+def make_constant(value, t, base=10):
+    if is_unsigned_bits(t):
+        value %= 2 ** t.size
+
+    return P4Node({'id' : get_fresh_node_id(),
+                   'node_type' : 'Constant',
+                   'value' : value,
+                   'base' : base,
+                   'type' : t,
+                   })
+
+
+def make_bool(value, t):
+    return P4Node({'id' : get_fresh_node_id(),
+                   'node_type' : 'BoolLiteral',
+                   'value' : value,
+                   'type' : t,
+                   })
+
+
+def copy_constant(c):
+    if c.node_type == 'BoolLiteral':
+        return make_bool(c.value, c.type)
+    return make_constant(c.value, c.type, c.get_attr('base') or 10)
+
+
+def make_empty_block():
+    return P4Node({'id' : get_fresh_node_id(),
+                   'node_type' : 'BlockStatement',
+                   'components' : [],
+                   'annotations' : P4Node({'id' : get_fresh_node_id(),
+                                           'node_type' : 'Annotations',
+                                           'annotations' : P4Node({'node_type' : 'Vector<Annotation>'}, []),
+                                           }),
+                   })
+
+
+arithmetic_ops = {
+    'Add': lambda a, b: a + b,
+    'Sub': lambda a, b: a - b,
+    'Mul': lambda a, b: a * b,
+    'Div': lambda a, b: a // b if b != 0 and a >= 0 and b > 0 else None,
+    'Mod': lambda a, b: a % b if b != 0 and a >= 0 and b > 0 else None,
+    'Shl': lambda a, b: a << b if 0 <= b else None,
+    'Shr': lambda a, b: a >> b if 0 <= b else None,
+    'BAnd': lambda a, b: a & b,
+    'BOr': lambda a, b: a | b,
+    'BXor': lambda a, b: a ^ b,
+}
+
+comparison_ops = {
+    'Equ': lambda a, b: a == b,
+    'Neq': lambda a, b: a != b,
+    'Lss': lambda a, b: a < b,
+    'Leq': lambda a, b: a <= b,
+    'Grt': lambda a, b: a > b,
+    'Geq': lambda a, b: a >= b,
+}
+
+# the subexpressions of the operations that are folded
+operand_attrs = {nt: ('left', 'right') for nt in list(arithmetic_ops) + list(comparison_ops) + ['LAnd', 'LOr', 'Concat']}
+operand_attrs.update({'Neg': ('expr',), 'Cmpl': ('expr',), 'LNot': ('expr',), 'Cast': ('expr',),
+                      'Mux': ('e0', 'e1', 'e2'), 'Slice': ('e0', 'e1', 'e2')})
+
+
+class ConstantFolder(object):
+    def __init__(self):
+        # the declarations of the local variables -> their current constant values
+        self.env = {}
+        self.folded_exprs = 0
+        self.propagated_reads = 0
+        self.pruned_branches = 0
+
+    def fold_expr(self, e):
+        """Returns the simplified expression; the subexpressions of the expression are replaced in place."""
+        if e is None or not isinstance(e, P4Node):
+            return e
+
+        nt = e.node_type
+
+        if nt == 'PathExpression':
+            value = self.env.get(id(e.get_attr('ref')))
+            if value is None:
+                return e
+            self.propagated_reads += 1
+            return copy_constant(value)
+
+        for attr in operand_attrs.get(nt, ()):
+            child = e.get_attr(attr)
+            if isinstance(child, P4Node):
+                e.set_attr(attr, self.fold_expr(child))
+
+        folded = self.fold_node(e)
+        if folded is not e:
+            self.folded_exprs += 1
+        return folded
+
+    def fold_node(self, e):
+        nt = e.node_type
+
+        if nt in arithmetic_ops and is_constant(e.left) and is_constant(e.right) and is_foldable_type(e.type):
+            value = arithmetic_ops[nt](e.left.value, e.right.value)
+            if value is None or (value < 0 and e.type.node_type == 'Type_InfInt'):
+                return e
+            return make_constant(value, e.type)
+
+        if nt in comparison_ops and is_constant(e.left) and is_constant(e.right):
+            return make_bool(comparison_ops[nt](e.left.value, e.right.value), e.type)
+        if nt in ('Equ', 'Neq') and is_bool_literal(e.left) and is_bool_literal(e.right):
+            return make_bool(comparison_ops[nt](e.left.value, e.right.value), e.type)
+
+        if nt == 'Neg' and is_constant(e.expr) and is_unsigned_bits(e.type):
+            return make_constant(-e.expr.value, e.type)
+        if nt == 'Cmpl' and is_constant(e.expr) and is_unsigned_bits(e.type):
+            return make_constant(~e.expr.value, e.type)
+        if nt == 'LNot' and is_bool_literal(e.expr):
+            return make_bool(not e.expr.value, e.type)
+
+        # the right operand is not evaluated if the left one decides the result
+        if nt in ('LAnd', 'LOr') and is_bool_literal(e.left):
+            if e.left.value == (nt == 'LOr'):
+                return make_bool(e.left.value, e.type)
+            return e.right
+
+        if nt == 'Mux' and is_bool_literal(e.e0):
+            return e.e1 if e.e0.value else e.e2
+
+        if nt == 'Slice' and is_constant(e.e0) and is_constant(e.e2) and is_unsigned_bits(e.type):
+            return make_constant(e.e0.value >> e.e2.value, e.type)
+
+        if nt == 'Concat' and is_constant(e.left) and is_constant(e.right) and is_unsigned_bits(e.type) and is_unsigned_bits(e.right.type):
+            return make_constant((e.left.value << e.right.type.size) | e.right.value, e.type)
+
+        if nt == 'Cast':
+            src_type, dst_type = e.expr.type, e.destType
+            if is_constant(e.expr) and is_unsigned_bits(dst_type):
+                return make_constant(e.expr.value, dst_type)
+            if is_bool_literal(e.expr) and is_unsigned_bits(dst_type) and dst_type.size == 1:
+                return make_constant(1 if e.expr.value else 0, dst_type)
+            if is_constant(e.expr) and dst_type.node_type == 'Type_Boolean' and is_unsigned_bits(src_type) and src_type.size == 1:
+                return make_bool(e.expr.value != 0, dst_type)
+
+        return e
+
+    def set_local(self, decl, value):
+        if value is not None and (is_constant(value) or is_bool_literal(value)):
+            self.env[id(decl)] = value
+        else:
+            self.env.pop(id(decl), None)
+
+    def fold_condition(self, e):
+        """Folds an expression that is evaluated before the branches of a statement.
+        A method call in it (e.g. table.apply().hit) may modify the local variables."""
+        e = self.fold_expr(e)
+        if contains_call(e):
+            self.env.clear()
+        return e
+
+    def fold_branch(self, stmt, env):
+        """Folds a branch that starts with the given constant values."""
+        self.env = dict(env)
+        return self.fold_statement(stmt)
+
+    def fold_statement(self, stmt):
+        """Returns the simplified statement."""
+        if stmt is None or not isinstance(stmt, P4Node):
+            return stmt
+
+        nt = stmt.get_attr('node_type')
+
+        if nt == 'AssignmentStatement':
+            stmt.right = self.fold_condition(stmt.right)
+            dst = stmt.left
+            if dst.node_type == 'PathExpression' and dst.get_attr('ref') is not None and dst.ref.node_type == 'Declaration_Variable':
+                self.set_local(dst.ref, stmt.right)
+            elif dst.node_type != 'Member':
+                self.env.clear()
+            return stmt
+
+        if nt == 'Declaration_Variable':
+            if stmt.get_attr('initializer') is not None:
+                stmt.initializer = self.fold_condition(stmt.initializer)
+            self.set_local(stmt, stmt.get_attr('initializer'))
+            return stmt
+
+        if nt == 'BlockStatement':
+            self.fold_block(stmt)
+            return stmt
+
+        if nt == 'IfStatement':
+            stmt.condition = self.fold_condition(stmt.condition)
+            if is_bool_literal(stmt.condition):
+                self.pruned_branches += 1
+                taken = stmt.get_attr('ifTrue') if stmt.condition.value else stmt.get_attr('ifFalse')
+                return self.fold_statement(taken) if taken is not None else make_empty_block()
+
+            env = self.env
+            stmt.ifTrue = self.fold_branch(stmt.ifTrue, env)
+            if stmt.get_attr('ifFalse') is not None:
+                stmt.ifFalse = self.fold_branch(stmt.ifFalse, env)
+            self.env = {}
+            return stmt
+
+        if nt == 'SwitchStatement':
+            stmt.expression = self.fold_condition(stmt.expression)
+            if is_constant(stmt.expression):
+                taken = self.get_taken_case(stmt)
+                if taken is not False:
+                    self.pruned_branches += 1
+                    return self.fold_statement(taken) if taken is not None else make_empty_block()
+
+            env = self.env
+            for case in stmt.cases:
+                if case.get_attr('statement') is not None:
+                    case.statement = self.fold_branch(case.statement, env)
+            self.env = {}
+            return stmt
+
+        # method calls may modify their (out) arguments
+        self.env.clear()
+        return stmt
+
+    def get_taken_case(self, stmt):
+        """The statement of the case that is taken (None if there is no such case),
+        or False if it cannot be determined. A case without a statement falls through to the next one."""
+        cases = list(stmt.cases)
+        for idx, case in enumerate(cases):
+            label = case.label
+            if label.node_type == 'DefaultExpression' or (is_constant(label) and label.value == stmt.expression.value):
+                for taken_case in cases[idx:]:
+                    if taken_case.get_attr('statement') is not None:
+                        return taken_case.statement
+                return None
+            if not is_constant(label):
+                return False
+        return None
+
+    def fold_block(self, block):
+        """The statements of the block are executed in order, so the constant values are propagated along them."""
+        components = [self.fold_statement(c) for c in block.components]
+        if isinstance(block.components, P4Node):
+            block.components.vec = components
+        else:
+            block.components = components
+
+    def fold_declaration(self, decl):
+        self.env = {}
+        if decl.get_attr('body') is not None:
+            decl.body = self.fold_statement(decl.body)
+
+        for local in decl.get_attr('controlLocals') or []:
+            if local.get_attr('node_type') in code_declarations:
+                self.fold_declaration(local)
+
+        for state in decl.get_attr('states') or []:
+            if state.get_attr('components') is not None:
+                self.env = {}
+                self.fold_block(state)
+
+
+def contains_call(e):
+    if not isinstance(e, P4Node):
+        return False
+    if e.get_attr('node_type') == 'MethodCallExpression':
+        return True
+    return any(contains_call(e.get_attr(attr)) for attr in ('left', 'right', 'expr', 'e0', 'e1', 'e2'))
+
+
+def collect_wide_constants(node, visited, result):
+    """The constants in the subtree that are wider than 32 bits; references are not followed."""
+    if not isinstance(node, P4Node) or id(node) in visited:
+        return
+    visited.add(id(node))
+
+    if node.get_attr('node_type') == 'Constant' and node.type.node_type == 'Type_Bits' and node.type.size > 32:
+        result.append(node)
+
+    children = list(node.vec) if node.is_vec() else []
+    for name, value in node.__dict__.items():
+        if name in ('ref', 'type_ref', 'header_ref', 'field_ref', 'type', 'action_object', 'vec'):
+            continue
+        if isinstance(value, P4Node):
+            children.append(value)
+        elif type(value) in (list, tuple):
+            children += value
+
+    for child in children:
+        collect_wide_constants(child, visited, result)
+
+
+def fold_constants(hlir16):
+    folder = ConstantFolder()
+    code = [decl for decl in hlir16.declarations if decl.get_attr('node_type') in code_declarations]
+    for decl in code:
+        folder.fold_declaration(decl)
+
+    wide_constants = []
+    visited = set()
+    for decl in code:
+        collect_wide_constants(decl, visited, wide_constants)
+    for c in wide_constants:
+        c.byte_array = big_endian_bytes(c.value, (c.type.size+7)/8)
+
+    hlir16.constant_folding_stats = {
+        'folded expressions': folder.folded_exprs,
+        'propagated reads': folder.propagated_reads,
+        'pruned branches': folder.pruned_branches,
+        'precomputed byte arrays': len(wide_constants),
+    }
+    return hlir16.constant_folding_stats
@@ -0,0 +1,345 @@
+# Copyright 2018 Eotvos Lorand University, Budapest, Hungary
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#!/usr/bin/env python
+
+"""A compile time estimate of the per-packet cost of the program.
+
+The paths through the parser (from the start state to accept or reject)
+and through each control of the pipeline are enumerated;
+a table application branches into one path for each action of the table,
+if and switch statements branch into their cases.
+The branches are considered independent of each other, e.g. a switch on action_run
+is not matched up with the action that the table has actually run.
+
+For each path, the operations that the generated code performs are counted
+(header extracts, table lookups by match kind, field writes, bytes copied, emits, digests etc.),
+and the counts are weighted by the rough number of cycles they take on the target (cost_weights).
+The estimate is meant for comparing two versions of a program, not for predicting the throughput.
+"""
+
+import collections
+import json
+
+from hlir16.hlir16_attrs import get_main
+from liveness_hlir16 import is_live_field
+from static_tables_hlir16 import is_static_table
+
+# The approximate number of cycles of the operations.
+cost_weights = {
+    'header extracts':      10,
+    'field reads':           5,
+    'select evaluations':    5,
+    'key calculations':     10,
+    'exact lookups':        60,
+    'lpm lookups':          50,
+    'ternary lookups':     150,
+    'static lookups':       10,
+    'action calls':          5,
+    'field writes':         10,
+    'header copies':        10,
+    'validity changes':      2,
+    'bytes copied':          0.5,
+    'emits':                 5,
+    'digests':             500,
+    'extern calls':         20,
+}
+
+# Beyond this many paths, only the most expensive ones are kept.
+max_paths = 256
+
+
+def estimate(counts):
+    return sum(cost_weights.get(name, 0) * count for name, count in counts.items())
+
+
+class Path(object):
+    def __init__(self, steps=(), counts=None):
+        self.steps = tuple(steps)
+        self.counts = counts if counts is not None else collections.Counter()
+
+    def then(self, other):
+        counts = collections.Counter(self.counts)
+        counts.update(other.counts)
+        return Path(self.steps + other.steps, counts)
+
+
+def single_path(step=None, **counts):
+    return [Path([step] if step is not None else [], collections.Counter(counts))]
+
+
+def header_byte_width(e):
+    """The byte width of the header instance or header typed expression, or 0 if it is not known."""
+    hdr = e.get_attr('header_ref')
+    t = hdr.type if hdr is not None else e.get_attr('type')
+    if t is None:
+        return 0
+    if t.get_attr('type_ref') is not None:
+        t = t.type_ref
+    return t.get_attr('byte_width') or 0
+
+
+class CostModel(object):
+    def __init__(self, hlir16):
+        self.hlir16 = hlir16
+        self.truncated = False
+
+    def limit(self, paths):
+        if len(paths) <= max_paths:
+            return paths
+        self.truncated = True
+        return sorted(paths, key=lambda p: -estimate(p.counts))[:max_paths]
+
+    def sequence(self, *path_lists):
+        paths = [Path()]
+        for path_list in path_lists:
+            paths = self.limit([p.then(q) for p in paths for q in path_list])
+        return paths
+
+    def alternatives(self, *path_lists):
+        return self.limit([p for path_list in path_lists for p in path_list])
+
+    # --------------------------------------------------------------------------
+    # Expressions
+
+    def expression_paths(self, e):
+        """The costs of evaluating the expression; table applications in it branch."""
+        if e is None or not hasattr(e, 'node_type'):
+            return [Path()]
+
+        if e.node_type == 'Member' and e.get_attr('field_ref') is not None:
+            return single_path(**{'field reads': 1})
+
+        if e.node_type == 'MethodCallExpression':
+            return self.call_paths(e)
+
+        if e.node_type == 'ListExpression':
+            return self.sequence(*[self.expression_paths(c) for c in e.components])
+
+        children = [e.get_attr(attr) for attr in ('left', 'right', 'expr', 'e0', 'e1', 'e2')]
+        return self.sequence(*[self.expression_paths(c) for c in children if c is not None])
+
+    def call_paths(self, call):
+        m = call.method
+        args = list(call.arguments) if call.get_attr('arguments') is not None and call.arguments.is_vec() else []
+        member = m.get_attr('member')
+
+        if member == 'apply' and m.expr.get_attr('ref') is not None and m.expr.ref.node_type == 'P4Table':
+            return self.table_paths(m.expr.ref, call)
+        if member == 'isValid':
+            return [Path()]
+        if member in ('setValid', 'setInvalid'):
+            return single_path(**{'validity changes': 1})
+        if member == 'emit':
+            width = header_byte_width(args[0]) if args != [] else 0
+            # the emitted headers are stored and copied back into the packet
+            return single_path(**{'emits': 1, 'bytes copied': 2 * width})
+
+        ref = m.get_attr('ref')
+        if ref is not None and ref.node_type == 'P4Action':
+            return self.sequence(single_path(**{'action calls': 1}), self.statement_paths(ref.body))
+        if ref is not None and ref.get_attr('name') == 'digest':
+            return single_path(**{'digests': 1})
+
+        return self.sequence(single_path(**{'extern calls': 1}), *[self.expression_paths(arg) for arg in args])
+
+    def table_paths(self, table, call):
+        counts = collections.Counter()
+        if is_static_table(table):
+            counts['static lookups'] += 1
+        elif hasattr(table, 'key'):
+            shared_key = call.get_attr('shared_key')
+            if shared_key is None or shared_key.is_first:
+                counts['key calculations'] += 1
+                counts['field reads'] += len(table.key.keyElements)
+            counts[table.match_type.lower() + ' lookups'] += 1
+        lookup = [Path([], counts)]
+
+        actions = []
+        for action in table.actions:
+            action_object = action.action_object
+            step = "{}: {}".format(table.name, action_object.name)
+            actions += self.sequence(single_path(step, **{'action calls': 1}), self.statement_paths(action_object.body))
+
+        return self.sequence(lookup, self.limit(actions) if actions != [] else [Path()])
+
+    # --------------------------------------------------------------------------
+    # Statements
+
+    def statement_paths(self, stmt):
+        if stmt is None or not hasattr(stmt, 'node_type'):
+            return [Path()]
+
+        if stmt.node_type == 'BlockStatement':
+            return self.sequence(*[self.statement_paths(c) for c in stmt.components])
+
+        if stmt.node_type == 'AssignmentStatement':
+            dst = stmt.left
+            if dst.get_attr('field_ref') is not None:
+                write = single_path(**{'field writes': 1})
+            elif dst.get_attr('header_ref') is not None:
+                write = single_path(**{'header copies': 1, 'bytes copied': header_byte_width(dst)})
+            else:
+                write = [Path()]
+            return self.sequence(self.expression_paths(stmt.right), write)
+
+        if stmt.node_type == 'IfStatement':
+            branches = self.alternatives(
+                self.statement_paths(stmt.get_attr('ifTrue')),
+                self.statement_paths(stmt.get_attr('ifFalse')))
+            return self.sequence(self.expression_paths(stmt.condition), branches)
+
+        if stmt.node_type == 'SwitchStatement':
+            cases = [self.statement_paths(case.statement) for case in stmt.cases if case.get_attr('statement') is not None]
+            return self.sequence(self.expression_paths(stmt.expression), self.alternatives(*cases) if cases != [] else [Path()])
+
+        if stmt.node_type == 'MethodCallStatement':
+            return self.call_paths(stmt.methodCall)
+
+        return [Path()]
+
+    # --------------------------------------------------------------------------
+    # Parser and controls
+
+    def state_paths(self, state):
+        counts = collections.Counter()
+        paths = [Path([state.name])]
+        for c in state.components:
+            if c.get_attr('call') == 'extract_header':
+                hdr = c.header
+                hdrtype = hdr.type.type_ref if hasattr(hdr.type, 'type_ref') else hdr.type
+                counts['header extracts'] += 1
+                if c.is_tmp:
+                    counts['bytes copied'] += hdrtype.byte_width
+                else:
+                    header_ref = hdr.get_attr('header_ref')
+                    for f in hdrtype.fields:
+                        if f.get_attr('preparsed') and f.size <= 32 and (header_ref is None or is_live_field(self.hlir16, header_ref, f)):
+                            counts['field reads'] += 1
+            elif c.get_attr('node_type') is not None:
+                paths = self.sequence(paths, self.statement_paths(c))
+
+        if state.get_attr('selectExpression') is not None and state.selectExpression.node_type == 'SelectExpression':
+            counts['select evaluations'] += 1
+            paths = self.sequence(paths, self.expression_paths(state.selectExpression.select))
+
+        return self.sequence(paths, [Path([], counts)])
+
+    def next_states(self, state):
+        select = state.get_attr('selectExpression')
+        if select is None:
+            return []
+        if select.node_type == 'PathExpression':
+            return [select.ref.name]
+        return [case.state.ref.name for case in select.selectCases]
+
+    def parser_paths(self, parser):
+        states = {s.name: s for s in parser.states}
+        state_paths = {}
+
+        paths = []
+        todo = [(['start'], Path())]
+        while todo:
+            names, path = todo.pop()
+            state = states.get(names[-1])
+            if state is None or state.get_attr('node_type') != 'ParserState':
+                paths.append(path)
+                continue
+
+            if state.name not in state_paths:
+                state_paths[state.name] = self.state_paths(state)
+
+            for state_path in state_paths[state.name]:
+                next_path = path.then(state_path)
+                next_names = self.next_states(state)
+                if next_names == []:
+                    paths.append(next_path)
+                for name in next_names:
+                    # loops (e.g. header stacks) are followed only once
+                    if name in names:
+                        paths.append(next_path)
+                        continue
+                    if len(paths) + len(todo) >= max_paths:
+                        self.truncated = True
+                        paths.append(next_path)
+                        continue
+                    todo.append((names + [name], next_path))
+
+        return self.limit(paths)
+
+    def control_paths(self, control):
+        return self.statement_paths(control.body)
+
+
+def path_report(path):
+    return {
+        'steps': list(path.steps),
+        'counts': dict(path.counts),
+        'estimate': estimate(path.counts),
+    }
+
+
+def section_report(name, paths, truncated):
+    paths = sorted(paths, key=lambda p: -estimate(p.counts))
+    estimates = [estimate(p.counts) for p in paths]
+    return {
+        'name': name,
+        'path_count': len(paths),
+        'truncated': truncated,
+        'min': min(estimates) if estimates != [] else 0,
+        'max': max(estimates) if estimates != [] else 0,
+        'paths': [path_report(p) for p in paths],
+    }
+
+
+def get_cost_report(hlir16):
+    """The estimated costs of the parser and the controls of the pipeline, in a JSON compatible form."""
+    sections = []
+
+    parsers = hlir16.declarations['P4Parser']
+    if len(parsers) > 0:
+        model = CostModel(hlir16)
+        sections.append(section_report("parser " + parsers[0].name, model.parser_paths(parsers[0]), model.truncated))
+
+    for pe in get_main(hlir16).arguments:
+        ctl = hlir16.index.declarations_by_type.get((pe.type.name, 'P4Control'))
+        if ctl is None:
+            continue
+        model = CostModel(hlir16)
+        sections.append(section_report("control " + ctl.name, model.control_paths(ctl), model.truncated))
+
+    return {
+        'weights': cost_weights,
+        'sections': sections,
+        'min': sum(s['min'] for s in sections),
+        'max': sum(s['max'] for s in sections),
+    }
+
+
+def format_cost_report(report):
+    lines = ["Estimated per-packet cost: {:g} to {:g} cycles".format(report['min'], report['max']), ""]
+    for section in report['sections']:
+        lines.append("{}: {} paths{}, {:g} to {:g} cycles".format(
+            section['name'], section['path_count'], " (truncated)" if section['truncated'] else "", section['min'], section['max']))
+
+        for path in section['paths']:
+            counts = ", ".join("{} {:g}".format(name, count) for name, count in sorted(path['counts'].items()) if count != 0)
+            lines.append("    {:8g}  {}".format(path['estimate'], " -> ".join(path['steps']) or "(no branches)"))
+            lines.append("              {}".format(counts or "(nothing)"))
+        lines.append("")
+
+    return "\n".join(lines)
+
+
+def format_cost_report_json(report):
+    return json.dumps(report, indent=4, sort_keys=True)
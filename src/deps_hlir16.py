@@ -0,0 +1,197 @@
+# Copyright 2018 Eotvos Lorand University, Budapest, Hungary
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#!/usr/bin/env python
+
+"""Records which parts of the HLIR a template reads.
+
+Each node reachable from the root gets a path that stays the same
+across compilations as long as the surrounding declarations do not change,
+e.g. hlir16.declarations[ingress].body.components[#2].
+Vector elements are identified by their name if it is unique in the vector,
+otherwise by their index.
+
+While a template runs, every attribute read on a node is recorded
+as a (node path, attribute name, fingerprint of the value) triple.
+The output of the template can only change if one of these values changes.
+Nodes that are not reachable from the root are created by the templates themselves,
+they are not recorded.
+
+The paths are computed by get_node_paths when the HLIR is built,
+and they are saved into the HLIR snapshot (see snapshot_hlir16),
+so that the nodes of a loaded snapshot are not materialized just to find their paths.
+Wherever the paths are used, they are only looked up with get,
+so the dictionaries of get_node_paths and the lookups of the snapshot are interchangeable.
+"""
+
+from __future__ import print_function
+
+import collections
+import hashlib
+import os
+
+from hlir16.p4node import P4Node
+
+ROOT_PATH = "hlir16"
+
+MISSING = object()
+
+# the DependencyRecorder that is active in this process, if any
+active_recorder = None
+
+
+def get_children(value):
+    """Yields (path segment, child) pairs of a node or a container."""
+    if isinstance(value, P4Node):
+        attrs = value.__dict__
+        for name in sorted(attrs):
+            yield "." + name, attrs[name]
+    elif type(value) in (list, tuple):
+        names = [elem.__dict__.get('name') if isinstance(elem, P4Node) else None for elem in value]
+        counts = collections.Counter(names)
+        for idx, (name, elem) in enumerate(zip(names, value)):
+            if type(name) in (str, unicode) and counts[name] == 1:
+                yield "[{}]".format(name), elem
+            else:
+                yield "[#{}]".format(idx), elem
+    elif type(value) is dict:
+        for key in sorted(value, key=repr):
+            yield "{{{}}}".format(repr(key)), value[key]
+
+
+def get_node_paths(root):
+    """Returns the path of each node (keyed by the id of the node)
+    and the nodes by their paths."""
+    paths = {id(root): ROOT_PATH}
+    nodes = {ROOT_PATH: root}
+
+    todo = collections.deque([(root, ROOT_PATH)])
+    while todo:
+        value, path = todo.popleft()
+        for segment, child in get_children(value):
+            if isinstance(child, P4Node):
+                if id(child) in paths:
+                    continue
+                paths[id(child)] = path + segment
+                nodes[path + segment] = child
+                todo.append((child, path + segment))
+            elif type(child) in (list, tuple, dict):
+                todo.append((child, path + segment))
+
+    return paths, nodes
+
+
+def describe(value, paths):
+    """A textual description of the value; nodes are described by their paths."""
+    if value is MISSING:
+        return "<missing>"
+    if isinstance(value, P4Node):
+        return "@" + paths.get(id(value), "?")
+    if type(value) in (list, tuple):
+        return "{}[{}]".format(type(value).__name__, ",".join(describe(elem, paths) for elem in value))
+    if type(value) in (set, frozenset):
+        return "set[{}]".format(",".join(sorted(describe(elem, paths) for elem in value)))
+    if type(value) is dict:
+        items = sorted(describe(k, paths) + ":" + describe(v, paths) for k, v in value.items())
+        return "dict[{}]".format(",".join(items))
+    if type(value) is unicode:
+        return repr(value.encode('utf-8'))
+    return repr(value)
+
+
+def fingerprint(value, paths):
+    return hashlib.sha1(describe(value, paths)).hexdigest()
+
+
+class DependencyRecorder(object):
+    """While active, records the attribute reads on all nodes.
+
+    The reads are caught by replacing the __getattribute__ of the P4Node class,
+    since the templates can reach the nodes through references
+    (e.g. the index held by the code generator helpers) that no per-node hook would cover.
+    The replacement only records while the recorder is active, and only in the process that activated it,
+    so a process forked meanwhile (see compiler_daemon.py) does not record into its copy.
+    Only one recorder can be active at a time."""
+
+    def __init__(self, paths):
+        self.paths = paths
+        self.reads = {}
+        self.pid = None
+
+    def record(self, node, name, value):
+        key = (id(node), name)
+        if key in self.reads:
+            return
+
+        path = self.paths.get(id(node))
+        if path is None or os.getpid() != self.pid:
+            return
+
+        self.reads[key] = (path, name, fingerprint(value, self.paths))
+
+    def __enter__(self):
+        global active_recorder
+        if active_recorder is not None:
+            raise RuntimeError("another dependency recorder is already active")
+
+        self.pid = os.getpid()
+        self.orig_getattribute = P4Node.__dict__.get('__getattribute__')
+        base_getattribute = P4Node.__getattribute__
+
+        def recording_getattribute(node, name):
+            recorder = active_recorder
+            if recorder is None:
+                return base_getattribute(node, name)
+
+            try:
+                value = base_getattribute(node, name)
+            except AttributeError:
+                recorder.record(node, name, MISSING)
+                raise
+
+            if name == '__dict__' or name in object.__getattribute__(node, '__dict__'):
+                recorder.record(node, name, value)
+            return value
+
+        active_recorder = self
+        P4Node.__getattribute__ = recording_getattribute
+        return self
+
+    def __exit__(self, type, value, traceback):
+        global active_recorder
+        active_recorder = None
+        if self.orig_getattribute is None:
+            del P4Node.__getattribute__
+        else:
+            P4Node.__getattribute__ = self.orig_getattribute
+
+    def get_reads(self):
+        return sorted(self.reads.values())
+
+
+def reads_unchanged(reads, paths, nodes):
+    """Returns True iff all recorded reads give the same values in the current HLIR."""
+    for path, name, recorded in reads:
+        node = nodes.get(path)
+        if node is None:
+            return False
+
+        try:
+            value = getattr(node, name)
+        except AttributeError:
+            value = MISSING
+
+        if fingerprint(value, paths) != recorded:
+            return False
+
+    return True
@@ -0,0 +1,294 @@
+# Copyright 2018 Eotvos Lorand University, Budapest, Hungary
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# Translating the sugared syntax of the templates into Python (not using HLIR)
+
+"""The templates (and the .sugar.py files) are Python code with the following constructs:
+
+    #[ text     appends the text as a line of generated code
+    #{ text     the same, and the following lines are indented one more level
+    #} text     the same, and this line is indented one level less
+    #= expr     appends the value of the expression
+    $var        inserts the value of a variable into the text
+    ${expr}     inserts the value of an expression
+    $$[light][text1]{expr}{text2}
+                inserts the expression highlighted (the parts in [] and the second {} are optional)
+
+The file is translated in a single pass over its lines.
+Each #[ line is processed by one scan of a precompiled pattern
+that recognises both kinds of inserts.
+"""
+
+import os
+import re
+
+from utils.misc import addError
+
+
+header = """
+# Autogenerated file (from {0}), do not modify directly.
+# Generator: T4P4S (https://github.com/P4ELTE/t4p4s/)
+
+from utils.emitter import CodeBuffer
+
+global file_indentation_level
+file_indentation_level = 0
+
+# The last element is the innermost (current) style.
+file_sugar_style = ['line_comment']
+
+
+def indent():
+    global file_indentation_level
+    return '{1}' * file_indentation_level
+
+
+class SugarStyle():
+    def __init__(self, sugar):
+        global file_sugar_style
+        file_sugar_style.append(sugar)
+
+    def __enter__(self):
+        global file_sugar_style
+        return file_sugar_style[-1]
+
+    def __exit__(self, type, value, traceback):
+        global file_sugar_style
+        file_sugar_style.pop()
+
+
+def sugar(file, line):
+    import re
+    global file_sugar_style
+    sugar_file = re.sub("[.].*$", "", file)
+    if file_sugar_style[-1] == 'line_comment':
+        # if file == "{2}":
+        #     return ' // @' + str(line) + '\\n'
+        return ' // ' + sugar_file + '@' + str(line) + '\\n'
+    if file_sugar_style[-1] == 'inline_comment':
+        # if file == "{2}":
+        #     return '\\n/* @' + str(line) + '*/'
+        return '\\n/* ' + sugar_file + '@' + str(line) + '*/'
+    return ''
+
+
+"""
+
+# $$[light][text1]{expr}{text2} (all parts except {expr} are optional) or $var
+insert_pattern = re.compile(r'(?P<type>\$\$?)(?:\[(?P<light>[^\]]+)\])?(?:\[(?P<text1>[^\]]+)\])?{\s*(?P<expr>[^}]*)\s*}(?:{(?P<text2>[^}]+)})?'
+                            r'|\$(?P<var>[a-zA-Z0-9_]*)')
+
+expr_insert_pattern = re.compile(r'(?P<type>\$\$?)(?:\[(?P<light>[^\]]+)\])?(?:\[(?P<text1>[^\]]+)\])?{\s*(?P<expr>[^}]*)\s*}(?:{(?P<text2>[^}]+)})?')
+var_insert_pattern = re.compile(r'\$([a-zA-Z0-9_]*)')
+
+gen_markers = ('#[', '#{', '#}')
+
+
+def escape(text):
+    """Backslashes and quotes may appear in #[ parts."""
+    if '\\' in text:
+        text = text.replace('\\', '\\\\')
+    if '"' in text:
+        text = text.replace('"', '\\"')
+    return text
+
+
+def replace_vars(text):
+    if '$' not in text:
+        return text
+    return var_insert_pattern.sub(r'" + str(\1) + "', text)
+
+
+def format_insert(kind, light, txt1, expr, txt2):
+    # no highlighting
+    if kind == '$':
+        return '{}" + str({}) + "{}'.format(txt1, expr, txt2)
+
+    light_param = "," + light if light not in (None, "") else ""
+    return '\\" T4LIT({}" + str({}) + "{}{}) \\"'.format(txt1, expr, txt2, light_param)
+
+
+def replace_inserts_in_two_passes(content):
+    """Replaces the inserts in an escaped text: first the ${expr} inserts, then the $var inserts
+    in the result, including the ones in the parts of the replaced ${expr} inserts."""
+    def replacer(m):
+        return format_insert(m.group('type'), m.group('light'), m.group('text1') or '', m.group('expr'), m.group('text2') or '')
+
+    return replace_vars(expr_insert_pattern.sub(replacer, content))
+
+
+def replace_inserts(content):
+    """Returns the (unescaped) text of a #[ part as the contents of a Python string literal
+    with the inserts replaced."""
+    if '$' not in content:
+        return escape(content)
+
+    parts = []
+    pos = 0
+    var_end = None
+    for m in insert_pattern.finditer(content):
+        parts.append(escape(content[pos:m.start()]))
+        pos = m.end()
+
+        if m.group('var') is not None:
+            parts.append('" + str({}) + "'.format(m.group('var')))
+            var_end = pos
+            continue
+
+        kind = m.group('type')
+        txt1 = escape(m.group('text1') or '')
+        txt2 = escape(m.group('text2') or '')
+
+        # In a ${} insert, a $var that is directly before the first text or at the end of the second text
+        # would continue into the text around the insert; the two-pass replacement handles these cases.
+        if kind == '$' and ((txt1 != '' and var_end == m.start()) or '$' in txt2):
+            return replace_inserts_in_two_passes(escape(content))
+
+        light = m.group('light')
+        if light is not None:
+            light = replace_vars(escape(light))
+        parts.append(format_insert(kind, light, replace_vars(txt1), replace_vars(escape(m.group('expr'))), replace_vars(txt2)))
+
+    parts.append(escape(content[pos:]))
+    return "".join(parts)
+
+
+class Translator(object):
+    """Translates one sugared file."""
+
+    def __init__(self, file, desugar_info, indent_str="    ", add_lines=True):
+        self.file = file
+        self.desugar_info = desugar_info
+        self.indent_str = indent_str
+        self.add_lines = add_lines
+
+        self.basename = os.path.basename(file)
+        self.sugar_filename = re.sub("([.]sugar)?[.]py", "", self.basename)
+
+        self.indentation_level = 0
+        self.out = []
+
+        # state of add_gen_line
+        self.is_inside_gen = False
+
+        # state of add_line
+        self.last_indent = 0
+        self.already_added = False
+
+    def translate(self, code, prefix_lines=""):
+        """Returns the code transformed into runnable Python code."""
+        self.out = prefix_lines.splitlines()
+        self.out += header.format(self.file, self.indent_str, self.basename).splitlines()
+
+        for idx, line in enumerate(code.splitlines()):
+            self.add_gen_line(idx, line)
+
+        if self.is_inside_gen:
+            self.end_gen()
+
+        if self.indentation_level != 0:
+            addError("Compiler", "Non-zero indentation level ({}) at end of file: {}".format(self.indentation_level, self.file))
+
+        return '\n'.join(self.out)
+
+    def end_gen(self):
+        self.add_line(None, '    return generated_code.text()')
+        self.add_line(None, '')
+        self.is_inside_gen = False
+
+    def add_gen_line(self, idx, line):
+        """If a function's name starts with 'gen_' in a generated file,
+        that function produces code.
+        Its generated_code variable is initialised at the start of the function,
+        and returned at its end (the first unindented line) and at each bare "return"."""
+        if self.is_inside_gen:
+            code = line.lstrip(' \t')
+            if code.rstrip(' \t') == 'return':
+                line = line[:len(line) - len(code)] + 'return generated_code.text()'
+
+            if line != '' and line[0] not in ' \t':
+                self.end_gen()
+
+        if line.startswith('def gen_'):
+            self.add_line(idx, line)
+            self.add_line(None, '    generated_code = CodeBuffer()')
+            self.is_inside_gen = True
+            return
+
+        self.add_line(idx, line)
+
+    def add_line(self, idx, line):
+        """Empty lines are removed, except for the first one after an unindented line,
+        after which an empty line of generated code is inserted (without a line number).
+        The remaining line numbers are 1-based."""
+        if not self.add_lines:
+            self.translate_line(idx, line)
+            return
+
+        if not line.strip():
+            if self.last_indent == 0 and not self.already_added:
+                self.translate_line(idx, line)
+                self.translate_line(None, "#[")
+                self.already_added = True
+            return
+
+        self.translate_line(idx + 1 if idx is not None else None, line)
+        self.last_indent = len(line) - len(line.lstrip())
+        self.already_added = False
+
+    def translate_line(self, idx, line):
+        code = line.lstrip(' \t')
+        marker = code[:2]
+        if marker in gen_markers:
+            self.out.append(self.translate_gen_line(idx, line, line[:len(line) - len(code)], code[2:]))
+        elif marker == '#=' and code[2:3] == ' ':
+            new_line = line[:len(line) - len(code)] + 'generated_code += str(' + code[2:] + ')'
+            if self.desugar_info == "comment":
+                new_line += " # {}@{}".format(self.sugar_filename, idx)
+            self.out.append(new_line)
+        else:
+            self.out.append(line)
+
+    def translate_gen_line(self, line_idx, line, indentation, content):
+        """Transforms a line with a #[ (or #{, or #}) part to a Python code section.
+        Since Python code is generated, indentation has to be respected."""
+        pre_indentation_mod = ""
+        post_indentation_mod = ""
+        # #} unindents starting this line
+        if '#}' in line:
+            if self.indentation_level == 0:
+                addError("Compiler", "Too much unindent in {}:{}".format(self.file, line_idx))
+            self.indentation_level -= 1
+            pre_indentation_mod = indentation + "file_indentation_level -= 1\n"
+
+        # #{ starts a new indentation level from the next line
+        if '#{' in line:
+            self.indentation_level += 1
+            post_indentation_mod = "\n" + indentation + "file_indentation_level += 1"
+
+        content = replace_inserts(content).strip()
+
+        # add a comment that shows where the line is generated at
+        if content and line_idx is not None:
+            if self.desugar_info == "comment":
+                content += '" + sugar("{}", {}) + "'.format(self.basename, line_idx)
+            if self.desugar_info == "pragma":
+                content = '#line %d \\"%s\\"\\n%s' % (line_idx, "../../" + self.file, content)
+
+        return '{}{}generated_code += indent() + "{}"{}'.format(pre_indentation_mod, indentation, content, post_indentation_mod)
+
+
+def translate_file_contents(file, code, desugar_info, indent_str="    ", prefix_lines="", add_lines=True):
+    """Returns the code transformed into runnable Python code.
+       Translated are #[generated_code, #=generator_expression and ${var} constructs."""
+    return Translator(file, desugar_info, indent_str, add_lines).translate(code, prefix_lines)
@@ -0,0 +1,89 @@
+// Copyright 2018 Eotvos Lorand University, Budapest, Hungary
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//     http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+
+
+// The counters of the instrument option (see dpdk_instrument.h).
+// They are printed when the switch exits.
+
+#include "dpdk_lib.h"
+
+#include <rte_cycles.h>
+
+instr_lcore_t instr_lcores[RTE_MAX_LCORE];
+
+static double cycles_to_ns(double cycles) {
+    return cycles * 1e9 / rte_get_tsc_hz();
+}
+
+// The upper bound of the latency bucket that contains the given fraction of the packets.
+static uint64_t latency_percentile(instr_lcore_t* lcore, double fraction) {
+    uint64_t seen = 0;
+    for (int i = 0; i < INSTR_LATENCY_BUCKETS; ++i) {
+        seen += lcore->latency[i];
+        if (seen >= fraction * lcore->packets) {
+            return (uint64_t)2 << i;
+        }
+    }
+    return (uint64_t)2 << (INSTR_LATENCY_BUCKETS - 1);
+}
+
+static void dump_stages(instr_lcore_t* lcore) {
+    printf("    %-40s %14s %18s %12s\n", "stage", "calls", "cycles", "cycles/call");
+    for (int stage = 0; stage < INSTR_STAGE_COUNT; ++stage) {
+        instr_counter_t* counter = &lcore->stages[stage];
+        if (counter->calls == 0) {
+            continue;
+        }
+        printf("    %-40s %14" PRIu64 " %18" PRIu64 " %12.1f\n", instr_stage_names[stage],
+               counter->calls, counter->cycles, (double)counter->cycles / counter->calls);
+    }
+}
+
+static void dump_latency(instr_lcore_t* lcore) {
+    if (lcore->packets == 0) {
+        return;
+    }
+
+    printf("    latency of %" PRIu64 " packets: p50 < %" PRIu64 " cycles (%.0f ns), p99 < %" PRIu64 " cycles (%.0f ns)\n",
+           lcore->packets,
+           latency_percentile(lcore, 0.5),  cycles_to_ns(latency_percentile(lcore, 0.5)),
+           latency_percentile(lcore, 0.99), cycles_to_ns(latency_percentile(lcore, 0.99)));
+
+    for (int i = 0; i < INSTR_LATENCY_BUCKETS; ++i) {
+        if (lcore->latency[i] == 0) {
+            continue;
+        }
+        printf("    %12" PRIu64 " - %12" PRIu64 " cycles %14" PRIu64 " packets\n", (uint64_t)1 << i, ((uint64_t)2 << i) - 1, lcore->latency[i]);
+    }
+}
+
+void instr_dump() {
+    printf("Instrumentation counters (TSC: %" PRIu64 " Hz)\n", rte_get_tsc_hz());
+
+    for (unsigned lcore_id = 0; lcore_id < RTE_MAX_LCORE; ++lcore_id) {
+        instr_lcore_t* lcore = &instr_lcores[lcore_id];
+
+        bool is_used = lcore->packets > 0;
+        for (int stage = 0; stage < INSTR_STAGE_COUNT; ++stage) {
+            is_used |= lcore->stages[stage].calls > 0;
+        }
+        if (!is_used) {
+            continue;
+        }
+
+        printf("  lcore %u\n", lcore_id);
+        dump_stages(lcore);
+        dump_latency(lcore);
+    }
+}
@@ -101,6 +101,16 @@ uint8_t* make_table_entry_on_socket(lookup_table_t* t, uint8_t* value) {
     return entry;
 }
 
+// ============================================================================
+// Bulk lookups
+
+// Used by the bulk lookups of keyless tables and the lookups without a match.
+void set_default_results(lookup_table_t* t, unsigned count, uint8_t* results[]) {
+    for (unsigned i = 0; i < count; ++i) {
+        results[i] = t->default_val;
+    }
+}
+
 // ============================================================================
 // Table implementations
 
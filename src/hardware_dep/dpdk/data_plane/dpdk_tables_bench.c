@@ -0,0 +1,189 @@
+// Copyright 2018 Eotvos Lorand University, Budapest, Hungary
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//     http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+
+
+// Microbenchmarks of the table lookups, enabled by the lookup_bench option.
+// Tables of each match kind are filled with random entries,
+// then the same keys are looked up with the single key and the bulk lookup functions.
+// The lookups per second are printed, and the switch exits without processing packets.
+
+#include "dpdk_lib.h"
+
+#include <rte_cycles.h>
+#include <rte_malloc.h>
+#include <rte_random.h>
+
+extern void create_table(lookup_table_t* t, int socketid);
+extern void table_set_default_action(lookup_table_t* t, uint8_t* entry);
+
+// the number of different keys that are looked up
+#define BENCH_KEY_COUNT (1 << 16)
+// how many times all of the keys are looked up
+#define BENCH_ROUNDS    32
+// the number of keys given to one call of a bulk lookup
+#define BENCH_BURST     32
+
+typedef uint8_t* (*single_lookup_t)(lookup_table_t* t, uint8_t* key);
+typedef void     (*bulk_lookup_t)(lookup_table_t* t, uint8_t* keys[], unsigned count, uint8_t* results[]);
+
+typedef struct lookup_bench_s {
+    const char*     name;
+    uint8_t         type;
+    uint8_t         key_size;
+    int             entry_count;
+    single_lookup_t single_lookup;
+    bulk_lookup_t   bulk_lookup;
+} lookup_bench_t;
+
+// The exact tables can hold at most HASH_ENTRIES entries, the ternary tables at most 255.
+static lookup_bench_t lookup_benches[] = {
+    { "exact_4",    LOOKUP_EXACT,    4,  512, exact_lookup,   exact_lookup_bulk },
+    { "exact_16",   LOOKUP_EXACT,   16,  512, exact_lookup,   exact_lookup_bulk },
+    { "lpm_4",      LOOKUP_LPM,      4,  512, lpm_lookup,     lpm_lookup_bulk },
+    { "lpm_16",     LOOKUP_LPM,     16,  512, lpm_lookup,     lpm_lookup_bulk },
+    { "ternary_4",  LOOKUP_TERNARY,  4,  200, ternary_lookup, ternary_lookup_bulk },
+};
+
+static void random_bytes(uint8_t* dst, int size) {
+    for (int i = 0; i < size; ++i) {
+        dst[i] = (uint8_t)rte_rand();
+    }
+}
+
+static void init_bench_table(lookup_table_t* t, lookup_bench_t* bench, unsigned bench_idx, int socketid) {
+    memset(t, 0, sizeof(lookup_table_t));
+    t->name = (char*)bench->name;
+    // the names of the DPDK tables are made from the ids, they have to be different
+    t->id = 1000 + bench_idx;
+    t->type = bench->type;
+    t->min_size = bench->entry_count;
+    t->max_size = bench->entry_count;
+
+    t->entry.key_size = bench->key_size;
+    t->entry.action_size = sizeof(int);
+    t->entry.validity_size = sizeof(bool);
+    t->entry.state_size = 0;
+    t->entry.entry_size = t->entry.action_size + t->entry.validity_size + t->entry.state_size;
+
+    create_table(t, socketid);
+
+    int action_id = 0;
+    table_set_default_action(t, (uint8_t*)&action_id);
+}
+
+// Half of the looked up keys are in the table, the other half are random.
+static void fill_bench_table(lookup_table_t* t, lookup_bench_t* bench, uint8_t* keys[]) {
+    uint8_t key[16];
+    uint8_t mask[16];
+    int action_id = 0;
+
+    uint8_t* entry_keys = rte_malloc("uint8_t", bench->entry_count * bench->key_size, 0);
+    for (int i = 0; i < bench->entry_count; ++i) {
+        uint8_t* entry_key = entry_keys + i * bench->key_size;
+        random_bytes(entry_key, bench->key_size);
+
+        switch (bench->type) {
+            case LOOKUP_EXACT:
+                exact_add(t, entry_key, (uint8_t*)&action_id);
+                break;
+            case LOOKUP_LPM:
+                lpm_add(t, entry_key, 8 + rte_rand() % (8 * bench->key_size - 7), (uint8_t*)&action_id);
+                break;
+            case LOOKUP_TERNARY:
+                random_bytes(mask, bench->key_size);
+                ternary_add(t, entry_key, mask, (uint8_t*)&action_id);
+                break;
+        }
+    }
+
+    for (int i = 0; i < BENCH_KEY_COUNT; ++i) {
+        if (i % 2 == 0) {
+            memcpy(keys[i], entry_keys + (rte_rand() % bench->entry_count) * bench->key_size, bench->key_size);
+        } else {
+            random_bytes(key, bench->key_size);
+            memcpy(keys[i], key, bench->key_size);
+        }
+    }
+
+    rte_free(entry_keys);
+}
+
+static uint64_t bench_single(lookup_table_t* t, lookup_bench_t* bench, uint8_t* keys[], uint8_t* results[]) {
+    uint64_t start = rte_rdtsc();
+    for (int round = 0; round < BENCH_ROUNDS; ++round) {
+        for (int i = 0; i < BENCH_KEY_COUNT; ++i) {
+            results[i] = bench->single_lookup(t, keys[i]);
+        }
+    }
+    return rte_rdtsc() - start;
+}
+
+static uint64_t bench_bulk(lookup_table_t* t, lookup_bench_t* bench, uint8_t* keys[], uint8_t* results[]) {
+    uint64_t start = rte_rdtsc();
+    for (int round = 0; round < BENCH_ROUNDS; ++round) {
+        for (int i = 0; i < BENCH_KEY_COUNT; i += BENCH_BURST) {
+            bench->bulk_lookup(t, &keys[i], RTE_MIN(BENCH_BURST, BENCH_KEY_COUNT - i), &results[i]);
+        }
+    }
+    return rte_rdtsc() - start;
+}
+
+static double lookups_per_sec(uint64_t cycles) {
+    return (double)BENCH_KEY_COUNT * BENCH_ROUNDS * rte_get_tsc_hz() / (cycles == 0 ? 1 : cycles);
+}
+
+void run_lookup_benchmarks() {
+    int socketid = rte_socket_id();
+
+    uint8_t*  key_storage    = rte_malloc("uint8_t", BENCH_KEY_COUNT * 16, 0);
+    uint8_t** keys           = rte_malloc("uint8_t*", BENCH_KEY_COUNT * sizeof(uint8_t*), 0);
+    uint8_t** single_results = rte_malloc("uint8_t*", BENCH_KEY_COUNT * sizeof(uint8_t*), 0);
+    uint8_t** bulk_results   = rte_malloc("uint8_t*", BENCH_KEY_COUNT * sizeof(uint8_t*), 0);
+    if (key_storage == NULL || keys == NULL || single_results == NULL || bulk_results == NULL) {
+        rte_exit(EXIT_FAILURE, "Could not allocate memory for the lookup benchmarks\n");
+    }
+
+    printf("%-10s %8s %16s %16s %8s\n", "table", "entries", "single lookup/s", "bulk lookup/s", "speedup");
+
+    for (unsigned b = 0; b < sizeof(lookup_benches) / sizeof(lookup_bench_t); ++b) {
+        lookup_bench_t* bench = &lookup_benches[b];
+
+        for (int i = 0; i < BENCH_KEY_COUNT; ++i) {
+            keys[i] = key_storage + i * bench->key_size;
+        }
+
+        lookup_table_t t;
+        init_bench_table(&t, bench, b, socketid);
+        fill_bench_table(&t, bench, keys);
+
+        uint64_t single_cycles = bench_single(&t, bench, keys, single_results);
+        uint64_t bulk_cycles   = bench_bulk(&t, bench, keys, bulk_results);
+
+        int mismatches = 0;
+        for (int i = 0; i < BENCH_KEY_COUNT; ++i) {
+            mismatches += single_results[i] != bulk_results[i];
+        }
+
+        printf("%-10s %8d %16.0f %16.0f %7.2fx\n", bench->name, bench->entry_count,
+               lookups_per_sec(single_cycles), lookups_per_sec(bulk_cycles), (double)single_cycles / (bulk_cycles == 0 ? 1 : bulk_cycles));
+        if (mismatches > 0) {
+            printf("    %d of the bulk lookup results differ from the single key lookup results\n", mismatches);
+        }
+    }
+
+    rte_free(key_storage);
+    rte_free(keys);
+    rte_free(single_results);
+    rte_free(bulk_results);
+}
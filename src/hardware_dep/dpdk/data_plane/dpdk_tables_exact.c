@@ -75,3 +75,22 @@ uint8_t* exact_lookup(lookup_table_t* t, uint8_t* key)
     int ret = rte_hash_lookup(ext->rte_table, key);
     return (ret < 0)? t->default_val : ext->content[ret%t->max_size];
 }
+
+void exact_lookup_bulk(lookup_table_t* t, uint8_t* keys[], unsigned count, uint8_t* results[])
+{
+    if (unlikely(t->entry.key_size == 0)) {
+        set_default_results(t, count, results);
+        return;
+    }
+
+    extended_table_t* ext = (extended_table_t*)t->table;
+    int32_t positions[RTE_HASH_LOOKUP_BULK_MAX];
+    for (unsigned start = 0; start < count; start += RTE_HASH_LOOKUP_BULK_MAX) {
+        unsigned n = RTE_MIN(count - start, (unsigned)RTE_HASH_LOOKUP_BULK_MAX);
+        rte_hash_lookup_bulk(ext->rte_table, (const void**)&keys[start], n, positions);
+        for (unsigned i = 0; i < n; ++i) {
+            int ret = positions[i];
+            results[start + i] = (ret < 0)? t->default_val : ext->content[ret%t->max_size];
+        }
+    }
+}
@@ -94,7 +94,7 @@ void lpm_add(lookup_table_t* t, uint8_t* key, uint8_t depth, uint8_t* value)
     }
     else if (t->entry.key_size <= 16)
     {
-        static uint8_t key128[16];
+        uint8_t key128[16];
         memset(key128, 0, 16);
         memcpy(key128, key, t->entry.key_size);
 
@@ -103,6 +103,22 @@ void lpm_add(lookup_table_t* t, uint8_t* key, uint8_t depth, uint8_t* value)
 }
 
 
+uint8_t* lpm_lookup_u32(lookup_table_t* t, uint32_t key32)
+{
+    if (t->entry.key_size == 0) return t->default_val;
+    extended_table_t* ext = (extended_table_t*)t->table;
+
+    table_index_t result;
+#if RTE_VERSION >= RTE_VERSION_NUM(16,04,0,0)
+    uint32_t result32;
+    int ret = rte_lpm_lookup(ext->rte_table, key32, &result32);
+    result = (table_index_t)result32;
+#else
+    int ret = rte_lpm_lookup(ext->rte_table, key32, &result);
+#endif
+    return ret == 0 ? ext->content[result] : t->default_val;
+}
+
 uint8_t* lpm_lookup(lookup_table_t* t, uint8_t* key)
 {
     if (t->entry.key_size == 0) return t->default_val;
@@ -113,19 +129,11 @@ uint8_t* lpm_lookup(lookup_table_t* t, uint8_t* key)
         uint32_t key32 = 0;
         memcpy(&key32, key, t->entry.key_size);
 
-        table_index_t result;
-#if RTE_VERSION >= RTE_VERSION_NUM(16,04,0,0)
-        uint32_t result32;
-        int ret = rte_lpm_lookup(ext->rte_table, key32, &result32);
-        result = (table_index_t)result32;
-#else
-        int ret = rte_lpm_lookup(ext->rte_table, key32, &result);
-#endif
-        return ret == 0 ? ext->content[result] : t->default_val;
+        return lpm_lookup_u32(t, key32);
     }
     else if(t->entry.key_size <= 16)
     {
-        static uint8_t key128[16];
+        uint8_t key128[16];
         memset(key128, 0, 16);
         memcpy(key128, key, t->entry.key_size);
 
@@ -135,3 +143,66 @@ uint8_t* lpm_lookup(lookup_table_t* t, uint8_t* key)
     }
     return NULL;
 }
+
+// The number of keys given to one call of the bulk lookup of DPDK.
+#define LPM_LOOKUP_BULK_MAX 64
+
+#if RTE_VERSION >= RTE_VERSION_NUM(16,04,0,0)
+typedef uint32_t lpm4_next_hop_t;
+#define LPM4_NEXT_HOP_MASK 0x00FFFFFF
+#else
+typedef uint16_t lpm4_next_hop_t;
+#define LPM4_NEXT_HOP_MASK 0x00FF
+#endif
+
+#if RTE_VERSION >= RTE_VERSION_NUM(17,05,0,0)
+typedef int32_t lpm6_next_hop_t;
+#else
+typedef int16_t lpm6_next_hop_t;
+#endif
+
+void lpm_lookup_bulk(lookup_table_t* t, uint8_t* keys[], unsigned count, uint8_t* results[])
+{
+    if (t->entry.key_size == 0 || t->entry.key_size > 16) {
+        set_default_results(t, count, results);
+        return;
+    }
+
+    extended_table_t* ext = (extended_table_t*)t->table;
+
+    for (unsigned start = 0; start < count; start += LPM_LOOKUP_BULK_MAX) {
+        unsigned n = RTE_MIN(count - start, (unsigned)LPM_LOOKUP_BULK_MAX);
+
+        if (t->entry.key_size <= 4)
+        {
+            uint32_t keys32[LPM_LOOKUP_BULK_MAX];
+            lpm4_next_hop_t next_hops[LPM_LOOKUP_BULK_MAX];
+            for (unsigned i = 0; i < n; ++i) {
+                keys32[i] = 0;
+                memcpy(&keys32[i], keys[start + i], t->entry.key_size);
+            }
+
+            rte_lpm_lookup_bulk(ext->rte_table, keys32, next_hops, n);
+
+            for (unsigned i = 0; i < n; ++i) {
+                bool found = (next_hops[i] & RTE_LPM_LOOKUP_SUCCESS) != 0;
+                results[start + i] = found ? ext->content[(table_index_t)(next_hops[i] & LPM4_NEXT_HOP_MASK)] : t->default_val;
+            }
+        }
+        else
+        {
+            uint8_t keys128[LPM_LOOKUP_BULK_MAX][16];
+            lpm6_next_hop_t next_hops[LPM_LOOKUP_BULK_MAX];
+            for (unsigned i = 0; i < n; ++i) {
+                memset(keys128[i], 0, 16);
+                memcpy(keys128[i], keys[start + i], t->entry.key_size);
+            }
+
+            rte_lpm6_lookup_bulk_func(ext->rte_table, keys128, next_hops, n);
+
+            for (unsigned i = 0; i < n; ++i) {
+                results[start + i] = next_hops[i] >= 0 ? ext->content[(table_index_t)next_hops[i]] : t->default_val;
+            }
+        }
+    }
+}
@@ -35,3 +35,17 @@ uint8_t* ternary_lookup(lookup_table_t* t, uint8_t* key)
     uint8_t* ret = naive_ternary_lookup(t->table, key);
     return ret == NULL ? t->default_val : ret;
 }
+
+// The naive ternary table has no bulk lookup, the keys are looked up one by one.
+void ternary_lookup_bulk(lookup_table_t* t, uint8_t* keys[], unsigned count, uint8_t* results[])
+{
+    if (t->entry.key_size == 0) {
+        set_default_results(t, count, results);
+        return;
+    }
+
+    for (unsigned i = 0; i < count; ++i) {
+        uint8_t* ret = naive_ternary_lookup(t->table, keys[i]);
+        results[i] = ret == NULL ? t->default_val : ret;
+    }
+}
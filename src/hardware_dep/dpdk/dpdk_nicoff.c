@@ -263,6 +263,12 @@ void free_packet(packet_descriptor_t* pd) {
     rte_free(pd->wrapper);
 }
 
+void free_packets(packet_descriptor_t* pds[], unsigned count) {
+    for (unsigned i = 0; i < count; ++i) {
+        free_packet(pds[i]);
+    }
+}
+
 bool is_packet_handled(packet_descriptor_t* pd, struct lcore_data* lcdata) {
     return get_cmd(lcdata).action == FAKE_PKT;
 }
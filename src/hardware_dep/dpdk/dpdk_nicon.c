@@ -232,6 +232,21 @@ void free_packet(packet_descriptor_t* pd) {
     rte_pktmbuf_free((struct rte_mbuf*)pd->data);
 }
 
+void free_packets(packet_descriptor_t* pds[], unsigned count) {
+    struct rte_mbuf* mbufs[count];
+    for (unsigned i = 0; i < count; ++i) {
+        mbufs[i] = (struct rte_mbuf*)pds[i]->wrapper;
+    }
+
+#if RTE_VERSION >= RTE_VERSION_NUM(21,11,0,0)
+    rte_pktmbuf_free_bulk(mbufs, count);
+#else
+    for (unsigned i = 0; i < count; ++i) {
+        rte_pktmbuf_free(mbufs[i]);
+    }
+#endif
+}
+
 
 void init_storage() {
     /* Needed for L2 multicasting - e.g. acting as a hub
@@ -0,0 +1,85 @@
+// Copyright 2018 Eotvos Lorand University, Budapest, Hungary
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//     http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+
+#ifndef DPDK_INSTRUMENT_H
+#define DPDK_INSTRUMENT_H
+
+// Cycle counters of the stages of the pipeline, enabled by the instrument option.
+// The stages (parser states, table lookups, actions, emit) are listed in the generated instrument.h.
+// Each lcore counts the calls and the TSC cycles of each stage,
+// and the latencies of its forwarded packets from receiving to sending them in a histogram.
+// Without the option, the macros below expand to nothing.
+
+#include "instrument.h"
+
+#ifdef T4P4S_INSTRUMENT
+
+#include <rte_cycles.h>
+#include <rte_lcore.h>
+
+// bucket i of the latency histogram counts the packets that took [2^i, 2^(i+1)) cycles
+#define INSTR_LATENCY_BUCKETS 32
+
+typedef struct instr_counter_s {
+    uint64_t calls;
+    uint64_t cycles;
+} instr_counter_t;
+
+typedef struct instr_lcore_s {
+    instr_counter_t stages[INSTR_STAGE_COUNT];
+    uint64_t        latency[INSTR_LATENCY_BUCKETS];
+    uint64_t        packets;
+} __rte_cache_aligned instr_lcore_t;
+
+// defined in dpdk_instrument.c
+extern instr_lcore_t instr_lcores[RTE_MAX_LCORE];
+extern void instr_dump();
+
+static inline void instr_record_stage(enum instr_stage_e stage, uint64_t start) {
+    instr_counter_t* counter = &instr_lcores[rte_lcore_id()].stages[stage];
+    counter->calls++;
+    counter->cycles += rte_rdtsc() - start;
+}
+
+// a stage that has processed a burst of packets at once counts as one call for each packet
+static inline void instr_record_stage_bulk(enum instr_stage_e stage, uint64_t start, unsigned count) {
+    instr_counter_t* counter = &instr_lcores[rte_lcore_id()].stages[stage];
+    counter->calls += count;
+    counter->cycles += rte_rdtsc() - start;
+}
+
+static inline void instr_record_latency(uint64_t start) {
+    uint64_t cycles = rte_rdtsc() - start;
+    int bucket = cycles == 0 ? 0 : 63 - __builtin_clzll(cycles);
+
+    instr_lcore_t* lcore = &instr_lcores[rte_lcore_id()];
+    lcore->latency[bucket < INSTR_LATENCY_BUCKETS ? bucket : INSTR_LATENCY_BUCKETS - 1]++;
+    lcore->packets++;
+}
+
+#define INSTR_START(start)          uint64_t start = rte_rdtsc()
+#define INSTR_STOP(stage, start)    instr_record_stage(stage, start)
+#define INSTR_STOP_BULK(stage, start, count) instr_record_stage_bulk(stage, start, count)
+#define INSTR_LATENCY(start)        instr_record_latency(start)
+
+#else
+
+#define INSTR_START(start)
+#define INSTR_STOP(stage, start)
+#define INSTR_STOP_BULK(stage, start, count)
+#define INSTR_LATENCY(start)
+
+#endif
+
+#endif // DPDK_INSTRUMENT_H
@@ -55,6 +55,7 @@
 
 #include "aliases.h"
 #include "stateful_memory.h"
+#include "dpdk_instrument.h"
 
 #define MAX_ETHPORTS RTE_MAX_ETHPORTS
 
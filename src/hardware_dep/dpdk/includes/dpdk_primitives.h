@@ -187,6 +187,11 @@ typedef struct bitfield_handle_s {
     memcpy(dst, fd.byte_addr, fd.bytewidth); \
 }
 
+// Extracts a field to the given destination with its bytes in reverse order [ONLY BYTE ALIGNED]
+#define EXTRACT_BYTEBUF_REVERSED(fd, dst) { \
+    for (int i = 0; i < fd.bytewidth; ++i) (dst)[fd.bytewidth - 1 - i] = fd.byte_addr[i]; \
+}
+
 
 /*******************************************************************************
    Interface
@@ -200,6 +205,9 @@ typedef struct bitfield_handle_s {
 #define EXTRACT_BYTEBUF_PACKET(pd , h, f, dst) EXTRACT_BYTEBUF(handle(header_desc_ins(pd , h), f), dst)
 #define EXTRACT_BYTEBUF_BUFFER(buf, w, f, dst) EXTRACT_BYTEBUF(handle(header_desc_buf(buf, w), f), dst)
 
+#define EXTRACT_BYTEBUF_REVERSED_PACKET(pd , h, f, dst) EXTRACT_BYTEBUF_REVERSED(handle(header_desc_ins(pd , h), f), dst)
+#define EXTRACT_BYTEBUF_REVERSED_BUFFER(buf, w, f, dst) EXTRACT_BYTEBUF_REVERSED(handle(header_desc_buf(buf, w), f), dst)
+
 #define EXTRACT_INT32_AUTO_PACKET(pd , h, f, dst) EXTRACT_INT32_AUTO(handle(header_desc_ins(pd , h), f), dst)
 #define EXTRACT_INT32_AUTO_BUFFER(buf, w, f, dst) EXTRACT_INT32_AUTO(handle(header_desc_buf(buf, w), f), dst)
 
@@ -42,4 +42,20 @@ typedef struct extended_table_s {
 // #define TABLE_MAX 100000
 #define TABLE_MAX 250000
 
+//=============================================================================
+// LPM lookup with a key of at most 4 bytes, given as the number that lpm_lookup would read from the key
+
+uint8_t*   lpm_lookup_u32 (struct lookup_table_s* t, uint32_t key32);
+
+//=============================================================================
+// Bulk lookups
+
+// The keys are looked up in the table together, the memory accesses of the lookups are pipelined where possible.
+// For each key, results[] gets the matching table entry, or the default value of the table if there is no match.
+// The key sizes and the returned entries are the same as with the single key lookups in backend.h.
+
+void    exact_lookup_bulk (struct lookup_table_s* t, uint8_t* keys[], unsigned count, uint8_t* results[]);
+void      lpm_lookup_bulk (struct lookup_table_s* t, uint8_t* keys[], unsigned count, uint8_t* results[]);
+void  ternary_lookup_bulk (struct lookup_table_s* t, uint8_t* keys[], unsigned count, uint8_t* results[]);
+
 #endif
@@ -64,13 +64,22 @@ extern void t4p4s_normal_exit();
 // TODO from...
 extern void init_control_plane();
 
+#ifdef T4P4S_LOOKUP_BENCH
+// defined in dpdk_tables_bench.c
+extern void run_lookup_benchmarks();
+#endif
+
 // defined in the generated file dataplane.c
 extern void handle_packet(packet_descriptor_t* pd, lookup_table_t** tables, parser_state_t* pstate, uint32_t portid);
+#ifdef T4P4S_BURST
+extern void handle_packet_burst(packet_descriptor_t* pds[], parser_state_t* pstates[], unsigned pkt_count, lookup_table_t** tables, uint32_t portid);
+#endif
 
 // defined separately for each example
 extern bool core_is_working(struct lcore_data* lcdata);
 extern bool receive_packet(packet_descriptor_t* pd, struct lcore_data* lcdata, unsigned pkt_idx);
 extern void free_packet(packet_descriptor_t* pd);
+extern void free_packets(packet_descriptor_t* pds[], unsigned count);
 extern bool is_packet_handled(packet_descriptor_t* pd, struct lcore_data* lcdata);
 extern void init_storage();
 extern void main_loop_pre_rx(struct lcore_data* lcdata);
@@ -100,30 +109,102 @@ void do_single_tx(struct lcore_data* lcdata, packet_descriptor_t* pd, unsigned q
     }
 }
 
-void do_single_rx(struct lcore_data* lcdata, packet_descriptor_t* pd, unsigned queue_idx, unsigned pkt_idx)
+void do_single_rx(struct lcore_data* lcdata, packet_descriptor_t* pd, parser_state_t* pstate, unsigned queue_idx, unsigned pkt_idx)
 {
     bool got_packet = receive_packet(pd, lcdata, pkt_idx);
 
     if (got_packet) {
 	    if (likely(is_packet_handled(pd, lcdata))) {
-	        handle_packet(pd, lcdata->conf->state.tables, &(lcdata->conf->state.parser_state), get_portid(lcdata, queue_idx));
+            INSTR_START(instr_rx_time);
+	        handle_packet(pd, lcdata->conf->state.tables, pstate, get_portid(lcdata, queue_idx));
             do_single_tx(lcdata, pd, queue_idx, pkt_idx);
+            // only the forwarded packets are measured
+            if (likely(!pd->dropped)) {
+                INSTR_LATENCY(instr_rx_time);
+            }
         }
     }
 
     main_loop_post_single_rx(lcdata, got_packet);
 }
 
-void do_rx(struct lcore_data* lcdata, packet_descriptor_t* pd)
+#ifdef T4P4S_BURST
+
+#ifndef MAX_PKT_BURST
+#define MAX_PKT_BURST 32
+#endif
+
+// The received packets are processed together by handle_packet_burst.
+// The dropped packets are collected while the others are sent, and they are freed together.
+void do_burst_rx(struct lcore_data* lcdata, packet_descriptor_t* pds, parser_state_t* pstates, unsigned queue_idx)
+{
+    packet_descriptor_t* handled_pds[MAX_PKT_BURST];
+    parser_state_t* handled_pstates[MAX_PKT_BURST];
+    bool got_packets[MAX_PKT_BURST];
+    unsigned handled_count = 0;
+#ifdef T4P4S_INSTRUMENT
+    uint64_t rx_times[MAX_PKT_BURST];
+#endif
+
+    unsigned pkt_count = get_pkt_count_in_group(lcdata);
+    if (pkt_count > MAX_PKT_BURST) {
+        pkt_count = MAX_PKT_BURST;
+    }
+
+    for (unsigned pkt_idx = 0; pkt_idx < pkt_count; pkt_idx++) {
+        packet_descriptor_t* pd = &pds[pkt_idx];
+        got_packets[pkt_idx] = receive_packet(pd, lcdata, pkt_idx);
+
+        if (got_packets[pkt_idx] && likely(is_packet_handled(pd, lcdata))) {
+#ifdef T4P4S_INSTRUMENT
+            rx_times[handled_count] = rte_rdtsc();
+#endif
+            handled_pstates[handled_count] = &pstates[pkt_idx];
+            handled_pds[handled_count++] = pd;
+        }
+    }
+
+    handle_packet_burst(handled_pds, handled_pstates, handled_count, lcdata->conf->state.tables, get_portid(lcdata, queue_idx));
+
+    packet_descriptor_t* dropped_pds[MAX_PKT_BURST];
+    unsigned dropped_count = 0;
+
+    for (unsigned i = 0; i < handled_count; i++) {
+        if (unlikely(handled_pds[i]->dropped)) {
+            dropped_pds[dropped_count++] = handled_pds[i];
+            continue;
+        }
+
+        do_single_tx(lcdata, handled_pds[i], queue_idx, i);
+        INSTR_LATENCY(rx_times[i]);
+    }
+
+    if (dropped_count > 0) {
+        debug(" :::: Dropping %d packets\n", dropped_count);
+        free_packets(dropped_pds, dropped_count);
+    }
+
+    for (unsigned pkt_idx = 0; pkt_idx < pkt_count; pkt_idx++) {
+        main_loop_post_single_rx(lcdata, got_packets[pkt_idx]);
+    }
+}
+
+#endif
+
+void do_rx(struct lcore_data* lcdata, packet_descriptor_t* pd, parser_state_t* pstate)
 {
     unsigned queue_count = get_queue_count(lcdata);
     for (unsigned queue_idx = 0; queue_idx < queue_count; queue_idx++) {
         main_loop_rx_group(lcdata, queue_idx);
 
+#ifdef T4P4S_BURST
+        do_burst_rx(lcdata, pd, pstate, queue_idx);
+#else
         unsigned pkt_count = get_pkt_count_in_group(lcdata);
         for (unsigned pkt_idx = 0; pkt_idx < pkt_count; pkt_idx++) {
-            do_single_rx(lcdata, pd, queue_idx, pkt_idx);
+            do_single_rx(lcdata, pd, pstate, queue_idx, pkt_idx);
         }
+#endif
     }
 }
 
@@ -135,13 +216,30 @@ bool dpdk_main_loop()
     	return false;
     }
 
-    packet_descriptor_t pd;
-    init_dataplane(&pd, lcdata.conf->state.tables);
+#ifdef T4P4S_BURST
+    // one packet descriptor for each packet of a burst
+    packet_descriptor_t pds[MAX_PKT_BURST];
+    for (unsigned i = 0; i < MAX_PKT_BURST; i++) {
+        init_dataplane(&pds[i], lcdata.conf->state.tables);
+    }
+    packet_descriptor_t* pd = pds;
+
+    // all packets of a burst are parsed before the controls are applied,
+    // so each of them needs its own parser state
+    parser_state_t pstates[MAX_PKT_BURST];
+    memset(pstates, 0, sizeof(pstates));
+    parser_state_t* pstate = pstates;
+#else
+    packet_descriptor_t pd_struct;
+    init_dataplane(&pd_struct, lcdata.conf->state.tables);
+    packet_descriptor_t* pd = &pd_struct;
+    parser_state_t* pstate = &(lcdata.conf->state.parser_state);
+#endif
 
     while (core_is_working(&lcdata)) {
         main_loop_pre_rx(&lcdata);
 
-        do_rx(&lcdata, &pd);
+        do_rx(&lcdata, pd, pstate);
 
         main_loop_post_rx(&lcdata);
     }
@@ -175,6 +273,12 @@ int main(int argc, char** argv)
     debug("Initializing switch\n");
 
     initialize_args(argc, argv);
+
+#ifdef T4P4S_LOOKUP_BENCH
+    run_lookup_benchmarks();
+    return 0;
+#endif
+
     initialize_nic();
 
     init_lcore_confs();
@@ -202,6 +306,10 @@ int main(int argc, char** argv)
         t4p4s_post_launch(i);
     }
 
+#ifdef T4P4S_INSTRUMENT
+    instr_dump();
+#endif
+
     t4p4s_normal_exit();
     return 0;
 }
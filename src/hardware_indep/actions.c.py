@@ -12,7 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 from utils.misc import addError, addWarning 
-from utils.codegen import format_declaration, format_statement_ctl
+from utils.codegen import format_declaration, format_statement_ctl, FieldReadRegion
 import math
 
 
@@ -49,18 +49,19 @@ for ctl in hlir16.controls:
         #[     (void)value32; (void)res32; (void)mask32;
         #[     control_locals_${ctl.name}_t* control_locals = (control_locals_${ctl.name}_t*) pd->control_locals;
 
-        for stmt in act.body.components:
-            global pre_statement_buffer
-            global post_statement_buffer
-            pre_statement_buffer = ""
-            post_statement_buffer = ""
-
-            code = format_statement_ctl(stmt, ctl)
-            if pre_statement_buffer != "":
-                #= pre_statement_buffer
+        with FieldReadRegion():
+            for stmt in act.body.components:
+                global pre_statement_buffer
+                global post_statement_buffer
                 pre_statement_buffer = ""
-            #= code
-            if post_statement_buffer != "":
-                #= post_statement_buffer
                 post_statement_buffer = ""
+
+                code = format_statement_ctl(stmt, ctl)
+                if pre_statement_buffer != "":
+                    #= pre_statement_buffer
+                    pre_statement_buffer = ""
+                #= code
+                if post_statement_buffer != "":
+                    #= post_statement_buffer
+                    post_statement_buffer = ""
         #} }
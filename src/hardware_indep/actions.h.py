@@ -41,7 +41,7 @@ def resolve_typeref(hlir16, f):
     # resolving type reference
     if f.type.node_type == 'Type_Name':
         tref = f.type.type_ref
-        return hlir16.declarations.get(tref.name)
+        return hlir16.index.declarations.get(tref.name)
     else:
         return f
 
@@ -83,7 +83,7 @@ for table in hlir16.tables:
 
 # TODO: The controls shouldn't be accessed through an instance declaration parameter
 for pe in get_main(hlir16).arguments:
-    ctl = hlir16.declarations.get(pe.type.name, 'P4Control')
+    ctl = hlir16.index.declarations_by_type.get((pe.type.name, 'P4Control'))
 
     if ctl is not None:
         #[ typedef struct control_locals_${pe.type.name}_s {
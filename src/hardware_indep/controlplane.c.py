@@ -12,13 +12,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-def match_type_order(t):
-    match_types = {
-        "exact":    0,
-        "lpm":      1,
-        "ternary":  2,
-    }
-    return match_types[t]
+from index_hlir16 import get_key_byte_width, is_reversed_key
+from static_tables_hlir16 import is_static_table
 
 #[ #include "dpdk_lib.h"
 #[ #include "actions.h"
@@ -33,29 +28,17 @@ def match_type_order(t):
 #[ extern void ternary_add_promote(int tableid, uint8_t* key, uint8_t* mask, uint8_t* value);
 #[ extern device_mgr_t *dev_mgr_ptr;
 
-for table in hlir16.tables:
-    #[ extern void table_${table.name}_key(packet_descriptor_t* pd, uint8_t* key); // defined in dataplane.c
-
-
-if len(hlir16.tables)>0:
-    max_bytes = max([t.key_length_bytes for t in hlir16.tables if hasattr(t, 'key')])
-    #[ uint8_t reverse_buffer[$max_bytes];
-
-# Variable width fields are not supported
-def get_key_byte_width(k):
-    # for special functions like isValid
-    if k.get_attr('header') is None:
-        return 0
-        
-    return (k.width+7)/8 if not k.header.type.type_ref.is_vw else 0
+# the constant entries of a table cannot be modified by the controller
+hlir16_tables_with_keys = [t for t in hlir16.tables if hasattr(t, 'key') and not is_static_table(t)]
 
+for table in hlir16_tables_with_keys:
+    #[ extern void table_${table.name}_key(packet_descriptor_t* pd, table_key_${table.name}_t* key); // defined in dataplane.c
 
-hlir16_tables_with_keys = [t for t in hlir16.tables if hasattr(t, 'key')]
 keyed_table_names = ", ".join(["\"T4LIT(" + table.name + ",table)\"" for table in hlir16_tables_with_keys])
 
 
 for table in hlir16_tables_with_keys:
-    #[ // note: ${table.name}, ${table.match_type}, ${table.key_length_bytes}
+    #[ // note: ${table.name}, ${table.match_type}, ${hlir16.index.table_key_bytes[table.name]} key bytes
     #{ void ${table.name}_add(
     for k in table.key.keyElements:
         # TODO should properly handle specials (isValid etc.)
@@ -74,17 +57,18 @@ for table in hlir16_tables_with_keys:
     #}     struct ${table.name}_action action)
     #{ {
 
-    #[     uint8_t key[${table.key_length_bytes}];
+    #[     table_key_${table.name}_t key;
 
-    byte_idx = 0
-    for k in sorted((k for k in table.key.keyElements if k.get_attr('match_type') is not None), key = lambda k: match_type_order(k.match_type)):
-        # TODO should properly handle specials (isValid etc.)
-        if k.get_attr('header') is None:
+    # the same layout as in table_${table.name}_key in dataplane.c
+    # TODO should properly handle specials (isValid etc.), they are not in the key layout
+    for k, byte_idx, byte_width in hlir16.index.table_keys[table.name]:
+        if byte_width == 0:
             continue
-
-        byte_width = get_key_byte_width(k)
-        #[ memcpy(key+$byte_idx, field_instance_${k.header.name}_${k.field_name}, $byte_width);
-        byte_idx += byte_width
+        member = "key." + hlir16.index.key_member_names[k.id]
+        if is_reversed_key(table):
+            #[ for (int i = 0; i < $byte_width; ++i) $member[${byte_width - 1} - i] = field_instance_${k.header.name}_${k.field_name}[i];
+        else:
+            #[ memcpy($member, field_instance_${k.header.name}_${k.field_name}, $byte_width);
 
     if table.match_type == "LPM":
         #[ uint8_t prefix_length = 0;
@@ -97,13 +81,10 @@ for table in hlir16_tables_with_keys:
                 #[ prefix_length += ${get_key_byte_width(k)};
             if k.match_type == "lpm":
                 #[ prefix_length += field_instance_${k.header.name}_${k.field_name}_prefix_length;
-        #[ int c, d;
-        #[ for(c = ${byte_idx-1}, d = 0; c >= 0; c--, d++) *(reverse_buffer+d) = *(key+c);
-        #[ for(c = 0; c < ${byte_idx}; c++) *(key+c) = *(reverse_buffer+c);
-        #[ lpm_add_promote(TABLE_${table.name}, (uint8_t*)key, prefix_length, (uint8_t*)&action);
+        #[ lpm_add_promote(TABLE_${table.name}, (uint8_t*)&key, prefix_length, (uint8_t*)&action);
 
     if table.match_type == "EXACT":
-        #[ exact_add_promote(TABLE_${table.name}, (uint8_t*)key, (uint8_t*)&action);
+        #[ exact_add_promote(TABLE_${table.name}, (uint8_t*)&key, (uint8_t*)&action);
 
     #} }
 
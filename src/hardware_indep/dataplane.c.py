@@ -12,9 +12,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from utils.codegen import format_declaration, format_statement_ctl, format_expr, format_type, type_env
+from utils.codegen import format_declaration, format_statement_ctl, format_expr, format_type, type_env, FieldReadRegion
 from utils.misc import addError, addWarning
 from hlir16.hlir16_attrs import get_main
+from liveness_hlir16 import is_live_field, is_live_header
+from static_tables_hlir16 import is_static_table
+from key_sharing_hlir16 import uses_shared_key, get_applied_table
+from index_hlir16 import is_reversed_key
 
 #[ #include <stdlib.h>
 #[ #include <string.h>
@@ -39,10 +43,6 @@ STDPARAMS_IN = SHORT_STDPARAMS_IN + ", pstate"
 #[ extern void parse_packet(${STDPARAMS});
 #[ extern void increase_counter (int counterid, int index);
 
-# note: 0 is for the special case where there are no tables
-max_key_length = max([t.key_length_bytes for t in hlir16.tables if hasattr(t, 'key')] + [0])
-#[ uint8_t reverse_buffer[${max_key_length}];
-
 ################################################################################
 
 main = get_main(hlir16)
@@ -55,84 +55,269 @@ pipeline_elements = main.arguments
 #} };
 
 for pe in pipeline_elements:
-    c = hlir16.declarations.get(pe.type.name, 'P4Control')
+    c = hlir16.index.declarations_by_type.get((pe.type.name, 'P4Control'))
     if c is None:
         continue
 
     #[ void control_${pe.type.name}(${STDPARAMS});
     for t in c.controlLocals['P4Table']:
         #[ struct apply_result_s ${t.name}_apply(${STDPARAMS});
+        if uses_shared_key(t):
+            #[ struct apply_result_s ${t.name}_apply_with_key(${STDPARAMS}, uint8_t* key);
 
 ################################################################################
 
-# TODO move this to HAL
-def match_type_order(t):
-    if t == 'EXACT':   return 0
-    if t == 'LPM':     return 1
-    if t == 'TERNARY': return 2
-    else:              return 3
-
-################################################################################
 # Table key calculation
 
+# The keys are laid out according to hlir16.index.table_keys (see get_key_layout),
+# the same layout is used by the control plane when adding entries.
+
+def has_key_struct(table):
+    """The tables with constant entries are looked up by their own keys (see table_*_static_key)."""
+    return hasattr(table, 'key') and not is_static_table(table)
+
+def lpm_key_fits_int32(table):
+    """Whether the key of the LPM table can be calculated as a uint32_t (see table_*_key32)."""
+    layout = hlir16.index.table_keys[table.name]
+    return (table.match_type == "LPM" and has_key_struct(table) and not uses_shared_key(table)
+            and 0 < hlir16.index.table_key_bytes[table.name] <= 4
+            and len(layout) == len(table.key.keyElements)
+            and all(k.get_attr('width') is not None and k.width <= 32 for k, _, _ in layout))
+
 for table in hlir16.tables:
-    if not hasattr(table, 'key'):
+    if not has_key_struct(table):
         continue
 
-    #{ void table_${table.name}_key(packet_descriptor_t* pd, uint8_t* key) {
-    sortedfields = sorted(table.key.keyElements, key=lambda k: match_type_order(k.match_type))
+    is_reversed = is_reversed_key(table)
+
+    #{ void table_${table.name}_key(packet_descriptor_t* pd, table_key_${table.name}_t* key) {
+    #[     uint32_t value32;
+    #[     (void)value32;
     #TODO variable length fields
     #TODO field masks
-    for f in sortedfields:
-        if f.get_attr('width') is None:
+    for k, byte_idx, byte_width in hlir16.index.table_keys[table.name]:
+        if k.get_attr('width') is None or byte_width == 0:
             # TODO find out why this is missing and fix it
             continue
-        if f.width <= 32:
-            #[ EXTRACT_INT32_BITS_PACKET(pd, header_instance_${f.header.name}, field_${f.header.type.type_ref.name}_${f.field_name}, *(uint32_t*)key)
-            #[ key += sizeof(uint32_t);
-        elif f.width > 32 and f.width % 8 == 0:
-            byte_width = (f.width+7)/8
-            #[ EXTRACT_BYTEBUF_PACKET(pd, header_instance_${f.header.name}, field_${f.header.type.type_ref.name}_${f.field_name}, key)
-            #[ key += ${byte_width};
+
+        member = "key->" + hlir16.index.key_member_names[k.id]
+        if k.width <= 32:
+            #[ EXTRACT_INT32_AUTO_PACKET(pd, header_instance_${k.header.name}, field_${k.header.type.type_ref.name}_${k.field_name}, value32)
+            for i in range(byte_width):
+                shift = 8 * i if is_reversed else 8 * (byte_width - 1 - i)
+                byte_value = "(value32 >> {})".format(shift) if shift != 0 else "value32"
+                #[ $member[$i] = $byte_value & 0xff;
+        elif k.width % 8 == 0:
+            extract = "EXTRACT_BYTEBUF_REVERSED_PACKET" if is_reversed else "EXTRACT_BYTEBUF_PACKET"
+            #[ $extract(pd, header_instance_${k.header.name}, field_${k.header.type.type_ref.name}_${k.field_name}, $member)
         else:
-            add_error("table key calculation", "Unsupported field %s ignored." % f.id)
+            addError("table key calculation", "Unsupported field %s ignored." % k.id)
+    #} }
+
+    if lpm_key_fits_int32(table):
+        # the same value as the one lpm_lookup reads from the key calculated above
+        #{ static uint32_t table_${table.name}_key32(packet_descriptor_t* pd) {
+        #[     uint32_t key32 = 0;
+        #[     uint32_t value32;
+        for k, byte_idx, byte_width in hlir16.index.table_keys[table.name]:
+            shifted_value = "value32 << {}".format(8 * byte_idx) if byte_idx != 0 else "value32"
+            #[ EXTRACT_INT32_AUTO_PACKET(pd, header_instance_${k.header.name}, field_${k.header.type.type_ref.name}_${k.field_name}, value32)
+            #[ key32 |= $shifted_value;
+        #[     return key32;
+        #} }
+
+################################################################################
+# Tables with constant entries
+
+def byte_array(bytes):
+    return "{" + ", ".join(["0x{:02x}".format(b) for b in bytes]) + "}"
 
-    if table.match_type == "LPM":
-        #[ key -= ${table.key_length_bytes};
-        #[ int c, d;
-        #[ for(c = ${table.key_length_bytes-1}, d = 0; c >= 0; c--, d++) *(reverse_buffer+d) = *(key+c);
-        #[ for(c = 0; c < ${table.key_length_bytes}; c++) *(key+c) = *(reverse_buffer+c);
+def gen_static_entry(table, action_name, params, terminator=","):
+    #[ { .action = { .action_id = action_${action_name}, .${action_name}_params = {
+    for param_name, bytes in params:
+        #[     .${param_name} = ${byte_array(bytes)},
+    #[ } }, .is_entry_valid = VALID_TABLE_ENTRY }$terminator
+
+def gen_static_key_element(k, byte_idx, byte_width, kind, dst):
+    if kind == 'isValid':
+        #[ $dst = (pd->headers[header_instance_${k.expression.method.expr.member}].pointer != NULL);
+    else:
+        # the constant entries hold the values in host byte order
+        #[ EXTRACT_INT32_AUTO_PACKET(pd, header_instance_${k.header.name}, field_${k.header.type.type_ref.name}_${k.field_name}, $dst)
+
+for table in hlir16.tables:
+    if not is_static_table(table):
+        continue
+
+    lookup = table.static_lookup
+    entry_count = len(lookup.entries)
+
+    #[ // table ${table.name} has constant entries: ${lookup.kind} lookup
+    if entry_count > 0:
+        #{ static table_entry_${table.name}_t ${table.name}_static_entries[${entry_count}] = {
+        for _key, _mask, _value, action_name, params in lookup.entries:
+            #= gen_static_entry(table, action_name, params)
+        #} };
+
+    if lookup.default is not None:
+        #[ static table_entry_${table.name}_t ${table.name}_static_default =
+        #= gen_static_entry(table, lookup.default[0], lookup.default[1], ";")
+
+    if lookup.kind != 'switch' and entry_count > 0:
+        #{ static const uint8_t ${table.name}_static_keys[${entry_count}][${lookup.key_bytes}] = {
+        for key, _mask, _value, _action_name, _params in lookup.entries:
+            #[ ${byte_array(key)},
+        #} };
+
+    if lookup.kind == 'linear' and entry_count > 0:
+        #{ static const uint8_t ${table.name}_static_masks[${entry_count}][${lookup.key_bytes}] = {
+        for _key, mask, _value, _action_name, _params in lookup.entries:
+            #[ ${byte_array(mask)},
+        #} };
+
+    if lookup.kind == 'switch':
+        continue
+
+    #{ void table_${table.name}_static_key(packet_descriptor_t* pd, uint8_t* key) {
+    #[     uint32_t value32;
+    #[     (void)value32;
+    for k, byte_idx, byte_width, kind in lookup.key_elements:
+        if kind == 'bytebuf':
+            #[ EXTRACT_BYTEBUF_PACKET(pd, header_instance_${k.header.name}, field_${k.header.type.type_ref.name}_${k.field_name}, key + ${byte_idx})
+            continue
+
+        #= gen_static_key_element(k, byte_idx, byte_width, kind, "value32")
+        for i in range(byte_width):
+            #[ key[${byte_idx + i}] = (value32 >> ${8 * (byte_width - 1 - i)}) & 0xff;
     #} }
 
+def gen_static_lookup(table):
+    """Sets idx to the index of the matching constant entry, or -1 if there is none."""
+    lookup = table.static_lookup
+    entry_count = len(lookup.entries)
+
+    #[ int idx = -1;
+    if entry_count == 0:
+        return
+
+    if lookup.kind == 'switch':
+        k, byte_idx, byte_width, kind = lookup.key_elements[0]
+        #[ uint32_t value32;
+        #= gen_static_key_element(k, byte_idx, byte_width, kind, "value32")
+        #[ switch (value32) {
+        for idx, (_key, _mask, value, _action_name, _params) in enumerate(lookup.entries):
+            #[     case ${value}: idx = ${idx}; break;
+        #[ }
+        return
+
+    #[ uint8_t key[${lookup.key_bytes}];
+    #[ table_${table.name}_static_key(pd, key);
+
+    if lookup.kind == 'sorted':
+        #[ int lo = 0, hi = ${entry_count - 1};
+        #[ while (lo <= hi) {
+        #[     int mid = (lo + hi) / 2;
+        #[     int cmp = memcmp(key, ${table.name}_static_keys[mid], ${lookup.key_bytes});
+        #[     if (cmp == 0) { idx = mid; break; }
+        #[     if (cmp < 0) hi = mid - 1; else lo = mid + 1;
+        #[ }
+    else:
+        #[ for (int i = 0; i < ${entry_count} && idx < 0; ++i) {
+        #[     int j = 0;
+        #[     while (j < ${lookup.key_bytes} && (key[j] & ${table.name}_static_masks[i][j]) == ${table.name}_static_keys[i][j]) ++j;
+        #[     if (j == ${lookup.key_bytes}) idx = i;
+        #[ }
+
 ################################################################################
 # Table application
 
-for table in hlir16.tables:
-    lookupfun = {'LPM':'lpm_lookup', 'EXACT':'exact_lookup', 'TERNARY':'ternary_lookup'}
-    #[ struct apply_result_s ${table.name}_apply(${STDPARAMS})
-    #{ {
-    if hasattr(table, 'key'):
-        #[     uint8_t* key[${table.key_length_bytes}];
-        #[     table_${table.name}_key(pd, (uint8_t*)key);
+def gen_apply_direct_smems(table):
+    for smem in table.meters + table.counters:
+        for comp in smem.components:
+            value = "pd->parsed_length" if comp['for'] == 'bytes' else "1"
+            type = comp['type']
+            name  = comp['name']
+            #[ apply_direct_smem_$type(&(entry->state.$name), $value, "${table.name}", "${smem.smem_type}", "$name");
+
+def gen_lookup_result(table, key_var):
+    """The hit flag, the debug message and the direct meters and counters of the entry found by a lookup."""
+    #[     bool hit = entry != NULL && entry->is_entry_valid == INVALID_TABLE_ENTRY;
+
+    #[     dbg_bytes($key_var, table_config[TABLE_${table.name}].entry.key_size,
+    #[               "Lookup $$[success]{}{%s} on table $$[table]{table.name}: $${}{%s}%s <- %s",
+    #[               hit ? "hit" : "miss",
+    #[               entry == 0 ? "(no action)" : action_names[entry->action.action_id],
+    #[               hit ? "" : " (default)",
+    #[               ${hlir16.index.table_key_bytes[table.name]} == 0 ? "$$[bytes]{}{(empty key)}" : "");
+
+    #[     if (likely(hit)) {
+    #= gen_apply_direct_smems(table)
+    #[     }
+
+def gen_apply_actions(table):
+    """Runs the action of the entry, and returns the result of the table application."""
+    #[     if (likely(entry != 0)) {
+    #[       switch (entry->action.action_id) {
+    for action in table.actions:
+        action_name = action.action_object.name
+        if action_name == 'NoAction':
+            continue
+        #[         case action_${action_name}:
+        #[           debug("   :: Executing action $$[action]{action_name}%s...\n", hit ? "" : " (default)");
+        #[           {
+        #[               INSTR_START(instr_action_start);
+        #[               action_code_${action_name}(${SHORT_STDPARAMS_IN}, entry->action.${action_name}_params);
+        #[               INSTR_STOP(INSTR_STAGE_action_${action_name}, instr_action_start);
+        #[           }
+        #[           break;
+    #[       }
+    #[     } else {
+    #[       debug("   :: NO RESULT, NO DEFAULT ACTION.\n");
+    #[     }
+
+    #[     struct apply_result_s apply_result = { hit, hit ? entry->action.action_id : -1 };
+    #[     return apply_result;
+
+lookupfun = {'LPM':'lpm_lookup', 'EXACT':'exact_lookup', 'TERNARY':'ternary_lookup'}
 
-        #[     table_entry_${table.name}_t* entry = (table_entry_${table.name}_t*)${lookupfun[table.match_type]}(tables[TABLE_${table.name}], (uint8_t*)key);
-        #[     bool hit = entry != NULL && entry->is_entry_valid == INVALID_TABLE_ENTRY;
+for table in hlir16.tables:
+    # the key is calculated by the caller
+    takes_key = uses_shared_key(table)
 
-        #[     dbg_bytes(key, table_config[TABLE_${table.name}].entry.key_size,
-        #[               "Lookup $$[success]{}{%s} on table $$[table]{table.name}: $${}{%s}%s <- %s",
-        #[               hit ? "hit" : "miss",
-        #[               entry == 0 ? "(no action)" : action_names[entry->action.action_id],
-        #[               hit ? "" : " (default)",
-        #[               ${table.key_length_bytes} == 0 ? "$$[bytes]{}{(empty key)}" : "");
+    if takes_key:
+        #[ struct apply_result_s ${table.name}_apply_with_key(${STDPARAMS}, uint8_t* key)
+    else:
+        #[ struct apply_result_s ${table.name}_apply(${STDPARAMS})
+    #{ {
+    #[     INSTR_START(instr_start);
+    if is_static_table(table):
+        #= gen_static_lookup(table)
+        default_entry = "&{}_static_default".format(table.name) if table.static_lookup.default is not None else "0"
+        matching_entry = "&{}_static_entries[idx]".format(table.name) if table.static_lookup.entries != [] else "0"
+        #[     table_entry_${table.name}_t* entry = idx >= 0 ? $matching_entry : $default_entry;
+        #[     bool hit = idx >= 0;
+
+        #[     debug("   :: Lookup $$[success]{}{%s} on constant table $$[table]{table.name}: $${}{%s}%s\n",
+        #[           hit ? "hit" : "miss",
+        #[           entry == 0 ? "(no action)" : action_names[entry->action.action_id],
+        #[           hit ? "" : " (default)");
 
         #{     if (likely(hit)) {
-        for smem in table.meters + table.counters:
-            for comp in smem.components:
-                value = "pd->parsed_length" if comp['for'] == 'bytes' else "1"
-                type = comp['type']
-                name  = comp['name']
-                #[ apply_direct_smem_$type(&(entry->state.$name), $value, "${table.name}", "${smem.smem_type}", "$name");
+        #= gen_apply_direct_smems(table)
         #}    }
+    elif hasattr(table, 'key'):
+        if lpm_key_fits_int32(table):
+            key_var = "&key32"
+            #[     uint32_t key32 = table_${table.name}_key32(pd);
+            #[     table_entry_${table.name}_t* entry = (table_entry_${table.name}_t*)lpm_lookup_u32(tables[TABLE_${table.name}], key32);
+        else:
+            key_var = "key" if takes_key else "(uint8_t*)&key"
+            if not takes_key:
+                #[     table_key_${table.name}_t key;
+                #[     table_${table.name}_key(pd, &key);
+
+            #[     table_entry_${table.name}_t* entry = (table_entry_${table.name}_t*)${lookupfun[table.match_type]}(tables[TABLE_${table.name}], $key_var);
+        #= gen_lookup_result(table, key_var)
     else:
         action = table.default_action.expression.method.ref.name if hasattr(table, 'default_action') else None
 
@@ -149,26 +334,29 @@ for table in hlir16.tables:
             #[    bool is_default = false;
 
 
-    # ACTIONS
-    #[     if (likely(entry != 0)) {
-    #{       switch (entry->action.action_id) {
-    for action in table.actions:
-        action_name = action.action_object.name
-        if action_name == 'NoAction':
-            continue
-        #{         case action_${action_name}:
-        #[           debug("   :: Executing action $$[action]{action_name}%s...\n", hit ? "" : " (default)");
-        #[           action_code_${action_name}(${SHORT_STDPARAMS_IN}, entry->action.${action_name}_params);
-        #}           break;
-    #[       }
-    #[     } else {
-    #[       debug("   :: NO RESULT, NO DEFAULT ACTION.\n");
-    #}     }
+    #[     INSTR_STOP(INSTR_STAGE_table_${table.name}, instr_start);
 
-    #[     struct apply_result_s apply_result = { hit, hit ? entry->action.action_id : -1 };
-    #[     return apply_result;
+    #= gen_apply_actions(table)
     #} }
 
+    if takes_key:
+        #[ struct apply_result_s ${table.name}_apply(${STDPARAMS})
+        #{ {
+        #[     table_key_${table.name}_t key;
+        #[     table_${table.name}_key(pd, &key);
+        #[     return ${table.name}_apply_with_key(${STDPARAMS_IN}, (uint8_t*)&key);
+        #} }
+
+    if has_key_struct(table):
+        #[ #ifdef T4P4S_BURST
+        #[ // The part of the table application after the lookup, used when the entries of a burst are looked up together.
+        #[ struct apply_result_s ${table.name}_apply_entry(${STDPARAMS}, uint8_t* key, table_entry_${table.name}_t* entry)
+        #{ {
+        #= gen_lookup_result(table, "key")
+        #= gen_apply_actions(table)
+        #} }
+        #[ #endif
+
 
 ################################################################################
 
@@ -232,11 +420,14 @@ for table in hlir16.tables:
 #[     uint32_t value32, res32;
 #[     (void)value32, (void)res32;
 for hdr in hlir16.header_instances:
+    if not is_live_header(hlir16, hdr):
+        continue
+
     #[ 
     #[ // updating header instance ${hdr.name}
 
     for fld in hdr.type.type_ref.fields:
-        if not fld.preparsed and fld.type.size <= 32:
+        if not fld.preparsed and fld.type.size <= 32 and is_live_field(hlir16, hdr, fld):
             #{ if(pd->fields.attr_field_instance_${hdr.name}_${fld.name} == MODIFIED) {
             #[     value32 = pd->fields.field_instance_${hdr.name}_${fld.name};
             #[     MODIFY_INT32_INT32_AUTO_PACKET(pd, header_instance_${hdr.name}, field_${hdr.type.type_ref.name}_${fld.name}, value32);
@@ -282,7 +473,7 @@ for m in hlir16.declarations['Method']:
         #[ extern ${ret_type} ${m.name}(${args});
 
 for pe in pipeline_elements:
-    ctl = hlir16.declarations.get(pe.type.name, 'P4Control')
+    ctl = hlir16.index.declarations_by_type.get((pe.type.name, 'P4Control'))
         
     if ctl is None:
         continue
@@ -295,13 +486,76 @@ for pe in pipeline_elements:
     #[     control_locals_${pe.type.name}_t control_locals_struct;
     #[     control_locals_${pe.type.name}_t* control_locals = &control_locals_struct;
     #[     pd->control_locals = (void*) control_locals;
-    #= format_statement_ctl(ctl.body, ctl)
+    with FieldReadRegion():
+        #= format_statement_ctl(ctl.body, ctl)
+    #} }
+
+def get_staged_tables(ctl):
+    """The tables applied by the control one after the other,
+    or None if the body of the control is not a sequence of table applications (t.apply();)."""
+    tables = []
+    for stmt in ctl.body.components:
+        table = get_applied_table(stmt)
+        if table is None:
+            return None
+        tables.append(table)
+    return tables
+
+#[ #ifdef T4P4S_BURST
+for pe in pipeline_elements:
+    ctl = hlir16.index.declarations_by_type.get((pe.type.name, 'P4Control'))
+    if ctl is None or get_staged_tables(ctl) is None:
+        continue
+
+    #[ // Applies the control to a burst of packets one table at a time:
+    #[ // the keys of all packets are calculated, then they are looked up together,
+    #[ // the found entries are prefetched, then the actions are run.
+    #[ void control_${pe.type.name}_burst(packet_descriptor_t* pds[], parser_state_t* pstates[], unsigned pkt_count, lookup_table_t** tables)
+    #{ {
+    #[     debug("Entering control $$[control]{ctl.name} with $${}{%d} packets...\n", pkt_count);
+    #[     control_locals_${pe.type.name}_t control_locals_structs[pkt_count];
+    #[     for (unsigned i = 0; i < pkt_count; ++i) {
+    #[         pds[i]->control_locals = (void*)&control_locals_structs[i];
+    #[     }
+
+    for table in get_staged_tables(ctl):
+        #[
+        if not has_key_struct(table):
+            #[     for (unsigned i = 0; i < pkt_count; ++i) {
+            #[         ${table.name}_apply(pds[i], tables, pstates[i]);
+            #[     }
+            continue
+
+        #{     {
+        #[         table_key_${table.name}_t keys[pkt_count];
+        #[         uint8_t* key_ptrs[pkt_count];
+        #[         uint8_t* entries[pkt_count];
+        #[
+        #[         INSTR_START(instr_start);
+        #[         for (unsigned i = 0; i < pkt_count; ++i) {
+        #[             table_${table.name}_key(pds[i], &keys[i]);
+        #[             key_ptrs[i] = (uint8_t*)&keys[i];
+        #[         }
+        #[         ${lookupfun[table.match_type]}_bulk(tables[TABLE_${table.name}], key_ptrs, pkt_count, entries);
+        #[         INSTR_STOP_BULK(INSTR_STAGE_table_${table.name}, instr_start, pkt_count);
+        #[
+        #[         for (unsigned i = 0; i < pkt_count; ++i) {
+        #[             if (entries[i] != NULL) {
+        #[                 rte_prefetch0(entries[i]);
+        #[             }
+        #[         }
+        #[
+        #[         for (unsigned i = 0; i < pkt_count; ++i) {
+        #[             ${table.name}_apply_entry(pds[i], tables, pstates[i], key_ptrs[i], (table_entry_${table.name}_t*)entries[i]);
+        #[         }
+        #}     }
     #} }
+#[ #endif
 
 #[ void process_packet(${STDPARAMS})
 #{ {
 for pe in pipeline_elements:
-    ctl = hlir16.declarations.get(pe.type.name, 'P4Control')
+    ctl = hlir16.index.declarations_by_type.get((pe.type.name, 'P4Control'))
     if ctl is not None:
         #[ control_${pe.type.name}(${STDPARAMS_IN});
         if pe.type.name == 'egress':
@@ -371,12 +625,14 @@ pkt_name_indent = " " * longest_hdr_name_len
 
 #[ void emit_packet(${STDPARAMS})
 #{ {
+#[     INSTR_START(instr_start);
 #[     if (unlikely(pd->is_emit_reordering)) {
 #[         debug(" :::: Reordering emit\n");
 #[         store_headers_for_emit(${STDPARAMS_IN});
 #[         resize_packet_on_emit(${STDPARAMS_IN});
 #[         copy_emit_contents(${STDPARAMS_IN});
 #[     }
+#[     INSTR_STOP(INSTR_STAGE_emit, instr_start);
 #} }
 
 #[ static void set_metadata_inport(packet_descriptor_t* pd, uint32_t inport)
@@ -407,3 +663,70 @@ pkt_name_indent = " " * longest_hdr_name_len
 #[
 #[     emit_packet(${STDPARAMS_IN});
 #} }
+
+#[ #ifdef T4P4S_BURST
+#[ // the packet data of this many packets ahead is prefetched
+#[ #define PREFETCH_OFFSET 3
+
+#[ // Processes a burst of packets one stage at a time: first all packets are parsed,
+#[ // then each control is applied to all of them, then all of them are emitted.
+#[ // The controls that only apply tables one after the other are staged further (see control_*_burst).
+#[ // Each packet has its own parser state, as the controls read the parser state of their packet.
+#[ void handle_packet_burst(packet_descriptor_t* pds[], parser_state_t* pstates[], unsigned pkt_count, lookup_table_t** tables, uint32_t portid)
+#{ {
+#[     if (pkt_count == 0) {
+#[         return;
+#[     }
+#[
+#[     for (unsigned i = 0; i < PREFETCH_OFFSET && i < pkt_count; ++i) {
+#[         rte_prefetch0(pds[i]->data);
+#[     }
+#[
+#{     for (unsigned i = 0; i < pkt_count; ++i) {
+#[         packet_descriptor_t* pd = pds[i];
+#[         parser_state_t* pstate = pstates[i];
+#[         if (i + PREFETCH_OFFSET < pkt_count) {
+#[             rte_prefetch0(pds[i + PREFETCH_OFFSET]->data);
+#[         }
+#[
+#[         reset_headers(${SHORT_STDPARAMS_IN});
+#[         set_metadata_inport(pd, portid);
+#[
+#[         dbg_bytes(pd->data, rte_pktmbuf_pkt_len(pd->wrapper), "Handling packet (port %" PRIu32 ", $${}{%02d} bytes)  : ", EXTRACT_INGRESSPORT(pd), rte_pktmbuf_pkt_len(pd->wrapper));
+#[
+#[         pd->parsed_length = 0;
+#[         parse_packet(${STDPARAMS_IN});
+#[         pd->payload_length = rte_pktmbuf_pkt_len(pd->wrapper) - pd->parsed_length;
+#[
+#[         pd->emit_hdrinst_count = 0;
+#[         pd->is_emit_reordering = false;
+#}     }
+
+for pe in pipeline_elements:
+    ctl = hlir16.index.declarations_by_type.get((pe.type.name, 'P4Control'))
+    if ctl is None:
+        continue
+
+    #[
+    if get_staged_tables(ctl) is not None:
+        #[     control_${pe.type.name}_burst(pds, pstates, pkt_count, tables);
+    else:
+        #{     for (unsigned i = 0; i < pkt_count; ++i) {
+        #[         if (i + 1 < pkt_count) {
+        #[             rte_prefetch0(pds[i + 1]);
+        #[         }
+        #[         control_${pe.type.name}(pds[i], tables, pstates[i]);
+        #}     }
+
+    if pe.type.name == 'egress':
+        #[     for (unsigned i = 0; i < pkt_count; ++i) {
+        #[         update_packet(pds[i]); // we need to update the packet prior to calculating the new checksum
+        #[     }
+
+#[
+#{     for (unsigned i = 0; i < pkt_count; ++i) {
+#[         emit_addr = pds[i]->data;
+#[         emit_packet(pds[i], tables, pstates[i]);
+#}     }
+#} }
+#[ #endif
@@ -0,0 +1,57 @@
+# Copyright 2018 Eotvos Lorand University, Budapest, Hungary
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# The stages of the pipeline that are measured by the instrument option (see dpdk_instrument.h).
+# The parser states and the actions are measured without the states and actions they call,
+# the tables from the start of the apply function until the lookup is done.
+
+#[ #ifndef __INSTRUMENT_H__
+#[ #define __INSTRUMENT_H__
+
+parser = hlir16.declarations['P4Parser'][0]
+
+stages = []
+for s in parser.states:
+    if s.node_type != 'ParserState': continue
+    stages.append(("parser_state_" + s.name, "parser state " + s.name))
+
+for table in hlir16.tables:
+    stages.append(("table_" + table.name, "table " + table.name))
+
+action_names = []
+for table in hlir16.tables:
+    for action in table.actions:
+        action_name = action.action_object.name
+        if action_name != 'NoAction' and action_name not in action_names:
+            action_names.append(action_name)
+
+for action_name in action_names:
+    stages.append(("action_" + action_name, "action " + action_name))
+
+stages.append(("emit", "emit"))
+
+#{ enum instr_stage_e {
+for stage, _ in stages:
+    #[ INSTR_STAGE_$stage,
+#[ INSTR_STAGE_COUNT,
+#} };
+
+#[ #ifdef T4P4S_INSTRUMENT
+#{ static const char* instr_stage_names[INSTR_STAGE_COUNT] = {
+for stage, description in stages:
+    #[ "$description", // INSTR_STAGE_$stage
+#} };
+#[ #endif
+
+#[ #endif
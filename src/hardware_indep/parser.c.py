@@ -14,6 +14,7 @@
 
 from utils.misc import addError, addWarning 
 from utils.codegen import format_expr, format_statement, statement_buffer_value, format_declaration
+from liveness_hlir16 import is_live_field
 
 
 #[ #include "dpdk_lib.h"
@@ -38,6 +39,11 @@ def gen_extract_header_tmp_2(h, w):
     #[ buf += hdrlen;
 
 
+def is_extracted_field_live(h, f):
+    """Fields of headers that are not resolved to a header instance are considered live."""
+    hdr = h.get_attr('header_ref')
+    return hdr is None or is_live_field(hlir16, hdr, f)
+
 def gen_extract_header(h):
     #[ if((int)((uint8_t*)buf-(uint8_t*)(pd->data))+${h.type.type_ref.byte_width} > pd->wrapper->pkt_len); // packet_too_short // TODO optimize this
     #[ pd->headers[${h.id}].pointer = buf;
@@ -47,7 +53,7 @@ def gen_extract_header(h):
     for f in h.type.type_ref.fields:
         # TODO get rid of "f.get_attr('preparsed') is not None"
         # TODO (f must always have a preparsed attribute)
-        if f.get_attr('preparsed') is not None and f.preparsed and f.size <= 32:
+        if f.get_attr('preparsed') is not None and f.preparsed and f.size <= 32 and is_extracted_field_live(h, f):
             #[ EXTRACT_INT32_AUTO_PACKET(pd, ${h.id}, ${f.id}, value32)
             #[ pd->fields.${f.id} = value32;
             #[ pd->fields.attr_${f.id} = 0;
@@ -85,6 +91,7 @@ for s in parser.states:
     #[     uint32_t value32; (void)value32;
     #[     uint32_t res32; (void)res32;
     #[     debug(" :::: Parser state $$[parserstate]{s.name}\n");
+    #[     INSTR_START(instr_start);
 
     for c in s.components:
         if hasattr(c, 'call'):
@@ -121,6 +128,7 @@ for s in parser.states:
         if s.name == 'reject':
             #[ debug("   :: Packet is $$[success]{}{dropped}\n");
             #[ pd->dropped = 1;
+        #[ INSTR_STOP(INSTR_STAGE_parser_state_${s.name}, instr_start);
     else:
         b = s.selectExpression
         if b.node_type == 'PathExpression':
@@ -131,6 +139,8 @@ for s in parser.states:
         prebuf, postbuf = statement_buffer_value()
 
         #[ $prebuf
+        # the next state is measured separately
+        #[ INSTR_STOP(INSTR_STAGE_parser_state_${s.name}, instr_start);
         #[ $x
         #[ $postbuf
     #[ }
@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 from hlir16.utils_hlir16 import *
+from liveness_hlir16 import is_live_field
 
 
 #[ #ifndef __HEADER_INFO_H__
@@ -25,11 +26,16 @@ from hlir16.utils_hlir16 import *
 
 #{ typedef struct parsed_fields_s {
 
-for hdr in hlir16.header_instances:
-    for fld in hdr.type.type_ref.fields:
-        if not fld.preparsed and fld.type.size <= 32:
-            #[ uint32_t field_instance_${hdr.name}_${fld.name};
-            #[ uint8_t attr_field_instance_${hdr.name}_${fld.name};
+# only the fields that are used in the program are kept
+parsed_fields = [(hdr, fld) for hdr in hlir16.header_instances for fld in hdr.type.type_ref.fields
+                 if not fld.preparsed and fld.type.size <= 32 and is_live_field(hlir16, hdr, fld)]
+
+for hdr, fld in parsed_fields:
+    #[ uint32_t field_instance_${hdr.name}_${fld.name};
+    #[ uint8_t attr_field_instance_${hdr.name}_${fld.name};
+
+if parsed_fields == []:
+    #[ uint8_t unused; // ISO C does not allow empty structs
 #} } parsed_fields_t;
 
 
@@ -128,8 +134,8 @@ for hdr in hlir16.header_instances:
 
 #{ static const int field_instance_bit_offset[FIELD_INSTANCE_COUNT] = {
 for hdr in hlir16.header_instances:
-    for fld in hdr.type.type_ref.fields:
-        #[   (${fld.offset} % 8), // field_instance_${hdr.name}_${fld.name}
+    for fld, offset in hlir16.index.header_fields[hdr.name]:
+        #[   ($offset % 8), // field_instance_${hdr.name}_${fld.name}
 #} };
 
 
@@ -137,8 +143,8 @@ for hdr in hlir16.header_instances:
 
 #{ static const int field_instance_byte_offset_hdr[FIELD_INSTANCE_COUNT] = {
 for hdr in hlir16.header_instances:
-    for fld in hdr.type.type_ref.fields:
-        #[   (${fld.offset} / 8), // field_instance_${hdr.name}_${fld.name}
+    for fld, offset in hlir16.index.header_fields[hdr.name]:
+        #[   ($offset / 8), // field_instance_${hdr.name}_${fld.name}
 #} };
 
 
@@ -151,9 +157,9 @@ for hdr in hlir16.header_instances:
 
 #{ static const int field_instance_mask[FIELD_INSTANCE_COUNT] = {
 for hdr in hlir16.header_instances:
-    for fld in hdr.type.type_ref.fields:
+    for fld, offset in hlir16.index.header_fields[hdr.name]:
         fldtype = get_real_type(fld.type)
-        #[  __bswap_constant_32(uint32_top_bits(${fldtype.size}) >> (${fld.offset}%8)), // field_instance_${hdr.name}_${fld.name},
+        #[  __bswap_constant_32(uint32_top_bits(${fldtype.size}) >> ($offset%8)), // field_instance_${hdr.name}_${fld.name},
 #} };
 
 
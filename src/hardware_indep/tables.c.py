@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 from utils.misc import addError, addWarning
+from static_tables_hlir16 import is_static_table
 
 #[ #include "dataplane.h"
 #[ #include "actions.h"
@@ -22,7 +23,9 @@ from utils.misc import addError, addWarning
 #[ lookup_table_t table_config[NB_TABLES] = {
 for table in hlir16.tables:
     tmt = table.match_type if hasattr(table, 'key') else "none"
-    ks  = table.key_length_bytes if hasattr(table, 'key') else 0
+    # the tables with constant entries are looked up by generated code, no runtime table is created for them
+    ks  = hlir16.index.table_key_bytes[table.name] if hasattr(table, 'key') and not is_static_table(table) else 0
+    max_size = 0 if is_static_table(table) else 250000
     #[ {
     #[  .name= "${table.name}",
     #[  .id = TABLE_${table.name},
@@ -40,7 +43,7 @@ for table in hlir16.tables:
     #[  },
 
     #[  .min_size = 0,
-    #[  .max_size = 250000,
+    #[  .max_size = $max_size,
     #[ },
 #[ };
 
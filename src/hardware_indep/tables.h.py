@@ -12,6 +12,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from index_hlir16 import is_reversed_key
+from static_tables_hlir16 import is_static_table
+
 #[ #ifndef __TABLES_H__
 #[ #define __TABLES_H__
 
@@ -20,6 +23,25 @@
 
 #[ typedef bool entry_validity_t;
 
+#[ // the keys of the lookup tables start on this boundary, the hash function reads them in 8 byte units
+#[ #define TABLE_KEY_ALIGNMENT 8
+
+for t in hlir16.tables:
+    if not hasattr(t, 'key') or is_static_table(t):
+        continue
+
+    key_bytes = hlir16.index.table_key_bytes[t.name]
+    byte_order = "reverse byte order" if is_reversed_key(t) else "network byte order"
+    #[ // the key of table ${t.name}: $key_bytes bytes, the fields are in $byte_order
+    #{ typedef struct table_key_${t.name}_s {
+    for k, byte_idx, byte_width in sorted(hlir16.index.table_keys[t.name], key=lambda item: item[1]):
+        if byte_width == 0:
+            continue
+        #[     uint8_t ${hlir16.index.key_member_names[k.id]}[$byte_width];
+    if key_bytes == 0:
+        #[     uint8_t unused;
+    #} } __attribute__((aligned(TABLE_KEY_ALIGNMENT))) table_key_${t.name}_t;
+
 for t in hlir16.tables:
     #{ typedef struct table_entry_${t.name}_s {
     #[     struct ${t.name}_action  action;
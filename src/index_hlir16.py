@@ -0,0 +1,148 @@
+# Copyright 2018 Eotvos Lorand University, Budapest, Hungary
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#!/usr/bin/env python
+
+"""A symbol index of the HLIR, so that the templates and the code generator helpers
+do not have to scan the node lists for each lookup.
+
+The index is built once, after transform_hlir16, and it is stored as hlir16.index.
+Since it is a node itself, it is saved into the HLIR snapshot together with the HLIR.
+Its attributes are plain dictionaries:
+
+    declarations            name -> the first declaration with the name
+    declarations_by_type    (name, node_type) -> the first such declaration
+    control_locals          control name -> frozenset of the names of its local declarations
+    header_fields           header instance name -> list of (field, bit offset), in order
+    table_keys              table name -> key layout, see get_key_layout
+    key_member_names        key element id -> the name of its member in the key struct, see get_key_member_name
+    table_key_bytes         table name -> the length of the key layout in bytes;
+                            this is the key size of the lookup table
+"""
+
+from hlir16.p4node import P4Node, get_fresh_node_id
+
+
+def match_type_order(match_type):
+    """The order of the key elements in a table key."""
+    order = {'exact': 0, 'lpm': 1, 'ternary': 2}
+    return order.get(match_type.lower(), 3)
+
+
+def get_key_byte_width(k):
+    """Variable width fields are not supported; neither are special keys (e.g. isValid)."""
+    if k.get_attr('header') is None:
+        return 0
+
+    return (k.width+7)/8 if not k.header.type.type_ref.is_vw else 0
+
+
+def is_reversed_key(table):
+    """The LPM engine reads the key as a number in host byte order,
+    so the key of an LPM table is stored in reverse byte order:
+    its fields are placed from the end of the key, each with its bytes reversed."""
+    return table.get_attr('match_type') == 'LPM'
+
+
+def get_key_layout(table):
+    """The key elements of the table with their byte offsets and byte widths, as (key element, offset, width) tuples.
+    The elements are ordered by their match types (exact, lpm, ternary) and packed without padding;
+    the offsets are the positions of the fields in the stored key (see is_reversed_key).
+    Special keys (e.g. isValid) are left out.
+    Both the data plane and the control plane build the keys according to this layout."""
+    layout = []
+    if not hasattr(table, 'key'):
+        return layout
+
+    byte_idx = 0
+    keys = (k for k in table.key.keyElements if k.get_attr('match_type') is not None)
+    for k in sorted(keys, key=lambda k: match_type_order(k.match_type)):
+        if k.get_attr('header') is None:
+            continue
+
+        byte_width = get_key_byte_width(k)
+        layout.append((k, byte_idx, byte_width))
+        byte_idx += byte_width
+
+    if is_reversed_key(table):
+        layout = [(k, byte_idx - offset - byte_width, byte_width) for k, offset, byte_width in layout]
+
+    return layout
+
+
+def get_key_member_name(k, position):
+    """The name of the member of the generated key struct (table_key_*_t) that holds the key element.
+    The position of the element in the key keeps the names unique even if a field is used twice
+    or the underscores of the header and field names make two elements look alike."""
+    return "{}_{}_{}".format(k.header.name, k.field_name, position)
+
+
+def get_header_fields(hdr):
+    """The fields of the header instance with their bit offsets."""
+    fields = []
+    offset = 0
+    for fld in hdr.type.type_ref.fields:
+        fld_offset = fld.get_attr('offset')
+        fields.append((fld, fld_offset if fld_offset is not None else offset))
+        offset += fld.size if fld.get_attr('size') is not None else 0
+    return fields
+
+
+def build_index(hlir16):
+    declarations = {}
+    declarations_by_type = {}
+    control_locals = {}
+    for decl in hlir16.declarations:
+        name = decl.get_attr('name')
+        if name is None:
+            continue
+
+        declarations.setdefault(name, decl)
+        declarations_by_type.setdefault((name, decl.node_type), decl)
+
+        if decl.node_type == 'P4Control':
+            control_locals[name] = frozenset(cl.name for cl in decl.controlLocals if cl.get_attr('name') is not None)
+
+    header_fields = {}
+    for hdr in hlir16.header_instances:
+        header_fields[hdr.name] = get_header_fields(hdr)
+
+    table_keys = {}
+    table_key_bytes = {}
+    key_member_names = {}
+    for table in hlir16.tables:
+        table_keys[table.name] = get_key_layout(table)
+        table_key_bytes[table.name] = sum(width for _, _, width in table_keys[table.name])
+
+        if hasattr(table, 'key'):
+            for position, k in enumerate(table.key.keyElements):
+                if k.get_attr('header') is not None:
+                    key_member_names[k.id] = get_key_member_name(k, position)
+
+    return P4Node({
+        'id': get_fresh_node_id(),
+        'node_type': 'SymbolIndex',
+        'declarations': declarations,
+        'declarations_by_type': declarations_by_type,
+        'control_locals': control_locals,
+        'header_fields': header_fields,
+        'table_keys': table_keys,
+        'table_key_bytes': table_key_bytes,
+        'key_member_names': key_member_names,
+    })
+
+
+def index_hlir16(hlir16):
+    """Builds the index and stores it as hlir16.index."""
+    hlir16.index = build_index(hlir16)
+    return hlir16.index
@@ -0,0 +1,187 @@
+# Copyright 2018 Eotvos Lorand University, Budapest, Hungary
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#!/usr/bin/env python
+
+"""Sharing the key of consecutive table applications.
+
+If tables with the same key (the same fields with the same match types) are applied
+in consecutive statements of a block, and the actions of the earlier tables
+cannot modify the fields of the key, the key is calculated only once.
+
+The apply calls of such a group get a shared_key attribute:
+
+    name        the name of the local variable that holds the key
+    table       the table whose key calculation is used (the first one in the group)
+    is_first    True for the first apply call of the group, which calculates the key
+
+The tables in the groups are marked with uses_shared_key;
+they get an apply function that takes the key as a parameter.
+"""
+
+import collections
+
+from hlir16.p4node import P4Node, get_fresh_node_id
+from index_hlir16 import match_type_order
+from liveness_hlir16 import get_children, collect_references
+from static_tables_hlir16 import is_static_table
+
+
+def get_key_signature(table):
+    """The fields and match types of the key in the order of the key calculation,
+    or None if the key cannot be shared."""
+    if not hasattr(table, 'key') or is_static_table(table):
+        return None
+
+    signature = []
+    for k in sorted(table.key.keyElements, key=lambda k: match_type_order(k.match_type)):
+        if k.get_attr('header') is None or k.get_attr('width') is None:
+            return None
+        signature.append((k.header.name, k.field_name, k.width, k.match_type))
+
+    if signature == []:
+        return None
+
+    return (table.match_type, tuple(signature))
+
+
+def get_applied_table(stmt):
+    """The table if the statement is a plain table application (t.apply();), otherwise None."""
+    if stmt.get_attr('node_type') != 'MethodCallStatement':
+        return None
+
+    m = stmt.methodCall.method
+    if m.get_attr('member') != 'apply' or m.expr.get_attr('ref') is None or m.expr.ref.node_type != 'P4Table':
+        return None
+
+    return m.expr.ref
+
+
+def get_modified(action):
+    """The fields (header instance name, field name) and header instances that the action may modify,
+    or None if this cannot be determined."""
+    fields = set()
+    headers = set()
+
+    visited = set()
+    todo = collections.deque([action.body])
+    while todo:
+        node = todo.popleft()
+        if not isinstance(node, P4Node) or id(node) in visited:
+            continue
+        visited.add(id(node))
+
+        node_type = node.get_attr('node_type')
+        if node_type == 'AssignmentStatement':
+            dst = node.left
+            if dst.get_attr('field_ref') is not None and dst.expr.get_attr('header_ref') is not None:
+                fields.add((dst.expr.header_ref.name, dst.field_ref.name))
+            else:
+                dst_fields, dst_headers, unresolved = collect_references([dst])
+                if unresolved:
+                    return None
+                headers |= dst_headers
+        elif node_type == 'MethodCallExpression':
+            ref = node.method.get_attr('ref')
+            if ref is not None and ref.node_type in ('P4Action', 'Function'):
+                return None
+
+            # the headers used in the call (e.g. setInvalid, or an argument of an extern) may be modified
+            call_fields, call_headers, unresolved = collect_references([node.method] + list(node.arguments))
+            if unresolved:
+                return None
+            headers |= call_headers
+
+        todo.extend(get_children(node))
+
+    return fields, headers
+
+
+def keeps_key(table, signature):
+    """Whether none of the actions of the table can modify the fields of the key."""
+    for action in table.actions:
+        modified = get_modified(action.action_object)
+        if modified is None:
+            return False
+
+        fields, headers = modified
+        for hdr, fld, _, _ in signature[1]:
+            if (hdr, fld) in fields or hdr in headers:
+                return False
+
+    return True
+
+
+def find_groups(components):
+    """The groups of the consecutive table applications with the same key in the statements of a block,
+    as lists of (statement, table) pairs."""
+    groups = []
+    group = []
+    signature = None
+    for stmt in components:
+        table = get_applied_table(stmt)
+        table_signature = get_key_signature(table) if table is not None else None
+
+        if group != [] and table_signature is not None and table_signature == signature and keeps_key(group[-1][1], signature):
+            group.append((stmt, table))
+            continue
+
+        if len(group) > 1:
+            groups.append(group)
+        group = [(stmt, table)] if table_signature is not None else []
+        signature = table_signature
+
+    if len(group) > 1:
+        groups.append(group)
+
+    return groups
+
+
+def get_blocks(hlir16):
+    visited = set()
+    todo = collections.deque(c.body for c in hlir16.controls)
+    while todo:
+        node = todo.popleft()
+        if not isinstance(node, P4Node) or id(node) in visited:
+            continue
+        visited.add(id(node))
+
+        if node.get_attr('node_type') == 'BlockStatement':
+            yield node
+
+        todo.extend(get_children(node))
+
+
+def mark_shared_keys(hlir16):
+    """Marks the table applications that share their keys; returns the groups as lists of tables."""
+    groups = []
+    for block in get_blocks(hlir16):
+        for group in find_groups(block.components):
+            first_stmt, first_table = group[0]
+            # the same group of tables can be applied more than once in a block
+            name = "shared_key_{}_{}".format(first_table.name, get_fresh_node_id())
+            for idx, (stmt, table) in enumerate(group):
+                stmt.methodCall.shared_key = P4Node({'id' : get_fresh_node_id(),
+                                                     'node_type' : 'SharedKey',
+                                                     'name' : name,
+                                                     'table' : first_table,
+                                                     'is_first' : idx == 0,
+                                                     })
+                table.uses_shared_key = True
+            groups.append([table for _, table in group])
+
+    return groups
+
+
+def uses_shared_key(table):
+    return table.get_attr('uses_shared_key') is not None
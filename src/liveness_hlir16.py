@@ -0,0 +1,117 @@
+# Copyright 2018 Eotvos Lorand University, Budapest, Hungary
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#!/usr/bin/env python
+
+"""Dead header and dead field elimination.
+
+A header field is live if it is read or written anywhere in the program:
+in the controls (including the deparser), their actions and tables,
+in the parser (e.g. in select expressions), in table keys or in digests.
+A header instance is live if it or one of its fields is referenced.
+
+The results are stored in the HLIR as hlir16.live_fields, a set of
+(header instance name, field name) pairs, and hlir16.live_headers, a set of header instance names.
+The templates generate the per-field parts of the packet descriptor,
+the parser and update_packet only for the live fields.
+"""
+
+import collections
+
+from hlir16.p4node import P4Node
+
+# These declarations contain the code of the program.
+code_declarations = {'P4Control', 'P4Parser', 'P4Action', 'Method', 'Function'}
+
+# These attributes refer to other parts of the HLIR (types, declarations);
+# the references are resolved where they are used, so they are not followed.
+reference_attrs = {'ref', 'type_ref', 'header_ref', 'field_ref', 'type', 'action_object', 'destType', 'typeArguments'}
+
+
+def get_children(node):
+    if node.is_vec():
+        for elem in node.vec:
+            yield elem
+
+    for name, value in node.__dict__.items():
+        if name in reference_attrs or name == 'vec':
+            continue
+        if isinstance(value, P4Node):
+            yield value
+        elif type(value) in (list, tuple):
+            for elem in value:
+                yield elem
+
+
+def collect_references(roots):
+    """Returns the referenced fields (as header instance name and field name pairs),
+    the referenced header instances and the names of the fields that cannot be resolved to a header instance."""
+    fields = set()
+    headers = set()
+    unresolved_fields = set()
+
+    visited = set()
+    todo = collections.deque(roots)
+    while todo:
+        node = todo.popleft()
+        if not isinstance(node, P4Node) or id(node) in visited:
+            continue
+        visited.add(id(node))
+
+        if node.get_attr('node_type') == 'Member':
+            if node.get_attr('field_ref') is not None:
+                header_ref = node.expr.get_attr('header_ref')
+                if header_ref is not None:
+                    fields.add((header_ref.name, node.field_ref.name))
+                    headers.add(header_ref.name)
+                else:
+                    unresolved_fields.add(node.field_ref.name)
+            elif node.get_attr('header_ref') is not None:
+                headers.add(node.header_ref.name)
+            elif node.get_attr('member') is not None and node.expr.get_attr('header_ref') is None:
+                # e.g. a field of a header that is a local variable of the parser
+                unresolved_fields.add(node.member)
+
+        # table keys refer to the fields by name
+        if node.get_attr('field_name') is not None and node.get_attr('header') is not None:
+            fields.add((node.header.name, node.field_name))
+            headers.add(node.header.name)
+
+        todo.extend(get_children(node))
+
+    return fields, headers, unresolved_fields
+
+
+def mark_live_fields(hlir16):
+    roots = [decl for decl in hlir16.declarations if decl.get_attr('node_type') in code_declarations]
+    fields, headers, unresolved_fields = collect_references(roots)
+
+    # fields that are not resolved are considered live in all header instances
+    for hdr in hlir16.header_instances:
+        for fld in hdr.type.type_ref.fields:
+            if fld.name in unresolved_fields:
+                fields.add((hdr.name, fld.name))
+
+    hlir16.live_fields = fields
+    hlir16.live_headers = headers | {hdr for hdr, _ in fields}
+
+
+def is_live_field(hlir16, hdr, fld):
+    """Without the liveness information, all fields are live."""
+    live_fields = hlir16.get_attr('live_fields')
+    return live_fields is None or (hdr.name, fld.name) in live_fields
+
+
+def is_live_header(hlir16, hdr):
+    live_headers = hlir16.get_attr('live_headers')
+    return live_headers is None or hdr.name in live_headers
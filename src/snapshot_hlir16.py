@@ -0,0 +1,341 @@
+# Copyright 2018 Eotvos Lorand University, Budapest, Hungary
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#!/usr/bin/env python
+
+"""A flat, binary snapshot format for the HLIR.
+
+The file contains a table of interned strings and a table of nodes.
+Nodes refer to each other by their index in the node table,
+therefore neither saving nor loading is recursive on the node graph.
+
+    header:  magic, version, string count, node count,
+             offsets of the string index, the node index and the path index
+    strings: (u32 length, bytes) records
+    nodes:   encoded attribute dictionaries, see encode_value
+    indexes: u32 offsets of the strings and the nodes,
+             u32 string ids of the paths of the nodes (see deps_hlir16)
+
+The loaded file is memory mapped. Nodes are materialized lazily:
+a node is created empty, and its attributes are decoded
+when one of them is accessed for the first time.
+Containers (lists, dicts etc.) are stored by value;
+only nodes keep their identity.
+The paths of the nodes are saved as well, so that the dependencies of the templates
+can be checked and recorded without materializing the nodes.
+"""
+
+from __future__ import print_function
+
+import mmap
+import struct
+
+from hlir16.p4node import P4Node
+
+MAGIC = "T4HLIR16"
+VERSION = 2
+
+HEADER = struct.Struct("<8sIIIQQQ")
+U32 = struct.Struct("<I")
+I64 = struct.Struct("<q")
+F64 = struct.Struct("<d")
+
+# the path index entry of a node that has no path
+NO_PATH = 0xffffffff
+
+
+class SnapshotError(Exception):
+    pass
+
+
+################################################################################
+# Saving
+
+class SnapshotWriter(object):
+    def __init__(self):
+        self.strings = []
+        self.string_ids = {}
+        self.nodes = []
+        self.node_ids = {}
+
+    def string_id(self, txt):
+        if txt not in self.string_ids:
+            self.string_ids[txt] = len(self.strings)
+            self.strings.append(txt)
+        return self.string_ids[txt]
+
+    def node_id(self, node):
+        if id(node) not in self.node_ids:
+            self.node_ids[id(node)] = len(self.nodes)
+            self.nodes.append(node)
+        return self.node_ids[id(node)]
+
+    def encode_pickled(self, value, out):
+        import pickle
+        try:
+            import dill
+            dumped = dill.dumps(value, protocol=2)
+        except ImportError:
+            dumped = pickle.dumps(value, protocol=2)
+        out.append('p' + U32.pack(self.string_id(dumped)))
+
+    def encode_value(self, value, out):
+        """Appends the encoded value to `out`.
+        Nodes are only referenced by their index, so this is recursive on containers only."""
+        if value is None:
+            out.append('N')
+        elif value is True:
+            out.append('T')
+        elif value is False:
+            out.append('F')
+        elif type(value) is int and -2**63 <= value < 2**63:
+            out.append('i' + I64.pack(value))
+        elif type(value) in (int, long):
+            out.append('L' + U32.pack(self.string_id(str(value))))
+        elif type(value) is float:
+            out.append('f' + F64.pack(value))
+        elif type(value) is str:
+            out.append('s' + U32.pack(self.string_id(value)))
+        elif type(value) is unicode:
+            out.append('u' + U32.pack(self.string_id(value.encode('utf-8'))))
+        elif type(value) is P4Node:
+            out.append('n' + U32.pack(self.node_id(value)))
+        elif type(value) in (list, tuple, set, frozenset):
+            tags = {list: 'l', tuple: 't', set: 'S', frozenset: 'Z'}
+            out.append(tags[type(value)] + U32.pack(len(value)))
+            for elem in value:
+                self.encode_value(elem, out)
+        elif type(value) is dict:
+            out.append('d' + U32.pack(len(value)))
+            for key in value:
+                self.encode_value(key, out)
+                self.encode_value(value[key], out)
+        else:
+            self.encode_pickled(value, out)
+
+    def write(self, root, outf, paths):
+        self.node_id(root)
+
+        outf.write(HEADER.pack(MAGIC, VERSION, 0, 0, 0, 0, 0))
+        offset = HEADER.size
+
+        node_offsets = []
+        idx = 0
+        while idx < len(self.nodes):
+            out = []
+            self.encode_value(self.nodes[idx].__dict__, out)
+            data = "".join(out)
+
+            node_offsets.append(offset)
+            outf.write(data)
+            offset += len(data)
+            idx += 1
+
+        path_ids = []
+        for node in self.nodes:
+            path = paths.get(id(node))
+            path_ids.append(self.string_id(path) if path is not None else NO_PATH)
+
+        string_offsets = []
+        for txt in self.strings:
+            string_offsets.append(offset)
+            outf.write(U32.pack(len(txt)))
+            outf.write(txt)
+            offset += U32.size + len(txt)
+
+        string_index_offset = offset
+        outf.write("".join(U32.pack(o) for o in string_offsets))
+        node_index_offset = string_index_offset + U32.size * len(string_offsets)
+        outf.write("".join(U32.pack(o) for o in node_offsets))
+        path_index_offset = node_index_offset + U32.size * len(node_offsets)
+        outf.write("".join(U32.pack(path_id) for path_id in path_ids))
+
+        outf.seek(0)
+        outf.write(HEADER.pack(MAGIC, VERSION, len(self.strings), len(self.nodes), string_index_offset, node_index_offset, path_index_offset))
+
+
+def save_snapshot(root, filename, paths={}):
+    """Saves the node graph under `root` into the file.
+    The paths of the nodes are given by the ids of the nodes, see deps_hlir16.get_node_paths."""
+    with open(filename, 'wb') as outf:
+        SnapshotWriter().write(root, outf, paths)
+
+
+################################################################################
+# Loading
+
+class LazyP4Node(P4Node):
+    """A node whose attributes have not been decoded yet.
+    Upon first access, the node becomes a regular P4Node."""
+
+    def materialize(self):
+        attrs = object.__getattribute__(self, '__dict__')
+        snapshot, idx = attrs.pop('_snapshot_ref')
+        object.__setattr__(self, '__class__', P4Node)
+        attrs.update(snapshot.decode_node(idx))
+
+    def __getattribute__(self, name):
+        LazyP4Node.materialize(self)
+        return getattr(self, name)
+
+    def __setattr__(self, name, value):
+        LazyP4Node.materialize(self)
+        setattr(self, name, value)
+
+    def __delattr__(self, name):
+        LazyP4Node.materialize(self)
+        delattr(self, name)
+
+
+class Snapshot(object):
+    def __init__(self, filename):
+        with open(filename, 'rb') as inf:
+            self.data = mmap.mmap(inf.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self.data) < HEADER.size:
+            raise SnapshotError("truncated snapshot file {}".format(filename))
+
+        magic, version, string_count, node_count, self.string_index, self.node_index, self.path_index = HEADER.unpack_from(self.data, 0)
+        if (magic, version) != (MAGIC, VERSION):
+            raise SnapshotError("incompatible snapshot file {}".format(filename))
+
+        self.strings = [None] * string_count
+        self.nodes = [None] * node_count
+        # the indexes of the nodes created so far by the ids of the nodes
+        self.node_indexes = {}
+        # the indexes of the nodes by their paths, only read when a node is looked up by its path
+        self.path_nodes = None
+
+    def string(self, idx):
+        txt = self.strings[idx]
+        if txt is None:
+            offset, = U32.unpack_from(self.data, self.string_index + U32.size * idx)
+            length, = U32.unpack_from(self.data, offset)
+            txt = self.data[offset + U32.size : offset + U32.size + length]
+            self.strings[idx] = txt
+        return txt
+
+    def node(self, idx):
+        node = self.nodes[idx]
+        if node is None:
+            node = P4Node.__new__(LazyP4Node)
+            object.__setattr__(node, '__dict__', {'_snapshot_ref': (self, idx)})
+            self.nodes[idx] = node
+            self.node_indexes[id(node)] = idx
+        return node
+
+    def node_path(self, idx):
+        path_id, = U32.unpack_from(self.data, self.path_index + U32.size * idx)
+        return self.string(path_id) if path_id != NO_PATH else None
+
+    def get_path(self, node_id):
+        """The path of the node with the given id, or None if it has no path or it is not in the snapshot."""
+        idx = self.node_indexes.get(node_id)
+        return self.node_path(idx) if idx is not None else None
+
+    def get_node(self, path):
+        """The node with the given path, or None. Only the paths are read, the nodes are not materialized."""
+        if self.path_nodes is None:
+            self.path_nodes = {}
+            for idx in range(len(self.nodes)):
+                node_path = self.node_path(idx)
+                if node_path is not None:
+                    self.path_nodes[node_path] = idx
+
+        idx = self.path_nodes.get(path)
+        return self.node(idx) if idx is not None else None
+
+    def decode_node(self, idx):
+        offset, = U32.unpack_from(self.data, self.node_index + U32.size * idx)
+        attrs, _ = self.decode_value(offset)
+        return attrs
+
+    def decode_value(self, offset):
+        """Returns the decoded value at the offset and the offset after it."""
+        data = self.data
+        tag = data[offset]
+        offset += 1
+
+        if tag == 'N': return None, offset
+        if tag == 'T': return True, offset
+        if tag == 'F': return False, offset
+        if tag == 'i': return I64.unpack_from(data, offset)[0], offset + I64.size
+        if tag == 'f': return F64.unpack_from(data, offset)[0], offset + F64.size
+
+        idx, = U32.unpack_from(data, offset)
+        offset += U32.size
+
+        if tag == 'n': return self.node(idx), offset
+        if tag == 's': return self.string(idx), offset
+        if tag == 'u': return self.string(idx).decode('utf-8'), offset
+        if tag == 'L': return long(self.string(idx)), offset
+        if tag == 'p':
+            import pickle
+            try:
+                import dill
+            except ImportError:
+                pass
+            return pickle.loads(self.string(idx)), offset
+
+        if tag == 'd':
+            value = {}
+            for _ in range(idx):
+                key, offset = self.decode_value(offset)
+                value[key], offset = self.decode_value(offset)
+            return value, offset
+
+        if tag in 'ltSZ':
+            elems = []
+            for _ in range(idx):
+                elem, offset = self.decode_value(offset)
+                elems.append(elem)
+            containers = {'l': list, 't': tuple, 'S': set, 'Z': frozenset}
+            return (elems if tag == 'l' else containers[tag](elems)), offset
+
+        raise SnapshotError("unknown tag {} in snapshot".format(repr(tag)))
+
+
+class SnapshotPaths(object):
+    """The paths of the nodes of a snapshot, looked up by the ids of the nodes.
+    It can be used in place of the dictionary returned by deps_hlir16.get_node_paths."""
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+    def get(self, node_id, default=None):
+        path = self.snapshot.get_path(node_id)
+        return path if path is not None else default
+
+
+class SnapshotNodesByPath(object):
+    """The nodes of a snapshot, looked up by their paths.
+    It can be used in place of the dictionary returned by deps_hlir16.get_node_paths."""
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+    def get(self, path, default=None):
+        node = self.snapshot.get_node(path)
+        return node if node is not None else default
+
+
+def load_snapshot(filename):
+    """Returns the (lazily loaded) root node of the snapshot."""
+    return Snapshot(filename).node(0)
+
+
+def load_snapshot_with_paths(filename):
+    """Returns the (lazily loaded) root node of the snapshot,
+    the paths of its nodes and its nodes by their paths."""
+    snapshot = Snapshot(filename)
+    return snapshot.node(0), SnapshotPaths(snapshot), SnapshotNodesByPath(snapshot)
@@ -0,0 +1,200 @@
+# Copyright 2018 Eotvos Lorand University, Budapest, Hungary
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#!/usr/bin/env python
+
+"""Tables with constant entries (const entries in the P4 source) are looked up by generated code
+instead of the runtime lookup tables of the target.
+
+For such a table, table.static_lookup describes the lookup:
+
+    kind            'switch'    one exact key of at most 32 bits: a switch statement on its value
+                    'sorted'    exact keys only: binary search in the entries sorted by their keys
+                    'linear'    there are masked (ternary, lpm) or wildcard keys: the first matching entry is taken
+    key_elements    list of (key element, byte offset, byte width, kind); the kind is 'int32', 'bytebuf' or 'isValid'
+    key_bytes       the length of the key in bytes
+    entries         list of (key bytes, mask bytes, key value, action name, action parameters);
+                    the key value is the numeric value of the key (used by 'switch'),
+                    the action parameters are (parameter name, bytes) pairs
+    default         the default action as (action name, action parameters), or None
+
+The key is assembled in big endian byte order, in the order of the key elements in the P4 source.
+Tables that have a feature not supported here (e.g. range keys, non-constant action arguments)
+keep using the runtime lookup tables.
+"""
+
+from hlir16.p4node import P4Node, get_fresh_node_id
+from constfold_hlir16 import big_endian_bytes
+
+
+class NotStatic(Exception):
+    """The table cannot be looked up statically."""
+    pass
+
+
+def get_const_entries(table):
+    """The const entries of the table, or None if it has none."""
+    properties = table.get_attr('properties')
+    if properties is None:
+        return None
+
+    entries = properties.properties.get('entries')
+    if entries is None or not entries.get_attr('isConstant'):
+        return None
+
+    return list(entries.value.entries)
+
+
+def get_key_element_layout(table):
+    layout = []
+    byte_idx = 0
+    for k in table.key.keyElements:
+        if k.get_attr('header') is not None:
+            if k.width <= 32:
+                kind = 'int32'
+            elif k.width % 8 == 0:
+                kind = 'bytebuf'
+            else:
+                raise NotStatic()
+            byte_width = (k.width+7)/8
+        else:
+            expr = k.get_attr('expression')
+            if expr is None or expr.node_type != 'MethodCallExpression' or expr.method.get_attr('member') != 'isValid':
+                raise NotStatic()
+            kind = 'isValid'
+            byte_width = 1
+
+        layout.append((k, byte_idx, byte_width, kind))
+        byte_idx += byte_width
+
+    return layout
+
+
+def get_value(e):
+    if e.node_type == 'Constant':
+        return e.value
+    if e.node_type == 'BoolLiteral':
+        return 1 if e.value else 0
+    raise NotStatic()
+
+
+def get_keyset_bytes(keyset, bit_width, byte_width):
+    """The value and the mask of a keyset as big endian bytes, and whether the keyset matches exactly."""
+    full_mask = 2 ** bit_width - 1
+
+    if keyset.node_type == 'DefaultExpression':
+        value, mask = 0, 0
+    elif keyset.node_type == 'Mask':
+        value, mask = get_value(keyset.left), get_value(keyset.right)
+    else:
+        value, mask = get_value(keyset), full_mask
+
+    return big_endian_bytes(value & mask, byte_width), big_endian_bytes(mask, byte_width), mask & full_mask == full_mask
+
+
+def get_action_call(table, call):
+    """The name of the called action and its parameters as (parameter name, bytes) pairs."""
+    if call.node_type != 'MethodCallExpression' or call.method.get_attr('ref') is None:
+        raise NotStatic()
+
+    action_name = call.method.ref.name
+    if action_name not in [a.action_object.name for a in table.actions]:
+        raise NotStatic()
+
+    params = [p for p in call.method.ref.parameters.parameters if p.get_attr('direction') in (None, '', 'none')]
+    args = list(call.arguments) if call.get_attr('arguments') is not None else []
+    if len(args) != len(params):
+        raise NotStatic()
+
+    param_bytes = []
+    for p, arg in zip(params, args):
+        size = p.type.get_attr('size') or arg.type.get_attr('size')
+        if size is None:
+            raise NotStatic()
+        param_bytes.append((p.name, big_endian_bytes(get_value(arg), (size+7)/8)))
+
+    return action_name, param_bytes
+
+
+def get_static_lookup(table):
+    entries = get_const_entries(table)
+    if entries is None or not hasattr(table, 'key'):
+        return None
+
+    layout = get_key_element_layout(table)
+    key_bytes = sum(byte_width for _, _, byte_width, _ in layout)
+
+    static_entries = []
+    is_exact = True
+    for entry in entries:
+        keysets = entry.keys.components if entry.keys.node_type == 'ListExpression' else [entry.keys]
+        if len(keysets) != len(layout):
+            raise NotStatic()
+
+        key, mask = [], []
+        for keyset, (k, _, byte_width, kind) in zip(keysets, layout):
+            bit_width = 1 if kind == 'isValid' else k.width
+            value_bytes, mask_bytes, is_full_mask = get_keyset_bytes(keyset, bit_width, byte_width)
+            key += value_bytes
+            mask += mask_bytes
+            is_exact = is_exact and is_full_mask
+
+        key_value = reduce(lambda value, byte: value * 256 + byte, key, 0)
+        action_name, params = get_action_call(table, entry.action)
+        static_entries.append((tuple(key), tuple(mask), key_value, action_name, tuple(params)))
+
+    default = None
+    if table.get_attr('default_action') is not None:
+        default = get_action_call(table, table.default_action.expression)
+
+    if is_exact:
+        # the first one of the entries with the same key is matched
+        seen = set()
+        static_entries = [e for e in static_entries if e[0] not in seen and not seen.add(e[0])]
+
+    if is_exact and len(layout) == 1 and layout[0][3] != 'bytebuf':
+        kind = 'switch'
+    elif is_exact:
+        kind = 'sorted'
+        static_entries.sort(key=lambda e: e[0])
+    else:
+        kind = 'linear'
+
+    return P4Node({'id' : get_fresh_node_id(),
+                   'node_type' : 'StaticLookup',
+                   'kind' : kind,
+                   'key_elements' : layout,
+                   'key_bytes' : key_bytes,
+                   'entries' : static_entries,
+                   'default' : default,
+                   })
+
+
+def mark_static_tables(hlir16):
+    """Sets table.static_lookup for the tables that are looked up statically; returns these tables."""
+    static_tables = []
+    for table in hlir16.tables:
+        try:
+            static_lookup = get_static_lookup(table)
+        except NotStatic:
+            static_lookup = None
+
+        if static_lookup is not None:
+            table.static_lookup = static_lookup
+            static_tables.append(table)
+
+    return static_tables
+
+
+def is_static_table(table):
+    return table.get_attr('static_lookup') is not None
@@ -15,6 +15,7 @@
 
 from hlir16.p4node import P4Node, deep_copy, get_fresh_node_id
 from hlir16.hlir16_attrs import get_main
+from constfold_hlir16 import fold_constants
 
 def apply_annotations(postfix, extra_args, x):
     if (x.methodCall.method.node_type=="PathExpression") :
@@ -56,3 +57,5 @@ def transform_hlir16(hlir16):
         c = hlir16.declarations.get(pe.type.name, 'P4Control')
         if c is not None:
             c.body.components = map(search_for_annotations, c.body.components)
+
+    fold_constants(hlir16)
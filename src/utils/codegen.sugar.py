@@ -12,7 +12,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from utils.misc import addWarning, addError
+from utils.misc import addWarning, addError, errors, warnings
+from hlir16.p4node import P4Node
 
 ################################################################################
 
@@ -144,10 +145,98 @@ def statement_buffer_value():
     return ret
 
 
+################################################################################
+# Common subexpression elimination of packet field reads
+
+# Inside a FieldReadRegion: (header instance id, field id) -> the local variable
+# that holds the value of the field; None outside the regions.
+field_reads = None
+# Increased whenever field_reads changes.
+field_reads_version = 0
+
+class FieldReadRegion():
+    """Within the region (the body of a generated C function), a packet field is read
+    into a local variable the first time it is used, and the variable is reused
+    until the field may have changed."""
+    def __enter__(self):
+        set_field_reads({})
+
+    def __exit__(self, type, value, traceback):
+        set_field_reads(None)
+
+def set_field_reads(reads):
+    global field_reads
+    global field_reads_version
+    field_reads = reads
+    field_reads_version += 1
+
+def invalidate_field_reads(key=None):
+    """Forgets the read of the field (header instance id, field id), or all reads."""
+    if field_reads is None or field_reads == {}:
+        return
+    if key is None:
+        set_field_reads({})
+    elif key in field_reads:
+        set_field_reads({k: v for k, v in field_reads.items() if k != key})
+
+def field_read_key(e):
+    """The key of the field in field_reads, or None if the header instance is not known."""
+    header_ref = e.expr.get_attr('header_ref')
+    return (header_ref.id, e.field_ref.id) if header_ref is not None else None
+
+def read_field(e):
+    """Returns the local variable with the value of the field, reading it if necessary.
+    The variable is declared before the current statement."""
+    key = field_read_key(e)
+    if key in field_reads:
+        return field_reads[key]
+
+    var_name = generate_var_name("fld", e.expr.header_ref.name + "_" + e.field_ref.name)
+    if e.type.size > 32:
+        byte_size = (e.type.size + 7) / 8
+        prepend_statement("uint8_t {}[{}];\n".format(var_name, byte_size))
+        prepend_statement("EXTRACT_BYTEBUF_PACKET(pd, {}, {}, {});\n".format(key[0], key[1], var_name))
+    else:
+        prepend_statement("uint32_t {} = GET_INT32_AUTO_PACKET(pd, {}, {});\n".format(var_name, key[0], key[1]))
+
+    reads = dict(field_reads)
+    reads[key] = var_name
+    set_field_reads(reads)
+    return var_name
+
+def without_field_reads(compute):
+    """The fields that compute() reads are not moved before the current statement,
+    e.g. because they are read conditionally."""
+    reads = field_reads
+    set_field_reads(None)
+    try:
+        return compute()
+    finally:
+        set_field_reads(reads)
+
+def has_method_call(e):
+    """Whether evaluating the expression may modify the packet (e.g. table.apply().hit)."""
+    if not isinstance(e, P4Node):
+        return False
+    if e.get_attr('node_type') == 'MethodCallExpression':
+        return True
+    return any(has_method_call(e.get_attr(attr)) for attr in ('left', 'right', 'expr', 'e0', 'e1', 'e2'))
+
+################################################################################
+
+# The index of the HLIR (see index_hlir16.py), set by the compiler before each file.
+hlir_index = None
+
 def is_control_local_var(var_name):
     global enclosing_control
 
-    return enclosing_control is not None and [] != [cl for cl in enclosing_control.controlLocals if cl.name == var_name]
+    if enclosing_control is None:
+        return False
+
+    if hlir_index is not None and enclosing_control.name in hlir_index.control_locals:
+        return var_name in hlir_index.control_locals[enclosing_control.name]
+
+    return [] != [cl for cl in enclosing_control.controlLocals if cl.name == var_name]
 
 
 var_name_counter = 0
@@ -171,6 +260,30 @@ def generate_var_name(var_name_part = "var", var_id = None):
 
     return var_name
 
+
+def reset_state(index=None):
+    """Clears the state that is collected while generating a file."""
+    global hlir_index
+    global enclosing_control
+    global pre_statement_buffer
+    global post_statement_buffer
+    global var_name_counter
+
+    # these are imported by name in the templates, so they are cleared in place
+    type_env.clear()
+    generated_var_names.clear()
+    generated_exprs.clear()
+
+    enclosing_control = None
+    set_field_reads(None)
+    pre_statement_buffer = ""
+    post_statement_buffer = ""
+    var_name_counter = 0
+    hlir_index = index
+
+    # the cached results may refer to the state above
+    format_cache.clear()
+
 ################################################################################
 
 def int_to_big_endian_byte_array_with_length(value, width):
@@ -183,6 +296,13 @@ def int_to_big_endian_byte_array_with_length(value, width):
     padded_array = [0 for i in range(width-array_len)] + array[array_len-min(array_len, width) : array_len]
     return '{' + ', '.join([str(x) for x in padded_array]) + '}'
 
+def constant_byte_array(c, width):
+    """Uses the byte array that is precomputed by constant folding, if it is available."""
+    byte_array = c.get_attr('byte_array')
+    if byte_array is None or len(byte_array) != width:
+        return int_to_big_endian_byte_array_with_length(c.value, width)
+    return '{' + ', '.join([str(x) for x in byte_array]) + '}'
+
 
 def bit_bounding_unit(t):
     """The bit width of the smallest int that can contain the type,
@@ -218,7 +338,10 @@ def gen_format_statement(stmt):
 
             if dst_width <= 32:
                 src_buffer = 'value32'
-                if src.node_type == 'Member':
+                if src.node_type == 'Constant':
+                    # the constant is passed directly, there is no need for value32
+                    src_buffer = format_expr(src)
+                elif src.node_type == 'Member':
                     #[ $src_buffer = ${format_expr(src)};
                 elif src.node_type == 'PathExpression':
                     #[ memcpy(&$src_buffer, parameters.${src.ref.name}, $dst_bytewidth);
@@ -228,6 +351,7 @@ def gen_format_statement(stmt):
 
                 #[ // MODIFY_INT32_INT32_AUTO_PACKET(pd, $dst_header_id, $dst_field_id, $src_buffer)
                 #[ set_field((fldT[]){{pd, $dst_header_id, $dst_field_id}}, 0, $src_buffer, $dst_width);
+                invalidate_field_reads(field_read_key(dst))
 
                 if dst_field_id == 'field_standard_metadata_t_egress_port' and src.node_type == 'PathExpression':
                     #[ uint16_t egrp = EXTRACT_EGRESSPORT(pd);
@@ -254,7 +378,7 @@ def gen_format_statement(stmt):
                         src_pointer = 'parameters.{}'.format(src.ref.name)
                 elif src.node_type == 'Constant':
                     src_pointer = 'value_{}'.format(src.id)
-                    #[ uint8_t $src_pointer[$dst_bytewidth] = ${int_to_big_endian_byte_array_with_length(src.value, dst_bytewidth)};
+                    #[ static const uint8_t $src_pointer[$dst_bytewidth] = ${constant_byte_array(src, dst_bytewidth)};
                 else:
                     src_pointer = 'NOT_SUPPORTED'
                     addError('formatting statement', 'Unhandled right hand side in assignment statement: {}'.format(src))
@@ -265,11 +389,14 @@ def gen_format_statement(stmt):
                     #[ pd->headers[$dst_header_id].length = ($dst_fixed_size + pd->headers[$dst_header_id].var_width_field_bitwidth)/8;
 
                 #[ MODIFY_BYTEBUF_BYTEBUF_PACKET(pd, $dst_header_id, $dst_field_id, $src_pointer, $dst_bytewidth)
+                # the length of the header may have changed, too
+                invalidate_field_reads(None if dst_is_vw else field_read_key(dst))
         else:
             if dst.type.node_type == 'Type_Header':
                 #[ // TODO make it work properly for non-byte-aligned headers
                 #[ memcpy(pd->headers[header_instance_${dst.member}].pointer, pd->headers[header_instance_${src.member}].pointer, header_instance_byte_width[header_instance_${src.member}]);
                 #[ dbg_bytes(pd->headers[header_instance_${dst.member}].pointer, header_instance_byte_width[header_instance_${src.member}], "Copied %02d bytes from header_instance_${src.member} to header_instance_${dst.member}: ", header_instance_byte_width[header_instance_${src.member}]);
+                invalidate_field_reads()
             else:
                 #[ ${format_expr(dst)} = ${format_expr(src)};
 
@@ -277,9 +404,19 @@ def gen_format_statement(stmt):
         for c in stmt.components:
             #= format_statement(c)
     elif stmt.node_type == 'IfStatement':
+        # the condition is evaluated before the branches; a table application in it may modify the packet
+        cond_has_call = has_method_call(stmt.condition)
+        if cond_has_call:
+            invalidate_field_reads()
+        reads_before = field_reads
+
+        # the variables declared inside a branch are not visible outside of it
         t = format_statement(stmt.ifTrue) if hasattr(stmt, 'ifTrue') else ';'
+        set_field_reads(reads_before)
         f = format_statement(stmt.ifFalse) if hasattr(stmt, 'ifFalse') else ';'
-        cond = format_expr(stmt.condition)
+        set_field_reads(reads_before)
+        cond = without_field_reads(lambda: format_expr(stmt.condition)) if cond_has_call else format_expr(stmt.condition)
+        invalidate_field_reads()
 
         # TODO this happens when .hit() is called; make a proper solution
         if cond.strip() == '':
@@ -287,8 +424,9 @@ def gen_format_statement(stmt):
 
         #[ if( $cond ) {
         #[ $t
-        #[ } else {
-        #[ $f
+        if hasattr(stmt, 'ifFalse'):
+            #[ } else {
+            #[ $f
         #[ }
     elif stmt.node_type == 'MethodCallStatement':
         m = stmt.methodCall.method
@@ -305,11 +443,15 @@ def gen_format_statement(stmt):
 
             for idx, f in enumerate(fields.components):
                 if f.expr.type.is_metadata:
-                    #[ fields.field_offsets[$idx] = (uint8_t*) field_desc(pd, field_instance_${f.expr.name}_${f.member}).byte_addr;
-                    #[ fields.field_widths[$idx]  =            field_desc(pd, field_instance_${f.expr.name}_${f.member}).bitwidth;
+                    field_instance = 'field_instance_{}_{}'.format(f.expr.name, f.member)
                 else:
-                    #[ fields.field_offsets[$idx] = (uint8_t*) field_desc(pd, field_instance_${f.expr.member}_${f.field_ref.name}).byte_addr;
-                    #[ fields.field_widths[$idx]  =            field_desc(pd, field_instance_${f.expr.member}_${f.field_ref.name}).bitwidth;
+                    field_instance = 'field_instance_{}_{}'.format(f.expr.member, f.field_ref.name)
+
+                # the field descriptor is calculated once
+                fd = generate_var_name("digest_fd")
+                #[ field_reference_t $fd = field_desc(pd, $field_instance);
+                #[ fields.field_offsets[$idx] = (uint8_t*) $fd.byte_addr;
+                #[ fields.field_widths[$idx]  =            $fd.bitwidth;
             #[ generate_digest(bg,"${digest_name}",0,&fields);
             #[ sleep_millis(DIGEST_SLEEP_MILLIS);
         else:
@@ -381,13 +523,16 @@ def gen_format_statement(stmt):
             else:
                 #= gen_methodcall(stmt)
     elif stmt.node_type == 'SwitchStatement':
-        #[ switch(${format_expr(stmt.expression)}) {
+        invalidate_field_reads()
+        #[ switch(${without_field_reads(lambda: format_expr(stmt.expression))}) {
+        # no variables can be declared directly after the case labels
         for case in stmt.cases:
             #[ case ${format_expr(case.label)}:
-            #[   ${format_statement(case.statement)}
+            #[   ${without_field_reads(lambda: format_statement(case.statement))}
             #[   break;
         #[   default: {}
         #[ }
+        invalidate_field_reads()
 
 def gen_methodcall(stmt):
     mcall = format_expr(stmt.methodCall)
@@ -497,7 +642,15 @@ def gen_method_setInvalid(e):
         return "pd->headers[%s].pointer = NULL" % format_expr(e.method.expr)
 
 def gen_method_apply(e):
-    #[ ${e.method.expr.path.name}_apply(pd, tables, pstate)
+    shared_key = e.get_attr('shared_key')
+    if shared_key is None:
+        #[ ${e.method.expr.path.name}_apply(pd, tables, pstate)
+    else:
+        # the key is calculated before the first application of the group, see key_sharing_hlir16.py
+        if shared_key.is_first:
+            prepend_statement("table_key_{}_t {};\n".format(shared_key.table.name, shared_key.name))
+            prepend_statement("table_{}_key(pd, &{});\n".format(shared_key.table.name, shared_key.name))
+        #[ ${e.method.expr.path.name}_apply_with_key(pd, tables, pstate, (uint8_t*)&${shared_key.name})
 
 def gen_method_setValid(e):
     h = e.method.expr.header_ref
@@ -575,6 +728,10 @@ def gen_format_expr(e, format_as_value=True, expand_parameters=False):
     elif e.node_type in simple_binary_ops and e.node_type == 'Equ' and e.left.type.size > 32:
         return "0 == memcmp({}, {}, ({} + 7) / 8)".format(format_expr(e.left), format_expr(e.right), e.left.type.size)
 
+    # the right operand is evaluated conditionally, so its fields are not read in advance
+    elif e.node_type in ('LAnd', 'LOr'):
+        return '(' + format_expr(e.left) + simple_binary_ops[e.node_type] + without_field_reads(lambda: format_expr(e.right)) + ')'
+
     elif e.node_type in simple_binary_ops:
         return '(' + format_expr(e.left) + simple_binary_ops[e.node_type] + format_expr(e.right) + ')'
 
@@ -600,7 +757,7 @@ def gen_format_expr(e, format_as_value=True, expand_parameters=False):
                     return ''
 
     elif e.node_type == 'Mux':
-        return '(' + format_expr(e.e0) + '?' + format_expr(e.e1) + ':' + format_expr(e.e2) + ')'
+        return '(' + format_expr(e.e0) + '?' + without_field_reads(lambda: format_expr(e.e1)) + ':' + without_field_reads(lambda: format_expr(e.e2)) + ')'
 
     elif e.node_type == 'Slice':
         return '(' + format_type_mask(e.type) + '(' + format_expr(e.e0) + '>>' + format_expr(e.e2) + '))'
@@ -665,8 +822,8 @@ def gen_format_expr(e, format_as_value=True, expand_parameters=False):
                 if case_type == 'DefaultExpression':
                     conds.append('true /* default */')
                 elif case_type == 'Constant' and select_type == 'Type_Bits' and 32 < size and size % 8 == 0:
-                    byte_array = int_to_big_endian_byte_array_with_length(c.value, size/8)
-                    prepend_statement('uint8_t {}[{}] = {};'.format(gen_var_name(c), size/8, byte_array))
+                    byte_array = constant_byte_array(c, size/8)
+                    prepend_statement('static const uint8_t {}[{}] = {};'.format(gen_var_name(c), size/8, byte_array))
                     conds.append('memcmp({}, {}, {}) == 0'.format(gen_var_name(k), gen_var_name(c), size/8))
                 elif size <= 32:
                     if case_type == 'Range':
@@ -695,6 +852,8 @@ def gen_format_expr(e, format_as_value=True, expand_parameters=False):
         if hasattr(e, 'field_ref'):
             if format_as_value == False:
                 return fldid2(e.expr.header_ref, e.field_ref)
+            elif field_reads is not None:
+                return read_field(e)
             else:
                 if e.type.size > 32:
                     var_name = generate_var_name("hdr", str(e.expr.header_ref.id) + "__" + str(e.field_ref.id))
@@ -785,6 +944,60 @@ def gen_format_expr(e, format_as_value=True, expand_parameters=False):
 
 ################################################################################
 
+# The results of the formatting functions, keyed by the formatted node, the parameters
+# and the state that the result depends on.
+format_cache = {}
+format_cache_enabled = True
+
+# For each formatting function: the number of hits, misses and uncacheable calls.
+format_cache_stats = {}
+
+def side_effect_state():
+    """The state that changes if a call cannot be replayed from the cache:
+    new variable names, generated expressions and reported problems
+    (these have to be produced again by each call)."""
+    return (var_name_counter, len(generated_exprs), len(errors), len(warnings), field_reads_version)
+
+def format_cache_key(name, node, params):
+    env = frozenset(type_env.items()) if type_env != {} else None
+    return (name, id(node), params, env, id(enclosing_control), file_sugar_style[-1], file_indentation_level, field_reads_version)
+
+def memoized(name, node, params, compute):
+    """Returns compute(), which formats the node, from the cache if possible.
+    The statements that the call prepends or appends are recorded,
+    and they are added again when the result is taken from the cache."""
+    global pre_statement_buffer
+    global post_statement_buffer
+
+    if not format_cache_enabled:
+        return compute()
+
+    stats = format_cache_stats.setdefault(name, {'hits': 0, 'misses': 0, 'uncacheable': 0})
+
+    key = format_cache_key(name, node, params)
+    entry = format_cache.get(key)
+    if entry is not None:
+        stats['hits'] += 1
+        _, result, prepended, appended = entry
+        pre_statement_buffer += prepended
+        post_statement_buffer += appended
+        return result
+
+    state = side_effect_state()
+    pre_before, post_before = pre_statement_buffer, post_statement_buffer
+
+    result = compute()
+
+    buffers_extended = pre_statement_buffer.startswith(pre_before) and post_statement_buffer.startswith(post_before)
+    if not buffers_extended or side_effect_state() != state:
+        stats['uncacheable'] += 1
+        return result
+
+    stats['misses'] += 1
+    # the node is kept so that its id is not reused while the entry exists
+    format_cache[key] = (node, result, pre_statement_buffer[len(pre_before):], post_statement_buffer[len(post_before):])
+    return result
+
 def format_declaration(d, varname_override = None):
     global file_sugar_style
     with SugarStyle("no_comment"):
@@ -792,8 +1005,10 @@ def format_declaration(d, varname_override = None):
 
 def format_type(t, resolve_names = True):
     global file_sugar_style
-    with SugarStyle("inline_comment"):
-        return gen_format_type(t, resolve_names)
+    def compute():
+        with SugarStyle("inline_comment"):
+            return gen_format_type(t, resolve_names)
+    return memoized('format_type', t, resolve_names, compute)
 
 def format_method_parameters(ps, mt):
     global file_sugar_style
@@ -802,8 +1017,10 @@ def format_method_parameters(ps, mt):
 
 def format_expr(e, format_as_value=True, expand_parameters=False):
     global file_sugar_style
-    with SugarStyle("inline_comment"):
-        return gen_format_expr(e, format_as_value, expand_parameters)
+    def compute():
+        with SugarStyle("inline_comment"):
+            return gen_format_expr(e, format_as_value, expand_parameters)
+    return memoized('format_expr', e, (format_as_value, expand_parameters), compute)
 
 def format_statement(stmt):
     global pre_statement_buffer
@@ -811,13 +1028,24 @@ def format_statement(stmt):
     pre_statement_buffer = ""
     post_statement_buffer = ""
 
-    ret = gen_format_statement(stmt)
+    def compute():
+        global pre_statement_buffer
+        global post_statement_buffer
 
-    pre_statement_buffer_ret = pre_statement_buffer
-    pre_statement_buffer = ""
-    post_statement_buffer_ret = post_statement_buffer
-    post_statement_buffer = ""
-    return pre_statement_buffer_ret + ret + post_statement_buffer_ret
+        # method calls may modify the packet, and the fields are read in the order of evaluation around them
+        has_call = stmt.node_type == 'AssignmentStatement' and has_method_call(stmt.right)
+        ret = without_field_reads(lambda: gen_format_statement(stmt)) if has_call else gen_format_statement(stmt)
+        if has_call or stmt.node_type not in ('AssignmentStatement', 'BlockStatement', 'IfStatement', 'SwitchStatement'):
+            invalidate_field_reads()
+
+        pre_statement_buffer_ret = pre_statement_buffer
+        pre_statement_buffer = ""
+        post_statement_buffer_ret = post_statement_buffer
+        post_statement_buffer = ""
+        return pre_statement_buffer_ret + ret + post_statement_buffer_ret
+
+    # the buffers are empty both before and after the call
+    return memoized('format_statement', stmt, None, compute)
 
 def format_statement_ctl(stmt, ctl):
     global enclosing_control
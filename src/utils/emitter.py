@@ -0,0 +1,134 @@
+# Copyright 2018 Eotvos Lorand University, Budapest, Hungary
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# Collecting the generated code (not using HLIR)
+
+import hashlib
+import os
+import re
+import tempfile
+
+
+class CodeBuffer(object):
+    """Collects the code generated by a gen_ function.
+    The desugared code appends to it with +=, which takes constant time."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def __iadd__(self, text):
+        self.chunks.append(text)
+        return self
+
+    def text(self):
+        return "".join(self.chunks)
+
+
+class FileEmitter(object):
+    """Collects the code generated by a template and streams it into a temporary file
+    next to the output file.
+    If an optimizer is given (see utils/postopt.py), the code is fed to it while streaming,
+    and the optimized code of the finished top level blocks is written.
+    Runs of three or more newlines are collapsed into two while streaming.
+    When the emitter is closed, the output file is replaced atomically,
+    but only if its contents have changed."""
+
+    def __init__(self, filename, flush_size=64 * 1024, optimizer=None):
+        self.filename = filename
+        self.flush_size = flush_size
+        self.optimizer = optimizer
+
+        self.chunks = []
+        self.chunks_size = 0
+
+        # the number of consecutive newlines at the end of the input so far
+        self.newline_run = 0
+        self.digest = hashlib.sha1()
+
+        dirname = os.path.dirname(filename) or '.'
+        fd, self.tmpname = tempfile.mkstemp(dir=dirname, prefix='.' + os.path.basename(filename) + '.')
+        self.outf = os.fdopen(fd, "w")
+
+    def __iadd__(self, text):
+        self.chunks.append(text)
+        self.chunks_size += len(text)
+        if self.chunks_size >= self.flush_size:
+            self.flush()
+        return self
+
+    def flush(self):
+        text = "".join(self.chunks)
+        self.chunks = []
+        self.chunks_size = 0
+
+        if self.optimizer is not None:
+            text = self.optimizer.feed(text)
+        self.write_collapsed(text)
+
+    def write_collapsed(self, text):
+        """Writes the text with its runs of newlines collapsed,
+        including the runs that span the texts written one after the other."""
+        if text == "":
+            return
+
+        body = text.lstrip('\n')
+        run = self.newline_run + len(text) - len(body)
+        out = '\n' * (min(run, 2) - min(self.newline_run, 2))
+
+        if body == "":
+            self.newline_run = run
+        else:
+            stripped_body = body.rstrip('\n')
+            self.newline_run = len(body) - len(stripped_body)
+            out += re.sub(r'\n{3,}', '\n\n', stripped_body) + '\n' * min(self.newline_run, 2)
+
+        self.write(out)
+
+    def write(self, out):
+        self.digest.update(out)
+        self.outf.write(out)
+
+    def hexdigest(self):
+        """The SHA-1 digest of the output; only valid after closing."""
+        return self.digest.hexdigest()
+
+    def close(self):
+        """Finishes the output file."""
+        self.flush()
+        if self.optimizer is not None:
+            self.write_collapsed(self.optimizer.finish())
+        self.outf.close()
+
+        if file_has_digest(self.filename, self.hexdigest()):
+            os.remove(self.tmpname)
+            return
+
+        os.chmod(self.tmpname, 0o644)
+        os.rename(self.tmpname, self.filename)
+
+    def discard(self):
+        """Leaves the output file as it was."""
+        self.outf.close()
+        os.remove(self.tmpname)
+
+
+def file_digest(filename):
+    digest = hashlib.sha1()
+    with open(filename, "rb") as infile:
+        for block in iter(lambda: infile.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_has_digest(filename, hexdigest):
+    return os.path.isfile(filename) and file_digest(filename) == hexdigest
@@ -0,0 +1,351 @@
+# Copyright 2018 Eotvos Lorand University, Budapest, Hungary
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# Optimizing the generated C code (not using HLIR)
+
+"""The generated code is split into lines, and each line into its code and its comments.
+The generated code has (mostly) one statement per line;
+the transformations below only change lines whose code is a single statement they recognize,
+the other lines are kept as they are.
+
+- The temporaries (value32, res32, mask32) that are not used in a function are not declared.
+- The lookups in constant tables (e.g. header_instance_byte_width[header_instance_ipv4])
+  are replaced by their values.
+- Adjacent memcpy calls that copy consecutive bytes are merged.
+- Statements without effect (;, memcpy of 0 bytes, x = x;) are removed.
+
+A statement after a line that does not end in ;, { or } may be the unbraced body
+of an if, else, for or while on that line; such statements are neither merged nor removed.
+
+The code is optimized while it is generated: it is fed to the optimizer in parts,
+and each top level block (e.g. function) is optimized as soon as it is finished.
+If the code cannot be split (e.g. a comment spans lines, or the braces are not balanced),
+the rest of it is left unchanged.
+"""
+
+import re
+
+# The temporaries declared by the templates for the macros of the target.
+temporaries = ('value32', 'res32', 'mask32')
+
+# These macros of the target assume that value32 and res32 are in scope.
+implicit_temporaries_re = re.compile(r'\bMODIFY_\w+')
+
+token_re = re.compile(r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|//.*|/\*.*?\*/')
+string_re = re.compile(r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'')
+identifier_re = re.compile(r'[A-Za-z_]\w*')
+
+temporaries_decl_re = re.compile(r'^uint32_t\s+(\w+(?:\s*,\s*\w+)*)\s*;$')
+temporaries_void_re = re.compile(r'^\(void\)\s*\w+(?:\s*[,;]\s*\(void\)\s*\w+)*\s*;$')
+memcpy_re = re.compile(r'^memcpy\((.*)\);$')
+offset_re = re.compile(r'^(.*?)\s*\+\s*(\d+)$')
+self_assignment_re = re.compile(r'^([A-Za-z_]\w*(?:(?:\.|->)[A-Za-z_]\w*)*)\s*=\s*([A-Za-z_]\w*(?:(?:\.|->)[A-Za-z_]\w*)*)\s*;$')
+
+
+class CannotOptimize(Exception):
+    pass
+
+
+def starts_statement(prev_code):
+    """Whether a statement after the given code line is unconditional,
+    i.e. it is not the unbraced body of an if, else, for or while on the line above."""
+    return prev_code is None or prev_code[-1] in ';{}'
+
+
+class Line(object):
+    """A line of the generated code: its indentation, its code and its comments."""
+
+    def __init__(self, text):
+        self.text = text
+        self.indent = text[:len(text) - len(text.lstrip())]
+
+        code = []
+        self.comments = []
+        pos = 0
+        for m in token_re.finditer(text):
+            if m.group().startswith('/'):
+                code.append(text[pos:m.start()])
+                self.comments.append(m.group())
+                pos = m.end()
+        code.append(text[pos:])
+        self.code = "".join(code).strip()
+
+        if '/*' in string_re.sub('""', self.code):
+            raise CannotOptimize()
+
+        self.removed = False
+
+    def is_preprocessor(self):
+        return self.code.startswith('#')
+
+    def brace_balance(self):
+        if self.is_preprocessor():
+            return 0
+        code = string_re.sub('""', self.code)
+        return code.count('{') - code.count('}')
+
+    def set_code(self, code):
+        self.code = code
+        self.text = self.indent + " ".join([code] + self.comments)
+
+    def remove(self):
+        """The comments of the line are kept."""
+        self.removed = True
+        self.text = self.indent + " ".join(self.comments) if self.comments != [] else None
+
+
+def split_args(args):
+    """The arguments of a call, split at the top level commas."""
+    parts = []
+    depth = 0
+    start = 0
+    for idx, char in enumerate(args):
+        if char in '([{':
+            depth += 1
+        elif char in ')]}':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            parts.append(args[start:idx].strip())
+            start = idx + 1
+    parts.append(args[start:].strip())
+    return parts
+
+
+class PostOptimizer(object):
+    def __init__(self, constant_tables):
+        """The constant tables are given as table name -> {index -> value}."""
+        self.constant_tables = constant_tables
+        self.stats = {
+            'removed temporaries': 0,
+            'folded table lookups': 0,
+            'merged memcpys': 0,
+            'removed no-op statements': 0,
+            'bytes before': 0,
+            'bytes after': 0,
+        }
+
+        # the last line fed so far, if it is not finished yet
+        self.partial_line = ''
+        # the lines of the top level block that is not finished yet
+        self.block = []
+        self.depth = 0
+        # set when the code cannot be split; the rest of the code is passed through unchanged
+        self.is_passthrough = False
+
+        if constant_tables != {}:
+            names = "|".join(re.escape(name) for name in sorted(constant_tables))
+            self.table_lookup_re = re.compile(r'\b(' + names + r')\[\s*(\w+)\s*\]')
+        else:
+            self.table_lookup_re = None
+
+    def feed(self, text):
+        """Takes the next part of the code.
+        Returns the optimized code of the top level blocks that are finished by it."""
+        text_lines = (self.partial_line + text).split('\n')
+        self.partial_line = text_lines.pop()
+
+        out = []
+        for text_line in text_lines:
+            self.add_line(text_line, out)
+        return self.get_output(text, out)
+
+    def finish(self):
+        """Returns the rest of the code, optimized if its blocks are finished."""
+        out = []
+        is_last_line_partial = self.partial_line != ''
+        if is_last_line_partial:
+            self.add_line(self.partial_line, out)
+            self.partial_line = ''
+
+        # the braces of the last block are not balanced
+        out.extend(line.text for line in self.block)
+        self.block = []
+        return self.get_output('', out, is_last_line_partial)
+
+    def optimize(self, text):
+        """Optimizes the whole code at once."""
+        return self.feed(text) + self.finish()
+
+    def add_line(self, text_line, out):
+        if self.is_passthrough:
+            out.append(text_line)
+            return
+
+        try:
+            line = Line(text_line)
+        except CannotOptimize:
+            self.pass_through(out)
+            out.append(text_line)
+            return
+
+        self.block.append(line)
+        self.depth += line.brace_balance()
+        if self.depth < 0:
+            self.pass_through(out)
+        elif self.depth == 0:
+            self.optimize_block(self.block)
+            out.extend(line.text for line in self.block if line.text is not None)
+            self.block = []
+
+    def pass_through(self, out):
+        out.extend(line.text for line in self.block)
+        self.block = []
+        self.is_passthrough = True
+
+    def get_output(self, text, out, is_last_line_partial=False):
+        optimized = "".join(text_line + '\n' for text_line in out)
+        if is_last_line_partial:
+            optimized = optimized[:-1]
+        self.stats['bytes before'] += len(text)
+        self.stats['bytes after'] += len(optimized)
+        return optimized
+
+    def optimize_block(self, block):
+        self.fold_table_lookups(block)
+        self.remove_noops(block)
+        self.merge_memcpys(block)
+        self.remove_unused_temporaries(block)
+
+    def fold_table_lookups(self, block):
+        if self.table_lookup_re is None:
+            return
+
+        def fold(m):
+            value = self.constant_tables[m.group(1)].get(m.group(2))
+            if value is None:
+                return m.group()
+            self.stats['folded table lookups'] += 1
+            return str(value)
+
+        for line in block:
+            if line.is_preprocessor() or not self.table_lookup_re.search(line.code):
+                continue
+
+            # the contents of the string literals are kept
+            parts = []
+            pos = 0
+            for m in string_re.finditer(line.code):
+                parts.append(self.table_lookup_re.sub(fold, line.code[pos:m.start()]))
+                parts.append(m.group())
+                pos = m.end()
+            parts.append(self.table_lookup_re.sub(fold, line.code[pos:]))
+            line.set_code("".join(parts))
+
+    def remove_noops(self, block):
+        prev_code = None
+        for line in block:
+            if line.code == '':
+                continue
+
+            is_noop = False
+            if line.code == ';':
+                # ; can be the body of an if, else, for, while or a label
+                is_noop = prev_code is not None and starts_statement(prev_code)
+            else:
+                m = memcpy_re.match(line.code)
+                if m:
+                    args = split_args(m.group(1))
+                    is_noop = len(args) == 3 and args[2] == '0'
+                m = self_assignment_re.match(line.code)
+                if m:
+                    is_noop = m.group(1) == m.group(2)
+                # the statement may be the body of the line above
+                is_noop = is_noop and starts_statement(prev_code)
+
+            if is_noop:
+                line.remove()
+                self.stats['removed no-op statements'] += 1
+            else:
+                prev_code = line.code
+
+    def merge_memcpys(self, block):
+        def parse_memcpy(line):
+            m = memcpy_re.match(line.code)
+            if not m:
+                return None
+            args = split_args(m.group(1))
+            if len(args) != 3 or not args[2].isdigit():
+                return None
+
+            def base_and_offset(arg):
+                m = offset_re.match(arg)
+                return (m.group(1), int(m.group(2))) if m else (arg, 0)
+
+            dst, src = base_and_offset(args[0]), base_and_offset(args[1])
+            if dst[0] == src[0]:
+                return None
+            return dst, src, int(args[2])
+
+        prev = None
+        prev_code = None
+        for line in block:
+            if line.removed or line.code == '':
+                continue
+
+            copy = parse_memcpy(line)
+            # a memcpy that is the unbraced body of the line above is conditional
+            if copy is not None and not starts_statement(prev_code):
+                copy = None
+            if not line.is_preprocessor():
+                prev_code = line.code
+            if copy is not None and prev is not None:
+                prev_line, ((dst, dst_offset), (src, src_offset), size) = prev
+                (dst2, dst_offset2), (src2, src_offset2), size2 = copy
+                if (dst, src) == (dst2, src2) and (dst_offset2, src_offset2) == (dst_offset + size, src_offset + size):
+                    merged_size = size + size2
+                    args = ["{} + {}".format(base, offset) if offset != 0 else base for base, offset in ((dst, dst_offset), (src, src_offset))]
+                    prev_line.set_code("memcpy({}, {}, {});".format(args[0], args[1], merged_size))
+                    line.remove()
+                    self.stats['merged memcpys'] += 1
+                    prev = (prev_line, ((dst, dst_offset), (src, src_offset), merged_size))
+                    continue
+
+            prev = (line, copy) if copy is not None else None
+
+    def remove_unused_temporaries(self, block):
+        decl_lines = []
+        void_lines = []
+        used = set()
+        for line in block:
+            if line.removed:
+                continue
+
+            m = temporaries_decl_re.match(line.code)
+            if m and all(name.strip() in temporaries for name in m.group(1).split(',')):
+                decl_lines.append(line)
+                continue
+            if temporaries_void_re.match(line.code) and all(name in temporaries for name in re.findall(r'\(void\)\s*(\w+)', line.code)):
+                void_lines.append(line)
+                continue
+
+            used.update(identifier_re.findall(line.code))
+            if implicit_temporaries_re.search(line.code):
+                used.update(('value32', 'res32'))
+
+        for line in decl_lines:
+            names = [name.strip() for name in temporaries_decl_re.match(line.code).group(1).split(',')]
+            kept = [name for name in names if name in used]
+            self.stats['removed temporaries'] += len(names) - len(kept)
+            if kept == []:
+                line.remove()
+            elif kept != names:
+                line.set_code("uint32_t {};".format(", ".join(kept)))
+
+        for line in void_lines:
+            names = re.findall(r'\(void\)\s*(\w+)', line.code)
+            kept = [name for name in names if name in used]
+            if kept == []:
+                line.remove()
+            elif kept != names:
+                separator = "; " if ';' in line.code[:-1] else ", "
+                line.set_code(separator.join("(void){}".format(name) for name in kept) + ";")
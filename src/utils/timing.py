@@ -0,0 +1,166 @@
+# Copyright 2018 Eotvos Lorand University, Budapest, Hungary
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# Timing and memory usage of the phases of the compiler (not using HLIR)
+
+from __future__ import print_function
+
+import os
+import resource
+import time
+from contextlib import contextmanager
+
+enabled = False
+cprofile_dir = None
+
+# The measured phases in the order they were started.
+records = []
+
+# The phases that are currently running, innermost last.
+open_phases = []
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+def enable(profile_cprofile_dir=None):
+    """Turns on the measurements.
+    If the directory is given, a cProfile dump is saved there for each template."""
+    global enabled, cprofile_dir
+    enabled = True
+    cprofile_dir = profile_cprofile_dir
+
+    if tracemalloc is not None and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def cpu_time():
+    """The CPU time of the process, including its finished child processes (e.g. p4c)."""
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def traced_memory():
+    """Returns the currently allocated and the peak memory since the last reset (in bytes).
+    Without tracemalloc, the maximum resident set size is used for both."""
+    if tracemalloc is None:
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        return maxrss, maxrss
+    return tracemalloc.get_traced_memory()
+
+
+def reset_peak():
+    if tracemalloc is not None and hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+
+
+@contextmanager
+def phase(name):
+    """Measures the wall time, CPU time and peak memory of the enclosed block.
+    Phases can be nested."""
+    if not enabled:
+        yield
+        return
+
+    if open_phases != []:
+        parent = open_phases[-1]
+        parent['peak'] = max(parent['peak'], traced_memory()[1])
+    reset_peak()
+
+    current, _ = traced_memory()
+    record = {
+        'name': name,
+        'depth': len(open_phases),
+        'pid': os.getpid(),
+        'wall': time.time(),
+        'cpu': cpu_time(),
+        'start_mem': current,
+        'peak': current,
+    }
+    records.append(record)
+    open_phases.append(record)
+
+    try:
+        yield
+    finally:
+        open_phases.pop()
+
+        record['wall'] = time.time() - record['wall']
+        record['cpu'] = cpu_time() - record['cpu']
+        record['peak'] = max(record['peak'], traced_memory()[1])
+        record['mem'] = record['peak'] - record['start_mem']
+
+        if open_phases != []:
+            parent = open_phases[-1]
+            parent['peak'] = max(parent['peak'], record['peak'])
+
+
+@contextmanager
+def cprofile(name):
+    """Saves the cProfile statistics of the enclosed block as <name>.prof,
+    if the cProfile dumps are turned on."""
+    if not enabled or cprofile_dir is None:
+        yield
+        return
+
+    import cProfile
+
+    if not os.path.isdir(cprofile_dir):
+        try:
+            os.makedirs(cprofile_dir)
+        except OSError:
+            # another process may have created it meanwhile
+            pass
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(os.path.join(cprofile_dir, name + ".prof"))
+
+
+def get_report():
+    """The finished records without the internal bookkeeping."""
+    keys = ['name', 'depth', 'pid', 'wall', 'cpu', 'mem', 'peak']
+    return [{k: r[k] for k in keys} for r in records if 'mem' in r]
+
+
+def format_report(report):
+    memory_kind = "peak mem" if tracemalloc is not None else "max RSS"
+    lines = ["{:<48} {:>10} {:>10} {:>12}".format("phase", "wall (s)", "CPU (s)", memory_kind + " (kB)")]
+    for r in report:
+        name = "  " * r['depth'] + r['name']
+        lines.append("{:<48} {:>10.3f} {:>10.3f} {:>12}".format(name, r['wall'], r['cpu'], r['mem'] // 1024 if tracemalloc is not None else r['peak'] // 1024))
+    return "\n".join(lines)
+
+
+def save_report(report, filename):
+    import json
+
+    dirname = os.path.dirname(filename)
+    if dirname and not os.path.isdir(dirname):
+        os.makedirs(dirname)
+
+    memory_kind = "tracemalloc" if tracemalloc is not None else "maxrss"
+    with open(filename, "w") as outf:
+        json.dump({'memory': memory_kind, 'phases': report}, outf, indent=4, sort_keys=True)
@@ -467,11 +467,16 @@ if [ "$(optvalue p4)" != off ]; then
     addopt p4opts "--p4v ${OPTS[vsn]}" " "
     addopt p4opts "-g ${T4P4S_SRCGEN_DIR}" " "
     [ "$(optvalue verbose)" != off ] && addopt p4opts "-verbose" " "
+    [ "$(optvalue jobs)" == on ] && addopt p4opts "-j 0" " "
+    [ "$(optvalue jobs)" != off ] && [ "$(optvalue jobs)" != on ] && addopt p4opts "-j ${OPTS[jobs]}" " "
+    [ "$(optvalue incremental)" != off ] && addopt p4opts "-incremental" " "
+    [ "$(optvalue profile)" != off ] && addopt p4opts "-profile" " "
+    [ "$(optvalue profile)" == templates ] && addopt p4opts "-profile_templates" " "
 
     verbosemsg "P4 compiler options: $(print_cmd_opts "${OPTS[p4opts]}")"
 
     IFS=" "
-    $PYTHON -B src/compiler.py ${OPTS[p4opts]}
+    $PYTHON -B src/compiler_client.py ${OPTS[p4opts]}
     exit_on_error "P4 to C compilation failed"
 fi
 